@@ -0,0 +1,6 @@
+#?attr ENGINE
+
+"""
+Benchmarks for the engine.
+Run them from the src folder, for example: python -m benchmarks.protocol_benchmark
+"""
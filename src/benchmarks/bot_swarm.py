@@ -0,0 +1,262 @@
+#?attr ENGINE
+
+"""
+Headless load generator. It spawns simulated clients in one process, which log in or register, join the level, walk, jump and mine,
+and reports server TPS, traffic per client and update latency, which is time from pressing a movement key until a snapshot shows the character moving.
+Bots are added in steps, so it shows at which player count the server falls below min_tps.
+Usage (from the src folder): python -m benchmarks.bot_swarm [bots] [--step N] [--duration S] [--address A] [--port P] [--async]
+Without address, the game server is started in a separate process on port 5555 from the project folder, like run.py does, so its TPS can be measured.
+Bot accounts stay in its user database, so next runs log in.
+"""
+
+from engine.core.async_network import AsyncClientNetwork
+from engine.core.network import ClientNetwork
+from engine.datatypes import *
+
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+
+
+PASSWORD = "bot"
+LOCAL_PORT = 5555
+# number of complete snapshots after a key press, in which the character has to start moving, otherwise it is blocked by terrain and the press isn't measured
+PRESS_TIMEOUT_SNAPSHOTS = 10
+
+
+
+class Bot:
+    """ Simulated client. It plays through the network only, without engine and renderer. """
+
+    def __init__(self, index: int, network):
+        self.name = f"bot_{index}"
+        self.network = network
+        self.state = "login"
+        self.net_id = 0
+        self.position = None
+        self.last_move_time = 0
+        self.direction = 0
+        self.next_action_time = 0
+        self.press_time = 0 # time of the movement key press, which wasn't seen in a snapshot yet
+        self.press_snapshots = 0 # complete snapshots received since the press
+        self.latencies = []
+        self.__partial_snapshots = {}
+
+
+    def start(self):
+        """ Logs in. If the account doesn't exist, the bot registers. """
+        self.network.send("login", (self.name, PASSWORD))
+        self.network.tick()
+
+
+    def tick(self, now: float):
+        """ Handles received data, presses keys and sends everything. """
+        for cmd, data in self.network.get_data(10000):
+            match cmd:
+                case "register_outcome":
+                    self.__on_register_outcome(data)
+                case "register_actor":
+                    if data[1] == f"__Player_{self.network.id}":
+                        self.net_id = data[3]
+                        self.position = data[2]
+                case "snapshot":
+                    self.__on_snapshot(data, now)
+
+        if self.state == "playing" and self.position is not None:
+            self.__play(now)
+        self.network.tick()
+
+
+    def __on_register_outcome(self, outcome):
+        if outcome > 0:
+            self.state = "playing"
+            self.network.send("join_level", "Overworld")
+            self.network.send("update_distance", 6)
+            self.network.send("key_down", Keys.MOUSE_LEFT)
+        elif self.state == "login":
+            self.state = "register"
+            self.network.send("register", (self.name, PASSWORD))
+        else:
+            self.state = "failed"
+
+
+    def __on_snapshot(self, data, now):
+        sequence, index, count, entries = data
+        for net_id, sync_data in entries:
+            if net_id != self.net_id or "position" not in sync_data:
+                continue
+            position = Vector(*sync_data["position"])
+            if abs(position.x - self.position.x) > KINDA_SMALL_NUMBER:
+                if self.press_time and (position.x - self.position.x) * self.direction > 0:
+                    self.latencies.append(now - self.press_time)
+                    self.press_time = 0
+                self.last_move_time = now
+            self.position = position
+
+        received = self.__partial_snapshots[sequence] = self.__partial_snapshots.get(sequence, 0) + 1
+        if received >= count:
+            del self.__partial_snapshots[sequence]
+            self.network.send("snapshot_ack", [sequence, []], True)
+            if self.press_time:
+                self.press_snapshots += 1
+                if self.press_snapshots > PRESS_TIMEOUT_SNAPSHOTS:
+                    # the latency would measure mining through the terrain instead of updates
+                    self.press_time = 0
+        while len(self.__partial_snapshots) > 64:
+            del self.__partial_snapshots[next(iter(self.__partial_snapshots))]
+
+
+    def __play(self, now):
+        # walk for a while, then stand, so the next key press starts from rest and its latency can be measured
+        if now >= self.next_action_time:
+            if self.direction:
+                self.network.send("key_up", Keys.D if self.direction > 0 else Keys.A)
+                self.direction = 0
+                self.press_time = 0
+                self.next_action_time = now + random.uniform(0.5, 1)
+            else:
+                self.direction = random.choice((-1, 1))
+                self.network.send("key_down", Keys.D if self.direction > 0 else Keys.A)
+                if now - self.last_move_time > 0.3:
+                    self.press_time = now
+                    self.press_snapshots = 0
+                if random.random() < 0.2:
+                    self.network.send("key_down", Keys.W)
+                    self.network.send("key_up", Keys.W)
+                self.next_action_time = now + random.uniform(1, 3)
+
+        # mine the block in front of the feet
+        self.network.send("world_mouse_pos", self.position + Vector(self.direction or 1, -1), True)
+
+
+
+def run_server(max_connections: int, ticks, min_tps, ready, stop, verbose: bool):
+    """ Runs the game server in a separate process and counts its ticks. """
+    # server expects resources relative to the project folder
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    if not verbose:
+        sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    from game.server_game import ServerGame
+    game = ServerGame()
+    game.engine.network.max_connections = max_connections
+    min_tps.value = game.engine.min_tps
+    ready.set()
+
+    while not stop.is_set():
+        game.tick()
+        ticks.value += 1
+
+    game.engine.stop()
+
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bot swarm load generator.")
+    parser.add_argument("bots", type=int, nargs="?", default=20, help="Maximum number of bots.")
+    parser.add_argument("--step", type=int, default=0, help="Bots added in each step. Default adds all at once.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of each step.")
+    parser.add_argument("--rate", type=float, default=60, help="Bot ticks per second.")
+    parser.add_argument("--address", default=None, help="Address of a running server. If not set, a local server is started.")
+    parser.add_argument("--port", type=int, default=LOCAL_PORT, help="UDP port of the running server.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use AsyncClientNetwork on one shared event loop instead of threads per bot.")
+    parser.add_argument("--verbose", action="store_true", help="Show engine logs.")
+    args = parser.parse_args()
+
+    step = args.step or args.bots
+    out = sys.stdout
+    report = lambda *values: print(*values, file=out, flush=True)
+
+    server = None
+    ticks = multiprocessing.RawValue("Q", 0)
+    min_tps = multiprocessing.RawValue("d", 0)
+    stop = multiprocessing.Event()
+    address, port = args.address, args.port
+    if address is None:
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=run_server, args=(args.bots + 1, ticks, min_tps, ready, stop, args.verbose), daemon=True)
+        server.start()
+        ready.wait()
+        address, port = "127.0.0.1", LOCAL_PORT
+
+    loop = asyncio.new_event_loop() if args.use_async else None
+    bots = []
+    frame_time = 1 / args.rate
+
+    report(f"{'bots':>5}{'playing':>8}{'tps':>8}{'min tps':>8}{'in KB/s':>9}{'out KB/s':>9}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'bot fps':>8}")
+    with contextlib.redirect_stdout(out if args.verbose else open(os.devnull, "w")):
+        while len(bots) < args.bots:
+            for index in range(len(bots), min(len(bots) + step, args.bots)):
+                network = AsyncClientNetwork(address, port, loop=loop) if loop else ClientNetwork(address, port)
+                bot = Bot(index, network)
+                bot.start()
+                bots.append(bot)
+
+            for bot in bots:
+                bot.latencies.clear()
+            bytes_received = sum(bot.network.bytes_received for bot in bots)
+            bytes_sent = sum(bot.network.bytes_sent for bot in bots)
+            tps_samples = []
+            frames = 0
+
+            start = time.time()
+            second_start, second_ticks = start, ticks.value
+            while time.time() - start < args.duration:
+                frame_start = time.time()
+                for bot in bots:
+                    bot.tick(frame_start)
+                frames += 1
+
+                if frame_start - second_start >= 1:
+                    tps_samples.append((ticks.value - second_ticks) / (frame_start - second_start))
+                    second_start, second_ticks = frame_start, ticks.value
+
+                remaining = frame_time - (time.time() - frame_start)
+                if loop:
+                    bots[0].network.drive(max(remaining, 0))
+                elif remaining > 0:
+                    time.sleep(remaining)
+
+            elapsed = time.time() - start
+            latencies = [latency * 1000 for bot in bots for latency in bot.latencies]
+            received_per_client = (sum(bot.network.bytes_received for bot in bots) - bytes_received) / elapsed / len(bots) / 1024
+            sent_per_client = (sum(bot.network.bytes_sent for bot in bots) - bytes_sent) / elapsed / len(bots) / 1024
+            tps = sum(tps_samples) / len(tps_samples) if server and tps_samples else float("nan")
+            lowest_tps = min(tps_samples) if server and tps_samples else float("nan")
+            playing = sum(bot.state == "playing" for bot in bots)
+
+            report(f"{len(bots):>5}{playing:>8}{tps:>8.1f}{lowest_tps:>8.1f}{received_per_client:>9.2f}{sent_per_client:>9.2f}"
+                   f"{percentile(latencies, 0.5):>8.1f}{percentile(latencies, 0.95):>8.1f}{percentile(latencies, 0.99):>8.1f}{frames / elapsed:>8.1f}")
+
+            if server and tps < min_tps.value:
+                report(f"Server TPS fell below min_tps ({min_tps.value}) with {len(bots)} bots.")
+                break
+
+            if frames / elapsed < args.rate * 0.8:
+                report("Bots can't keep up with the tick rate, results are limited by the load generator.")
+
+        for bot in bots:
+            bot.network.stop()
+
+        if server:
+            stop.set()
+            server.join(5)
+
+
+
+if __name__ == "__main__":
+    main()
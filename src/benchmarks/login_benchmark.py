@@ -0,0 +1,87 @@
+#?attr ENGINE
+
+"""
+Benchmark of the login pipeline. It simulates a login storm after a server restart: users are registered and then all of them log in at once.
+Logins are checked by the worker pool of the user database, while the main thread keeps ticking like the server network does,
+so the report shows login throughput and the longest stall of the ticking thread. Inline row checks logins directly in the ticking thread.
+Usage (from the src folder): python -m benchmarks.login_benchmark [--users N] [--workers 1,2,4,8] [--iterations N]
+"""
+
+from engine.core.network import UserDatabase
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+
+
+TICK_TIME = 0.001
+
+
+
+def storm(database: UserDatabase, users: int, request: str) -> tuple:
+    """
+    Submits requests of all users at once and ticks, until all of them are handled.
+    Returns:
+        tuple[float, float, int] - Handled requests per second, longest tick in seconds and number of successful requests.
+    """
+    start = time.perf_counter()
+    futures = [database.submit(request, (f"user_{index}", f"password_{index}"), ("benchmark", index)) for index in range(users)]
+
+    longest_tick = 0
+    last_tick = time.perf_counter()
+    while not all(future.done() for future in futures):
+        time.sleep(TICK_TIME)
+        now = time.perf_counter()
+        longest_tick = max(longest_tick, now - last_tick)
+        last_tick = now
+
+    elapsed = time.perf_counter() - start
+    return users / elapsed, longest_tick, sum(future.result() > 0 for future in futures)
+
+
+
+def inline(database: UserDatabase, users: int, request: str) -> tuple:
+    """ Same as storm, but requests are handled in the ticking thread, one per tick. """
+    start = time.perf_counter()
+    longest_tick = 0
+    successful = 0
+    for index in range(users):
+        tick_start = time.perf_counter()
+        successful += database.handle_login(request, (f"user_{index}", f"password_{index}"), ("benchmark", index)) > 0
+        time.sleep(TICK_TIME)
+        longest_tick = max(longest_tick, time.perf_counter() - tick_start)
+
+    elapsed = time.perf_counter() - start
+    return users / elapsed, longest_tick, successful
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput benchmark.")
+    parser.add_argument("--users", type=int, default=200, help="Number of users, which register and log in.")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma separated numbers of workers to measure.")
+    parser.add_argument("--iterations", type=int, default=100_000, help="PBKDF2 iterations of password hashes.")
+    args = parser.parse_args()
+
+    print(f"CPU count: {os.cpu_count()}, users: {args.users}, hash iterations: {args.iterations}")
+    print(f"{'workers':>8}{'register/s':>12}{'login/s':>10}{'longest tick ms':>17}{'ok':>6}")
+
+    runs = [("inline", 1)] + [(int(workers), int(workers)) for workers in args.workers.split(",")]
+    for name, workers in runs:
+        with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+            database = UserDatabase(os.path.join(folder, "users.db"), workers, args.iterations)
+            run = inline if name == "inline" else storm
+            register_rate, _, _ = run(database, args.users, "register")
+            login_rate, longest_tick, successful = run(database, args.users, "login")
+            database.close()
+
+        print(f"{name:>8}{register_rate:>12.1f}{login_rate:>10.1f}{longest_tick * 1000:>17.1f}{successful:>6}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#?attr ENGINE
+
+"""
+Tick level benchmark of the game server with bots connected through the loopback network, so no sockets, threads or sleeps are used.
+Server and bots are ticked in one loop on a manual clock, which advances by exactly one server tick, so the run is as fast as the server can tick,
+and simulated network conditions, world generation and snapshot timing are the same in every run with the same seed. Only tick times, which are measured in wall time, differ.
+It reports wall time of a server tick, traffic per client and update latency in simulated time.
+Usage (from the src folder): python -m benchmarks.loopback_benchmark [bots] [--ticks N] [--latency MS] [--jitter MS] [--loss FRACTION] [--seed S]
+"""
+
+from .bot_swarm import Bot, percentile
+from engine.core.loopback_network import *
+
+import argparse
+import contextlib
+import functools
+import os
+import random
+import sys
+import time
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback network benchmark of the game server.")
+    parser.add_argument("bots", type=int, nargs="?", default=20, help="Number of bots.")
+    parser.add_argument("--ticks", type=int, default=1200, help="Number of measured server ticks.")
+    parser.add_argument("--warmup", type=int, default=240, help="Number of server ticks before measuring, while bots log in.")
+    parser.add_argument("--latency", type=float, default=0, help="One way latency in milliseconds.")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximum random delay in milliseconds, which is added to the latency.")
+    parser.add_argument("--loss", type=float, default=0, help="Probability between 0 and 1, that a datagram is lost.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the world, bots and link model.")
+    parser.add_argument("--verbose", action="store_true", help="Show engine logs.")
+    args = parser.parse_args()
+
+    # iteration order of sets of strings depends on the hash seed, which is random in every process, so it is fixed before anything is hashed
+    if os.environ.get("PYTHONHASHSEED") != str(args.seed):
+        os.environ["PYTHONHASHSEED"] = str(args.seed)
+        sys.stdout.flush()
+        os.execv(sys.executable, sys.orig_argv)
+
+    out = sys.stdout
+    report = lambda *values: print(*values, file=out, flush=True)
+
+    # server expects resources relative to the project folder
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    random.seed(args.seed)
+    clock = ManualClock()
+    link_model = LinkModel(args.latency / 1000, args.jitter / 1000, args.loss, args.seed)
+
+    devnull = open(os.devnull, "w")
+    with contextlib.redirect_stdout(out if args.verbose else devnull), contextlib.redirect_stderr(sys.stderr if args.verbose else devnull):
+        from game.server_game import ServerGame
+        game = ServerGame(functools.partial(LoopbackServerNetwork, link_model=link_model, clock=clock))
+        game.engine.clock = clock
+        game.engine.network.max_connections = args.bots + 1
+
+        bots = [Bot(index, LoopbackClientNetwork("0.0.0.0", 5555)) for index in range(args.bots)]
+        for bot in bots:
+            bot.start()
+
+        tick_times = []
+        for tick in range(args.warmup + args.ticks):
+            if tick == args.warmup:
+                for bot in bots:
+                    bot.latencies.clear()
+                bytes_received = sum(bot.network.bytes_received for bot in bots)
+                bytes_sent = sum(bot.network.bytes_sent for bot in bots)
+                start_time = clock.time()
+
+            # chunks are generated by threads, so they are waited for to appear on the same tick in every run
+            game.world_generator.wait_for_chunks()
+            tick_start = time.perf_counter()
+            game.tick()
+            tick_times.append(time.perf_counter() - tick_start)
+
+            for bot in bots:
+                bot.tick(clock.time())
+
+        elapsed = clock.time() - start_time
+        tick_times = [tick_time * 1000 for tick_time in tick_times[args.warmup:]]
+        latencies = [latency * 1000 for bot in bots for latency in bot.latencies]
+        channels = game.engine.network.udp_channels.values()
+        lost = sum(channel.lost for channel in channels) + sum(bot.network.udp_channel.lost for bot in bots)
+        received = sum(channel.received for channel in channels) + sum(bot.network.udp_channel.received for bot in bots)
+        playing = sum(bot.state == "playing" for bot in bots)
+
+        for bot in bots:
+            bot.network.stop()
+        game.engine.stop()
+
+    report(f"{'bots':>5}{'playing':>8}{'tick ms':>9}{'p95 ms':>8}{'max tps':>9}{'in KB/s':>9}{'out KB/s':>9}{'lat p50':>9}{'lat p95':>9}{'lost':>7}")
+    report(f"{len(bots):>5}{playing:>8}{sum(tick_times) / len(tick_times):>9.2f}{percentile(tick_times, 0.95):>8.2f}{1000 * len(tick_times) / sum(tick_times):>9.1f}"
+           f"{(sum(bot.network.bytes_received for bot in bots) - bytes_received) / elapsed / len(bots) / 1024:>9.2f}"
+           f"{(sum(bot.network.bytes_sent for bot in bots) - bytes_sent) / elapsed / len(bots) / 1024:>9.2f}"
+           f"{percentile(latencies, 0.5):>9.1f}{percentile(latencies, 0.95):>9.1f}{lost / max(lost + received, 1):>7.1%}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#?attr ENGINE
+
+"""
+Compares size and speed of the network codecs on typical game messages.
+Usage (from the src folder): python -m benchmarks.protocol_benchmark [iterations]
+"""
+
+from engine.core.protocol import *
+from engine.core.tiles import pack_tiles
+from engine.datatypes import *
+
+import sys
+import time
+
+
+
+MESSAGES = {
+    "update_actor": ("update_actor", ("__Player_12", {"position": Vector(-5.25, 28.125)})),
+    "snapshot (8 actors)": ("snapshot", [1, 0, 1, [(net_id, {"position": Vector(-5.25 + net_id, 28.125)}) for net_id in range(100, 108)]]),
+    "register_actor": ("register_actor", ["GrassBlock", "grass_block_-12_16", Vector(-12, 16), 1234]),
+    "register_chunk (64 tiles)": ("register_chunk", pack_tiles([["Dirt" if y > -4 else "Stone", f"{'dirt' if y > -4 else 'stone'}_{float(x)}_{float(y)}", Vector(x, y), 1000 + x * 8 - y] for x in range(8) for y in range(-8, 0)])[0]),
+    "destroy_actor": ("destroy_actor", "dirt_12_-3"),
+    "world_mouse_pos": ("world_mouse_pos", Vector(12.5, -3.75)),
+    "key_down": ("key_down", Keys.A),
+    "play_sound": ("play_sound", ("res/sounds/pick_up.mp3", Vector(1, 2), 4, 0.5)),
+    "update_inventory": ("update_inventory", ({"Rock": 3, "Wood": 5}, ["Rock", "Wood", None, None, None, None, None, None, "Furnace", "Anvil"])),
+}
+
+
+
+def measure(codec: Codec, cmd: str, data, iterations: int):
+    """
+    Returns:
+        tuple[float, float, float] - Bytes per message in a batch of `iterations` messages, microseconds per encode and microseconds per decode.
+    """
+    start = time.perf_counter()
+    records = [codec.encode(cmd, data) for _ in range(iterations)]
+    batch = codec.pack(records)
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = codec.decode(batch)
+    decode_time = time.perf_counter() - start
+
+    if len(decoded) != iterations:
+        raise RuntimeError(f"{codec.name} decoded {len(decoded)} of {iterations} {cmd} messages")
+
+    return (
+        (len(batch) - codec.batch_overhead) / iterations,
+        encode_time / iterations * 1e6,
+        decode_time / iterations * 1e6,
+    )
+
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    json_codec = CODECS[JsonCodec.name]
+    binary_codec = CODECS[BinaryCodec.name]
+
+    print(f"{'message':<26}{'json B':>9}{'bin B':>9}{'json enc us':>13}{'bin enc us':>12}{'json dec us':>13}{'bin dec us':>12}")
+    for name, (cmd, data) in MESSAGES.items():
+        json_size, json_enc, json_dec = measure(json_codec, cmd, data, iterations)
+        bin_size, bin_enc, bin_dec = measure(binary_codec, cmd, data, iterations)
+        print(f"{name:<26}{json_size:>9.1f}{bin_size:>9.1f}{json_enc:>13.2f}{bin_enc:>12.2f}{json_dec:>13.2f}{bin_dec:>12.2f}")
+
+
+
+if __name__ == "__main__":
+    main()
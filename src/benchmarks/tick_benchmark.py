@@ -0,0 +1,78 @@
+#?attr ENGINE
+
+"""
+Benchmark of the level tick against the number of static blocks. Blocks don't override tick, so the level doesn't call it,
+while a few rigidbodies are simulated as usual. Tick all row enables tick of every block, which shows the cost of calling tick for the whole world.
+Usage (from the src folder): python -m benchmarks.tick_benchmark [--blocks 1000,10000,50000] [--rigidbodies N] [--ticks N]
+"""
+
+from engine.components.actors.actor import Actor
+from engine.components.actors.character import Character
+from engine.components.actors.rigidbody import Rigidbody
+from engine.components.level import Level
+from engine.components.material import Material
+from engine.datatypes import *
+
+import argparse
+import contextlib
+import io
+import time
+
+
+
+class Block(Actor):
+    def __init__(self, name, position):
+        super().__init__(name, position, material=Material(Color(120, 80, 40)))
+
+
+
+def build_level(engine, name: str, blocks: int, rigidbodies: int) -> Level:
+    """ Returns a level with a flat ground of blocks, which is 64 blocks wide, and rigidbodies falling on it. """
+    level = Level(name, Character)
+    engine.register_level(level)
+    level.register_actor([Block(f"block_{index}", Vector(index % 64, -(index // 64))) for index in range(blocks)])
+    level.register_actor([Rigidbody(f"rigidbody_{index}", Vector(index % 64, 2 + index // 64), material=Material(Color(200, 200, 200))) for index in range(rigidbodies)])
+    level.get_new_actors()
+    return level
+
+
+def measure(level: Level, ticks: int) -> float:
+    """ Returns average milliseconds per level tick. """
+    start = time.perf_counter()
+    for _ in range(ticks):
+        level.tick(1 / 60)
+    return (time.perf_counter() - start) / ticks * 1000
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Level tick cost against block count.")
+    parser.add_argument("--blocks", default="1000,10000,50000", help="Comma separated numbers of blocks to measure.")
+    parser.add_argument("--rigidbodies", type=int, default=20, help="Number of simulated rigidbodies.")
+    parser.add_argument("--ticks", type=int, default=100, help="Number of measured ticks.")
+    args = parser.parse_args()
+
+    # engine starts a console, which reads stdin
+    with contextlib.redirect_stderr(io.StringIO()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            from engine.core.engine import ServerEngine
+            engine = ServerEngine()
+
+        print(f"{'blocks':>8}{'tickable':>10}{'registry ms':>13}{'tick all ms':>13}")
+        for blocks in (int(blocks) for blocks in args.blocks.split(",")):
+            level = build_level(engine, f"Registry_{blocks}", blocks, args.rigidbodies)
+            tickable = len(level.tickable_actors)
+            registry_time = measure(level, args.ticks)
+
+            for actor in list(level.actors.values()):
+                actor.tick_enabled = True
+            all_time = measure(level, args.ticks)
+
+            print(f"{blocks:>8}{tickable:>10}{registry_time:>13.3f}{all_time:>13.3f}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.stop()
+
+
+if __name__ == "__main__":
+    main()
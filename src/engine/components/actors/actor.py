@@ -38,6 +38,7 @@ class Actor:
 
         self.__engine_ref = None
         self.__level_ref = None
+        self.net_id = 0
         self.name = name
         self.half_size = half_size
         self.position = position.copy
@@ -49,6 +50,10 @@ class Actor:
         self.render_layer = render_layer
 
         self.previously_collided = set()
+        #?ifdef SERVER
+        # static actors, which don't override tick, cost nothing per tick
+        self.__tick_enabled = type(self).tick is not Actor.tick
+        #?endif
 
         for k in self.__outdated:
             self.__outdated[k] = False
@@ -97,6 +102,20 @@ class Actor:
             raise TypeError("Name must be a string:", value)
 
 
+    @property
+    def net_id(self):
+        """ int - Handle, which identifies the actor in network messages instead of its name. It is assigned by the level on the server. 0 means, that it wasn't assigned yet. """
+        return self.__net_id
+    
+
+    @net_id.setter
+    def net_id(self, value):
+        if isinstance(value, int) and value >= 0:
+            self.__net_id = value
+        else:
+            raise TypeError("Net id must be a non-negative integer:", value)
+
+
     @property
     def half_size(self):
         """ Vector - Half size of the actor. This is used to scale material and collision box. """
@@ -107,7 +126,7 @@ class Actor:
     def half_size(self, value):
         if isinstance(value, Vector) and value.x > 0 and value.y > 0:
             self.__half_size = value
-            self.__outdated["half_size"] = True
+            self.__set_outdated("half_size")
         else:
             raise TypeError("Half size must be a Vector:", value)
         
@@ -122,7 +141,7 @@ class Actor:
     def position(self, value):
         if isinstance(value, Vector):
             self.__position = value
-            self.__outdated["position"] = True
+            self.__set_outdated("position")
         else:
             raise TypeError("Position must be a Vector:", value)
         
@@ -167,7 +186,7 @@ class Actor:
             if not self.material and value:
                 raise ValueError("Material must be set to use visible:", value)
             self.__visible = value
-            self.__outdated["visible"] = True
+            self.__set_outdated("visible")
         else:
             raise TypeError("Visible must be a bool:", value)
         
@@ -182,7 +201,7 @@ class Actor:
     def material(self, value):
         if isinstance(value, Material) or value == None:
             self.__material = value
-            self.__outdated["material"] = True
+            self.__set_outdated("material")
         else:
             raise TypeError("Material name must be a string or None:", value)
         
@@ -215,6 +234,14 @@ class Actor:
             raise TypeError("Restitution must be a float between 0 and 1:", value)
         
 
+    def __set_outdated(self, key):
+        self.__outdated[key] = True
+        #?ifdef SERVER
+        if self.__level_ref is not None:
+            self.__level_ref.mark_dirty(self)
+        #?endif
+
+
     #?ifdef CLIENT
     def update_from_net_sync(self, data):
         """ Called only by the engine. This function is used to update the actor from the network sync data. """
@@ -225,7 +252,7 @@ class Actor:
                 case "position":
                     self.position = Vector(*data[key])
                 case "material":
-                    self.material = Material(data[key])
+                    self.material = Material(data[key]) if data[key] else None
     #?endif
     
 
@@ -243,17 +270,35 @@ class Actor:
             if self.__outdated[key]:
                 if key == "material":
                     out[key] = self.material.texture_str if self.material else None
-                out[key] = getattr(self, key)
+                else:
+                    out[key] = getattr(self, key)
                 self.__outdated[key] = False
 
         return out
-        
+
+
+    def get_net_sync_values(self, keys):
+        """
+        Called only by the engine. Unlike get_for_net_sync, it returns current values of the keys even if they didn't change and doesn't reset outdated flags.
+        Args:
+            keys: Iterable of sync data keys, e.g. "position".
+        Returns:
+            dict - Sync data with the given keys.
+        """
+        out = {}
+        for key in keys:
+            if key == "material":
+                out[key] = self.material.texture_str if self.material else None
+            else:
+                out[key] = getattr(self, key)
+        return out
+
 
     def get_for_full_net_sync(self):
         """
         Returns the all data of the actor to register it on the client.
         Returns:
-            list[str, str, Vector] - List of all data of the actor. First element is the class name, second is the name of the actor, third is the position of the actor.
+            list[str, str, Vector, int] - List of all data of the actor. First element is the class name, second is the name of the actor, third is the position of the actor and fourth is its net id.
         """
         for key in self.__outdated:
             self.__outdated[key] = False
@@ -261,12 +306,29 @@ class Actor:
             self.__class__.__name__,
             self.name,
             self.position,
+            self.net_id,
         ]
 
 
+    @property
+    def tick_enabled(self):
+        """ bool - Whether the level calls tick of the actor. By default it is True only for actors, whose class overrides tick. It can be changed at any time. """
+        return self.__tick_enabled
+
+
+    @tick_enabled.setter
+    def tick_enabled(self, value):
+        if isinstance(value, bool):
+            self.__tick_enabled = value
+            if self.__level_ref is not None:
+                self.__level_ref.update_tickable(self)
+        else:
+            raise TypeError("Tick enabled must be a bool:", value)
+
+
     def tick(self, delta_time: float):
         """
-        It is called every engine tick.
+        It is called every engine tick, while tick_enabled is True and the actor's chunk is simulated.
         Args:
             delta_time: Time since the last tick in engine.
         """
@@ -203,31 +203,33 @@ class Rigidbody(Actor):
                 self.velocity.x -= v_change * self.velocity.x / self.velocity.abs.x
 
 
-    def is_colliding(self, collided_actor: Actor):
+    def is_colliding(self, collided_actor: Actor, margin: float = 0):
         """
         Checks if the object is colliding with another object.
         Args:
             collided_actor: The actor to check for collision with.
+            margin: Added to the half size of the object, so touching objects can be detected as colliding.
         Returns:
             bool - Whether the object is colliding with the other object or not.
             list[float] - List of distances to the collided side. The order is right, left, top, bottom.
         """
-        distances = self.get_edge_distances(collided_actor)
+        distances = self.get_edge_distances(collided_actor, margin)
         return (
             all(d > 0 for d in distances),
             distances
         )
 
 
-    def collision_response_direction(self, collided_actor: Actor):
+    def collision_response_direction(self, collided_actor: Actor, margin: float = 0):
         """
         Calculates the direction to push the object away from the collided object.
         Args:
             collided_actor: The actor to check for collision with.
+            margin: Added to the half size of the object, so touching objects can be detected as colliding.
         Returns:
             Vector - Direction to push the object away from the collided object.
         """
-        is_colliding, distances = self.is_colliding(collided_actor)
+        is_colliding, distances = self.is_colliding(collided_actor, margin)
         if not is_colliding:
             return Vector(0, 0)
 
@@ -248,19 +250,22 @@ class Rigidbody(Actor):
         return direction
         
 
-    def get_edge_distances(self, collided_actor: Actor):
+    def get_edge_distances(self, collided_actor: Actor, margin: float = 0):
         """
         Calculates the distances to the collided sides.
         Args:
             collided_actor: The actor to check for collision with.
+            margin: Added to the half size of the object.
         Returns:
             list[float] - List of distances to the collided side. The order is right, left, top, bottom. Negative value means that the object is colliding with that side.
         """
+        half_size_x = self.half_size.x + margin
+        half_size_y = self.half_size.y + margin
         # right, left, top, bottom
         return (
-            self.position.x + self.half_size.x - (collided_actor.position.x - collided_actor.half_size.x),
-            collided_actor.position.x + collided_actor.half_size.x - (self.position.x - self.half_size.x),
-            self.position.y + self.half_size.y - (collided_actor.position.y - collided_actor.half_size.y),
-            collided_actor.position.y + collided_actor.half_size.y - (self.position.y - self.half_size.y)
+            self.position.x + half_size_x - (collided_actor.position.x - collided_actor.half_size.x),
+            collided_actor.position.x + collided_actor.half_size.x - (self.position.x - half_size_x),
+            self.position.y + half_size_y - (collided_actor.position.y - collided_actor.half_size.y),
+            collided_actor.position.y + collided_actor.half_size.y - (self.position.y - half_size_y)
         )
 
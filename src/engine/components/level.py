@@ -9,10 +9,18 @@ from engine.components.actors.rigidbody import Rigidbody
 from engine.components.actors.character import Character
 from engine.game_math import *
 
+import itertools
 import warnings
 
 
 
+#?ifdef SERVER
+# net ids are unique across all levels, so actors can move between levels
+_NET_IDS = itertools.count(1)
+#?endif
+
+
+
 class Level:
     """
     This class represents a level in the game. It contains all the actors and handles the physics simulation.
@@ -45,6 +53,18 @@ class Level:
         self.__actors_to_destroy = set()
         self.__actors_to_create = set()
         self.__previously_collided = {}
+        #?ifdef SERVER
+        self.__chunk_versions = {}
+        self.__dirty_actors = {} # id -> actor, whose synced fields changed since the last get_updates
+        self.__tickable_actors = {} # id -> actor with tick_enabled
+        # actors, which tick visits, by their chunk, so only active chunks are visited
+        self.__tickable_by_chunk = {} # chunk -> {id -> actor with tick_enabled}
+        self.__rigidbodies_by_chunk = {} # chunk -> set of rigidbodies
+        self.__overlap_actors_by_chunk = {} # chunk -> set of actors with overlap events
+        self.__pinned_chunks = set()
+        self.__active_chunks = None
+        self.__active_centers = None
+        #?endif
 
         for actor in actors:
             self.register_actor(actor)
@@ -242,10 +262,18 @@ class Level:
                 warnings.warn(f"Actor with the same name already exists in level {self.name}: {actor.name}", UserWarning, 4)
                 continue
             self.actors[actor.name] = actor
+            #?ifdef SERVER
+            if not actor.net_id:
+                actor.net_id = next(_NET_IDS)
+            #?endif
             if isinstance(actor, Rigidbody):
                 self.rigidbodies.add(actor)
             if actor.generate_overlap_events:
                 self.__actors_with_overlap_events.add(actor)
+            #?ifdef SERVER
+            if actor.tick_enabled:
+                self.__tickable_actors[id(actor)] = actor
+            #?endif
             if actor.visible:
                 new_actors.append(actor)
             self.add_actor_to_chunk(actor)
@@ -268,6 +296,12 @@ class Level:
             if actor in self.__actors_with_overlap_events:
                 self.__actors_with_overlap_events.remove(actor)
             self.chunks[actor.chunk].remove(actor)
+            #?ifdef SERVER
+            self.__bump_chunk_version(actor.chunk)
+            self.__dirty_actors.pop(id(actor), None)
+            self.__remove_from_chunk_index(actor, actor.chunk)
+            self.__tickable_actors.pop(id(actor), None)
+            #?endif
         
         self.__actors_to_destroy.clear()
         return destroyed
@@ -314,6 +348,10 @@ class Level:
             self.chunks[chunk] = set()
         self.chunks[chunk].add(actor)
         actor.chunk = chunk
+        #?ifdef SERVER
+        self.__bump_chunk_version(chunk)
+        self.__add_to_chunk_index(actor, chunk)
+        #?endif
 
 
     def update_actor_chunk(self, actor: Actor):
@@ -326,70 +364,36 @@ class Level:
         a_chk = actor.chunk
         if a_chk.x != chk.x or a_chk.y != chk.y:
             self.chunks[a_chk].remove(actor)
+            #?ifdef SERVER
+            self.__bump_chunk_version(a_chk)
+            self.__remove_from_chunk_index(actor, a_chk)
+            #?endif
             self.add_actor_to_chunk(actor)
+        #?ifdef SERVER
+        elif not isinstance(actor, Rigidbody):
+            # static actor moved inside its chunk, rigidbodies are synced by snapshots
+            self.__bump_chunk_version(chk)
+        #?endif
 
 
-    #?ifdef SERVER
-    def get_updates(self, players):
-        """
-        Called only by the engine.
-        Returns a dictionary of actors that need to be updated for the given players.
-        """
-        chunk_updates = {}
-
-        for chunk in self.get_loaded_chunks(players):
-            if chunk not in self.chunks:
-                continue
-
-            for actor in self.chunks[chunk]:
-                sync_data = actor.get_for_net_sync()
-                if not sync_data:
-                    continue
-                        
-                if not actor.visible and "visible" not in sync_data:
-                    continue 
-                if "visible" in sync_data:
-                    del sync_data["visible"]
-
-                if chunk not in chunk_updates:
-                    chunk_updates[chunk] = {}
-                chunk_updates[chunk][actor] = sync_data
-                        
-        return chunk_updates
-        
-
-    def get_loaded_chunks(self, players: list):
-        """
-        Returns a set of chunk positions that are updated for the given players.
-        Args:
-            players: List of players to get the loaded chunks for. Player is an object with a position and previous_different_chunk attributes.
-        Returns:
-            set[Vector] - Set of chunk positions that are updated for the given players.
-        """
-        chunks = set()
-        for player in players:
-            for x in range(-player.update_distance, player.update_distance + 1):
-                for y in range(-player.update_distance, player.update_distance + 1):
-                    chunk_pos = get_chunk_cords(player.position) + Vector(x, y)
-                    previous_chunk_pos = player.previous_different_chunk + Vector(x, y)
-                    chunks.add(chunk_pos)
-                    chunks.add(previous_chunk_pos)
-
-        return chunks
-        
-
-    def tick(self, delta_time: float):
+    def simulate(self, actors, delta_time: float, events: bool = True):
         """
-        Called every tick by the engine.
-        Updates the level and all actors in the level.
+        Ticks only the given rigidbodies and resolves their collisions with the rest of the level, which doesn't move.
+        It is used for characters driven by input commands, which are simulated by the server and predicted by the client with the same steps.
         Args:
-            delta_time: Time since the last engine tick.
+            actors: Rigidbodies to simulate. They should be excluded from tick.
+            delta_time: Time step.
+            events: Whether on_collision of actors is called. If False, only the bounce of the simulated rigidbodies is applied. Client passes False, because collision events are handled by the server.
         """
         delta_time *= self.simulation_speed
-        
-        for actor in self.actors.values():
+        actors = set(actors)
+        for actor in actors:
             actor.tick(delta_time)
-                
+
+        self.__resolve_collisions(actors, events)
+
+
+    def __resolve_collisions(self, rigidbodies: set[Rigidbody], events: bool):
         max_iterations = 8
         collisions_not_resolved = True
         collided_actors = {}
@@ -400,7 +404,7 @@ class Level:
             collisions_not_resolved = False
             corrected_actors = {}
 
-            for actor1 in self.rigidbodies:
+            for actor1 in rigidbodies:
                 if not actor1.simulate_physics:
                     continue
 
@@ -436,13 +440,16 @@ class Level:
 
         for actor, collision_data in collided_actors.items():
             collision_data[0].normal = collision_data[1].normalized
-            actor.on_collision(collision_data[0])
+            if events:
+                actor.on_collision(collision_data[0])
+            elif actor in rigidbodies:
+                Rigidbody.on_collision(actor, collision_data[0])
 
-        for actor in self.rigidbodies:
+        for actor in rigidbodies:
             self.update_actor_chunk(actor)
 
         collided_actors_directions = {}
-        for actor1 in self.rigidbodies:
+        for actor1 in rigidbodies:
             if not actor1.simulate_physics:
                 continue
 
@@ -451,9 +458,7 @@ class Level:
                 if not_should_colide_with(actor1, actor2):
                     continue
                 
-                was_outdated = actor1.outdated["half_size"]
-                actor1.half_size += KINDA_SMALL_NUMBER
-                direction = actor1.collision_response_direction(actor2)
+                direction = actor1.collision_response_direction(actor2, KINDA_SMALL_NUMBER)
 
                 # right, left, top, bottom
                 if direction.x < 0:
@@ -464,26 +469,222 @@ class Level:
                     collided_actors_directions[actor1][2] = 1
                 if direction.y > 0:
                     collided_actors_directions[actor1][3] = 1
-                actor1.half_size -= KINDA_SMALL_NUMBER
-                actor1.outdated["half_size"] = was_outdated
 
         for actor, collided_sides in collided_actors_directions.items():
             actor.collided_sides = collided_sides
 
+
+    #?ifdef SERVER
+    @property
+    def active_chunks(self):
+        """ set[tuple[int, int]] | None - Chunks, which are simulated. Actors in other chunks are frozen. None means, that the whole level is simulated, which is the default until update_active_region is called. """
+        return self.__active_chunks
+
+
+    @property
+    def pinned_chunks(self):
+        """ set[tuple[int, int]] - Chunks, which are always simulated, even if no player is near them. It must not be modified, use pin_chunk and unpin_chunk. """
+        return self.__pinned_chunks
+
+
+    @property
+    def tickable_actors(self):
+        """ ValuesView[Actor] - Actors in the level, whose tick is called. They are actors with tick_enabled. """
+        return self.__tickable_actors.values()
+
+
+    def update_tickable(self, actor: Actor):
+        """
+        Called when tick_enabled of the actor changes. Adds it to tickable actors or removes it from them.
+        Args:
+            actor: Actor, whose tick_enabled changed.
+        """
+        if actor.tick_enabled and self.actors.get(actor.name) is actor:
+            self.__tickable_actors[id(actor)] = actor
+            self.__tickable_by_chunk.setdefault(actor.chunk, {})[id(actor)] = actor
+        elif self.__tickable_actors.pop(id(actor), None) is not None:
+            self.__discard_from(self.__tickable_by_chunk, actor.chunk, id(actor))
+
+
+    def __add_to_chunk_index(self, actor: Actor, chunk: Vector):
+        if id(actor) in self.__tickable_actors:
+            self.__tickable_by_chunk.setdefault(chunk, {})[id(actor)] = actor
+        if isinstance(actor, Rigidbody):
+            self.__rigidbodies_by_chunk.setdefault(chunk, set()).add(actor)
+        if actor in self.__actors_with_overlap_events:
+            self.__overlap_actors_by_chunk.setdefault(chunk, set()).add(actor)
+
+
+    def __remove_from_chunk_index(self, actor: Actor, chunk: Vector):
+        self.__discard_from(self.__tickable_by_chunk, chunk, id(actor))
+        self.__discard_from(self.__rigidbodies_by_chunk, chunk, actor)
+        self.__discard_from(self.__overlap_actors_by_chunk, chunk, actor)
+
+
+    @staticmethod
+    def __discard_from(index: dict, chunk: Vector, key):
+        """ Removes the key from the collection of the chunk in the index and drops the collection, when it becomes empty. """
+        collection = index.get(chunk)
+        if collection is None or key not in collection:
+            return
+        if isinstance(collection, dict):
+            del collection[key]
+        else:
+            collection.remove(key)
+        if not collection:
+            del index[chunk]
+
+
+    def pin_chunk(self, chunk: Vector | tuple):
+        """
+        Keeps the chunk simulated, even if no player is near it.
+        Args:
+            chunk: Chunk position.
+        """
+        self.__pinned_chunks.add((int(chunk[0]), int(chunk[1])))
+        self.__active_centers = None
+
+
+    def unpin_chunk(self, chunk: Vector | tuple):
+        """
+        Removes the chunk from pinned chunks. It is simulated only while a player is near it.
+        Args:
+            chunk: Chunk position.
+        """
+        self.__pinned_chunks.discard((int(chunk[0]), int(chunk[1])))
+        self.__active_centers = None
+
+
+    def update_active_region(self, centers):
+        """
+        Called only by the engine. Sets chunks, which are simulated, to squares around the centers and pinned chunks.
+        The region is computed again only when centers change, so players, who stay in their chunks, cost nothing.
+        Args:
+            centers: Iterable of (chunk x, chunk y, distance) tuples, usually one for each player.
+        """
+        centers = frozenset(centers)
+        if centers == self.__active_centers:
+            return
+
+        active_chunks = set(self.__pinned_chunks)
+        for x, y, distance in centers:
+            active_chunks.update((chunk_x, chunk_y) for chunk_x in range(x - distance, x + distance + 1) for chunk_y in range(y - distance, y + distance + 1))
+        self.__active_chunks = active_chunks
+        self.__active_centers = centers
+
+
+    def get_chunk_version(self, chunk: Vector) -> int:
+        """
+        Version of the chunk is increased, whenever an actor is added to it or removed from it, or a static actor in it moves.
+        It is used by the engine to cache data of the chunk, which are sent to clients.
+        Args:
+            chunk: Position of the chunk.
+        Returns:
+            int - Version of the chunk. 0 if no actor was ever in it.
+        """
+        return self.__chunk_versions.get(chunk, 0)
+
+
+    def mark_dirty(self, actor: Actor):
+        """
+        Called by actor setters, when a synced field of the actor changes. Only marked actors are checked in get_updates.
+        Args:
+            actor: Actor, whose field changed.
+        """
+        self.__dirty_actors[id(actor)] = actor
+
+
+    def __bump_chunk_version(self, chunk: Vector):
+        self.__chunk_versions[chunk] = self.__chunk_versions.get(chunk, 0) + 1
+
+
+    def get_updates(self, chunks):
+        """
+        Called only by the engine.
+        Returns a dictionary of actors that need to be updated in the given chunks, which players see. Chunks can be Vectors or (x, y) tuples.
+        Only actors marked by mark_dirty are checked, so the cost depends on what changed and not on the size of the world.
+        """
+        chunk_updates = {}
+        dirty_actors = self.__dirty_actors
+        self.__dirty_actors = {}
+
+        for actor in dirty_actors.values():
+            if self.actors.get(actor.name) is not actor:
+                continue
+            if actor.chunk not in chunks:
+                # nobody sees it now, the change is sent, when somebody does
+                self.__dirty_actors[id(actor)] = actor
+                continue
+
+            sync_data = actor.get_for_net_sync()
+            if not sync_data:
+                continue
+                    
+            if not actor.visible and "visible" not in sync_data:
+                continue 
+            if "visible" in sync_data:
+                del sync_data["visible"]
+
+            if actor.chunk not in chunk_updates:
+                chunk_updates[actor.chunk] = {}
+            chunk_updates[actor.chunk][actor] = sync_data
+                        
+        return chunk_updates
+        
+
+    def tick(self, delta_time: float, excluded: set[Actor] = frozenset()):
+        """
+        Called every tick by the engine.
+        Updates the level and all actors in the level.
+        Args:
+            delta_time: Time since the last engine tick.
+            excluded: Actors, which are not ticked, because they are simulated separately with simulate. Other actors still collide with them.
+        """
+        delta_time *= self.simulation_speed
+
+        active_chunks = self.__active_chunks
+        if active_chunks is None:
+            actors = list(self.__tickable_actors.values())
+            rigidbodies = self.rigidbodies
+            actors_with_overlap_events = self.__actors_with_overlap_events
+        else:
+            # only active chunks are visited, actors outside of them are frozen, but others still collide with them
+            actors = []
+            rigidbodies = set()
+            actors_with_overlap_events = []
+            for chunk in active_chunks:
+                if chunk in self.__tickable_by_chunk:
+                    actors.extend(self.__tickable_by_chunk[chunk].values())
+                if chunk in self.__rigidbodies_by_chunk:
+                    rigidbodies.update(self.__rigidbodies_by_chunk[chunk])
+                if chunk in self.__overlap_actors_by_chunk:
+                    actors_with_overlap_events.extend(self.__overlap_actors_by_chunk[chunk])
+        
+        for actor in actors:
+            if actor not in excluded:
+                actor.tick(delta_time)
+
+        self.__resolve_collisions(rigidbodies - excluded if excluded else rigidbodies, True)
+
         overlaped_actors = {}
-        for actor1 in self.__actors_with_overlap_events:
-            was_outdated = actor1.outdated["half_size"]
-            actor1.half_size += KINDA_SMALL_NUMBER
+        for actor1 in actors_with_overlap_events:
             for actor2 in self.get_actors_in_chunks_3x3(get_chunk_cords(actor1.position)):
-                if actor1 is actor2 or not is_overlapping_rect(actor1, actor2):
+                if actor1 is actor2 or not is_overlapping_rect(actor1, actor2, KINDA_SMALL_NUMBER):
                     continue
 
                 if actor2 not in overlaped_actors:
                     overlaped_actors[actor2] = set()
                 overlaped_actors[actor2].add(actor1)
 
-            actor1.half_size -= KINDA_SMALL_NUMBER
-            actor1.outdated["half_size"] = was_outdated
+        if active_chunks is not None:
+            # overlaps of actors, which weren't checked this tick, are kept, so frozen actors don't end and begin them again
+            checked = set(actors_with_overlap_events)
+            for actor, overlaped_set in self.__previously_collided.items():
+                if self.__actors.get(actor.name) is not actor:
+                    continue
+                frozen = {other_actor for other_actor in overlaped_set if other_actor not in checked and self.__actors.get(other_actor.name) is other_actor}
+                if frozen:
+                    overlaped_actors.setdefault(actor, set()).update(frozen)
 
         for actor, overlaped_set in overlaped_actors.items():
             for other_actor in overlaped_set - self.__previously_collided.get(actor, set()):
@@ -0,0 +1,524 @@
+"""
+Network module built on asyncio.
+It is an alternative to the network module with the same API. Connections are handled by coroutines in a dedicated event loop thread,
+so idle clients and clients, which are logging in, are cheap. Received messages are handed to the engine in batches.
+"""
+
+from .network import *
+from .protocol import *
+from engine.datatypes import *
+from engine.log import *
+
+import asyncio
+import struct
+import threading
+import time
+from typing import Callable, List, Tuple, Dict
+
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """
+    Reads a single length prefixed frame from the stream.
+    Raises:
+        asyncio.IncompleteReadError: If the stream ends.
+        ValueError: If frame is bigger than MAX_FRAME_SIZE.
+    """
+    length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame size {length} exceeds maximum frame size {MAX_FRAME_SIZE}")
+    return await reader.readexactly(length)
+
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    """ Datagram protocol, which passes every received datagram to the callback. """
+
+    def __init__(self, on_datagram: Callable[[bytes, tuple], None]):
+        self.__on_datagram = on_datagram
+
+
+    def datagram_received(self, data, addr):
+        self.__on_datagram(data, addr)
+
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable of a disconnected client) are reported here and can be ignored
+        pass
+
+
+
+class AsyncNetwork(Network):
+    """
+    Common base for the asyncio client and server.
+    By default the event loop runs in its own thread. If a loop is given, no thread is started and the caller drives the loop
+    with drive() after each tick, so many networks can share one loop and thread, like bots of the bot_swarm benchmark.
+    """
+
+    def __init__(self, *args, loop: asyncio.AbstractEventLoop = None, **kwargs):
+        """
+        Args:
+            loop: Event loop to run the network in. If None, a new loop is run in a dedicated thread.
+            Other arguments are passed to the next base class, e.g. address and port to the Network.
+        """
+        super().__init__(*args, **kwargs)
+        self.__owns_loop = loop is None
+        self.__loop = loop or asyncio.new_event_loop()
+        self.__loop_thread = None
+        self.__stopped = False
+
+        if self.__owns_loop:
+            self.__loop_thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+            self.__loop_thread.start()
+
+
+    @property
+    def loop(self):
+        """ asyncio.AbstractEventLoop - Event loop, which runs the network. """
+        return self.__loop
+
+
+    def drive(self, duration: float = 0):
+        """
+        Runs the given event loop for the duration. Does nothing if the network runs its own loop thread.
+        Args:
+            duration: Time in seconds. 0 handles only the work, which is ready now.
+        """
+        if self.__owns_loop or self.__loop.is_closed():
+            return
+        self.__loop.run_until_complete(asyncio.sleep(duration))
+
+
+    def _run(self, coro):
+        """ Runs the coroutine in the event loop and waits for its result. """
+        if self.__owns_loop:
+            return asyncio.run_coroutine_threadsafe(coro, self.__loop).result()
+        return self.__loop.run_until_complete(coro)
+
+
+    def _call_soon(self, callback, *args):
+        """ Schedules the callback in the event loop. """
+        if self.__owns_loop:
+            self.__loop.call_soon_threadsafe(callback, *args)
+        else:
+            self.__loop.call_soon(callback, *args)
+
+
+    def _begin_stop(self) -> bool:
+        """ Returns True the first time it is called, so stop() can run only once. """
+        if self.__stopped:
+            return False
+        self.__stopped = True
+        self._running = False
+        return True
+
+
+    def _stop_loop(self):
+        """ Stops and closes the event loop, if the network owns it. """
+        if not self.__owns_loop:
+            return
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__loop_thread.join()
+        self.__loop.close()
+
+
+
+#?ifdef CLIENT
+class AsyncClientNetwork(AsyncNetwork):
+    """
+    Asyncio network for the client. Uses TCP for login and non-priority data,
+    UDP for priority data.
+    """
+
+    def __init__(self, address: str, port: int, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name), loop: asyncio.AbstractEventLoop = None):
+        """
+        Args:
+            address: The address of the server.
+            port: The UDP port of the server. TCP port will be port + 1.
+            codecs: Names of codecs the client offers to the server, in order of preference. Until server picks one, JSON is used.
+            loop: Event loop to run the network in. If None, a new loop is run in a dedicated thread.
+        """
+        super().__init__(address, port, loop=loop)
+        self.tcp_port = self.port + 1
+        self.__codecs = codecs
+        self.__id = 0
+
+        self.__writer: asyncio.StreamWriter = None
+        self.__udp_transport: asyncio.DatagramTransport = None
+        self.__read_task: asyncio.Task = None
+        self.__udp_channel = DatagramChannel()
+        self.tcp_bytes_sent = 0
+        self.tcp_bytes_received = 0
+
+        try:
+            self._run(self.__connect())
+        except OSError as e:
+            log_client(f"Failed to connect to server: {e}", LogType.INFO)
+            self.__id = -10
+            self.stop()
+
+
+    @property
+    def connected(self):
+        """ bool - True if the TCP connection is open, False otherwise. """
+        return self.__writer is not None and not self.__writer.is_closing()
+
+
+    @property
+    def id(self):
+        """ int - The id of the client. Refer to the ClientNetwork class for more information. """
+        return self.__id
+
+
+    @property
+    def udp_channel(self):
+        """ DatagramChannel - Sequence numbers and loss counters of UDP datagrams exchanged with the server. """
+        return self.__udp_channel
+
+
+    @property
+    def bytes_sent(self):
+        """ int - Number of bytes sent to the server over TCP and UDP, including framing and datagram headers. """
+        return self.tcp_bytes_sent + self.__udp_channel.bytes_sent
+
+
+    @property
+    def bytes_received(self):
+        """ int - Number of bytes received from the server over TCP and UDP, including framing and datagram headers. """
+        return self.tcp_bytes_received + self.__udp_channel.bytes_received
+
+
+    def send(self, cmd: str, data, has_priority=False):
+        """
+        Adds data to the output buffer to be sent on the next tick.
+        Args:
+            cmd: The command to send.
+            data: The data to send.
+            has_priority: If True, data will be sent via UDP; otherwise via TCP.
+        """
+        if not self.running:
+            return
+        parsed_data = self._parse_for_send(cmd, data)
+
+        if has_priority:
+            self._send_priority_buffer.add_data(parsed_data)
+        else:
+            self._send_unpriority_buffer.add_data(parsed_data)
+
+
+    def tick(self):
+        """
+        Called only by the engine.
+        Hands data from the output buffer to the event loop, which sends it via UDP (priority) or TCP (non-priority).
+        """
+        if not self.running or not self.connected:
+            return
+
+        udp_payloads = self._send_priority_buffer.get_all_data()
+        tcp_payloads = self._send_unpriority_buffer.get_all_data()
+        if udp_payloads or tcp_payloads:
+            self._call_soon(self.__flush, self._codec, udp_payloads, tcp_payloads)
+
+
+    async def __connect(self):
+        reader, self.__writer = await asyncio.open_connection(self.address, self.tcp_port)
+        server_ip = self.__writer.get_extra_info("peername")[0]
+        log_client(f"Connected to server at {server_ip}:{self.tcp_port}", LogType.INFO)
+
+        hello_msg = self._codec.pack([self._parse_for_send("hello", list(self.__codecs))])
+        self.__writer.write(frame(hello_msg))
+
+        self.__udp_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self.__handle_datagram),
+            remote_addr=(server_ip, self.port)
+        )
+        self.__read_task = self.loop.create_task(self.__read_tcp(reader))
+
+
+    def __flush(self, codec: Codec, udp_payloads: List[bytes], tcp_payloads: List[bytes]):
+        """ Runs in the event loop. Writes the batched payloads to the transports. """
+        if not self.connected:
+            return
+        if udp_payloads:
+            for datagram in self._pack_datagrams(codec, udp_payloads, self.__udp_channel):
+                self.__udp_transport.sendto(datagram)
+        if tcp_payloads:
+            message = frame(codec.pack(tcp_payloads))
+            self.__writer.write(message)
+            self.tcp_bytes_sent += len(message)
+
+
+    async def __read_tcp(self, reader: asyncio.StreamReader):
+        """ Reads frames from the TCP connection until it is closed. """
+        try:
+            while self.running:
+                message = await read_frame(reader)
+                self.tcp_bytes_received += FRAME_HEADER.size + len(message)
+
+                unpriority_data = []
+                for payload in self._parse_data(message):
+                    cmd, response_data = payload
+                    if cmd == "codec":
+                        self._codec = self._select_codec((response_data,), self.__codecs)
+                        log_client(f"Using {self._codec.name} codec.", LogType.INFO)
+                        continue
+
+                    unpriority_data.append(payload)
+
+                    match cmd:
+                        case "register_outcome":
+                            old_id = self.__id
+                            self.__id = response_data
+                            if old_id > 0 or self.__id <= 0:
+                                continue
+
+                            log_client(f"Registered with ID {self.__id}. Sending UDP registration...", LogType.INFO)
+                            self.__udp_transport.sendto(self.__udp_channel.wrap(self._codec.pack([self._parse_for_send("register_udp", self.__id)])))
+
+                        case "connected_from_another_location":
+                            log_client(f"Connected from another location. Disconnecting...", LogType.INFO)
+                            self._running = False
+
+                self._receive_unpriority_buffer.add_data_multiple(unpriority_data)
+
+        except asyncio.IncompleteReadError:
+            log_client("TCP connection closed by server.", LogType.INFO)
+        except (ConnectionError, OSError, ValueError) as e:
+            log_client(f"TCP connection error: {e}", LogType.INFO)
+        finally:
+            self._running = False
+            self.__id = -10
+            self.__close_transports()
+            log_client("TCP connection handler stopped.", LogType.INFO)
+
+
+    def __handle_datagram(self, data: bytes, addr: tuple):
+        """ Runs in the event loop. The UDP socket is connected, so only datagrams from the server are received. """
+        if not data:
+            return
+        try:
+            batch = self.__udp_channel.receive(data)
+        except (ValueError, struct.error) as e:
+            log_client(f"Invalid UDP datagram: {e}", LogType.WARNING)
+            return
+        # stale, duplicated or incomplete fragment
+        if batch is not None:
+            self._receive_priority_buffer.add_data_multiple(self._parse_data(batch))
+
+
+    def __close_transports(self):
+        if self.__writer:
+            self.__writer.close()
+        if self.__udp_transport:
+            self.__udp_transport.close()
+
+
+    async def __shutdown(self):
+        if self.__read_task:
+            self.__read_task.cancel()
+            await asyncio.gather(self.__read_task, return_exceptions=True)
+        self.__close_transports()
+
+
+    def stop(self):
+        """ Cancels the connection coroutines, closes the transports and stops the event loop. """
+        if not self._begin_stop():
+            return
+        log_client("Stopping network...", LogType.INFO)
+
+        if not self.loop.is_closed():
+            self._run(self.__shutdown())
+        self._stop_loop()
+
+        self.__id = -10
+        log_client("Network stopped.", LogType.INFO)
+
+#?endif
+
+
+#?ifdef SERVER
+class AsyncConnection(Connection):
+    """ State of a single TCP connection on the asyncio server. It should be updated only by the AsyncServerNetwork. """
+
+    def __init__(self, writer: asyncio.StreamWriter, addr: tuple, codec: Codec):
+        super().__init__(writer, addr, codec)
+        self.writer = writer
+
+
+    @property
+    def buffered(self):
+        """ int - Number of bytes in the write buffer of the transport. """
+        return self.writer.transport.get_write_buffer_size()
+
+
+
+class AsyncServerNetwork(AsyncNetwork, ServerNetworkBase):
+    """
+    Asyncio network for the server. Handles TCP connections for login/non-priority data
+    and UDP for priority data. Each TCP connection is handled by its own coroutine.
+    Connect and disconnect callbacks are called on the engine thread during tick.
+    """
+
+    def __init__(self, address: str, port: int, max_connections: int, on_connect: Callable[[int], None], on_disconnect: Callable[[int], None] = None, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name), high_water_mark: int = 256 * 1024, max_over_budget_time: float = 5, auth_workers: int = 4, on_resume: Callable[[int], None] = None, loop: asyncio.AbstractEventLoop = None):
+        """
+        Args:
+            address: The address of the server.
+            port: The UDP port for the server. TCP port will be port + 1.
+            max_connections: The maximum number of TCP connections allowed.
+            on_connect: A function called when a client successfully connects and logs in (passes client ID).
+            on_disconnect: A function called when a client disconnects (passes client ID).
+            codecs: Names of codecs the server accepts. Client's most preferred codec from this list is used for that client.
+            high_water_mark: Number of unsent bytes per client, above which new TCP messages are deferred and UDP messages are dropped.
+            max_over_budget_time: Time in seconds a client can stay above the high-water mark before it is disconnected.
+            auth_workers: Number of threads, which check credentials of logging in clients.
+            on_resume: A function called instead of on_connect, when a client reconnects with its session token (passes client ID). If None, on_connect is called.
+            loop: Event loop to run the network in. If None, a new loop is run in a dedicated thread.
+        """
+        super().__init__(address, port, max_connections, on_connect, on_disconnect, codecs, high_water_mark, max_over_budget_time, UserDatabase(workers=auth_workers), on_resume, loop=loop)
+        self.__tcp_port = self.port + 1
+        self.__connection_tasks = set()
+        self.__events = AdvancedQueue()
+
+        self.__tcp_server: asyncio.Server = None
+        self.__udp_transport: asyncio.DatagramTransport = None
+
+        try:
+            self._run(self.__start())
+        except OSError as e:
+            log_server(f"Failed to start network: {e}", LogType.ERROR)
+            self._begin_stop()
+            self._stop_loop()
+            self._users.close()
+            raise
+
+
+    @property
+    def tcp_port(self):
+        """ int - The TCP port of the server. """
+        return self.__tcp_port
+
+
+    def tick(self):
+        """
+        Called only by the engine.
+        Calls connect/disconnect callbacks and hands data from the output buffer to the event loop,
+        which sends it to clients via UDP (priority) or TCP (non-priority).
+        """
+        if not self.running:
+            return
+
+        self.__fire_events()
+        self._call_soon(self.__dispatch, *self._take_output())
+
+
+    def __fire_events(self):
+        for callback, client_id in self.__events.get_all_data():
+            callback(client_id)
+
+
+    def __dispatch(self, data_by_client_udp: Dict[int, List[bytes]], data_by_client_tcp: Dict[int, List[bytes]]):
+        """ Runs in the event loop. Writes the batched payloads to the transports. """
+        self._dispatch(data_by_client_udp, data_by_client_tcp, time.time())
+
+
+    async def __start(self):
+        self.__tcp_server = await asyncio.start_server(self.__handle_client_tcp, self.address, self.tcp_port, backlog=self.max_connections, reuse_address=True)
+        log_server(f"TCP Socket listening on {self.address}:{self.tcp_port}", LogType.INFO)
+
+        self.__udp_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self._handle_datagram),
+            local_addr=(self.address, self.port)
+        )
+        log_server(f"UDP Socket listening on {self.address}:{self.port}", LogType.INFO)
+
+
+    async def __handle_client_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Handles login, registration, and non-priority data for a single TCP client. """
+        addr = writer.get_extra_info("peername")
+        log_server(f"Accepted TCP connection from {addr}", LogType.INFO)
+
+        if len(self._connections) >= self.max_connections:
+            log_server(f"Max connections reached. Closing connection from {addr}.", LogType.INFO)
+            writer.close()
+            return
+
+        task = asyncio.current_task()
+        self.__connection_tasks.add(task)
+        conn = AsyncConnection(writer, addr, self._codec)
+        self._connections[writer] = conn
+
+        try:
+            while self.running:
+                message = await read_frame(reader)
+                if not self._handle_payloads(conn, self._parse_data(message)):
+                    return
+
+                while conn.login:
+                    # checked by the worker pool, so the event loop keeps serving other clients
+                    await asyncio.wait((asyncio.wrap_future(conn.login),))
+                    if not self._finish_login(conn):
+                        return
+
+        except asyncio.CancelledError:
+            # Cancelled by stop(). Finishing normally, because the stream server reports exceptions of cancelled handlers
+            pass
+        except asyncio.IncompleteReadError:
+            log_server(f"TCP connection closed by client {conn.client_id or addr}.", LogType.INFO)
+        except (ConnectionError, OSError, ValueError) as e:
+            log_server(f"TCP connection error: {e}", LogType.INFO)
+        finally:
+            self.__connection_tasks.discard(task)
+            self._close_connection(conn)
+
+
+    def _notify(self, callback: Callable[[int], None], client_id: int):
+        self.__events.add_data((callback, client_id))
+
+
+    def _write(self, conn: AsyncConnection, batch: bytes):
+        if not conn.writer.is_closing():
+            conn.writer.write(frame(batch))
+
+
+    def _send_datagram(self, conn: AsyncConnection, datagram: bytes) -> bool:
+        self.__udp_transport.sendto(datagram, conn.udp_addr)
+        return True
+
+
+    def _release(self, conn: AsyncConnection):
+        conn.writer.close()
+
+
+    def end_session(self, client_id: int):
+        """
+        Invalidates the session token of the client, so it can't resume its session and it has to log in again.
+        Args:
+            client_id: ID of the client.
+        """
+        if self.running:
+            self._call_soon(ServerNetworkBase.end_session, self, client_id)
+
+
+    async def __shutdown(self):
+        self.__tcp_server.close()
+        for task in self.__connection_tasks:
+            task.cancel()
+        await asyncio.gather(*self.__connection_tasks, return_exceptions=True)
+        await self.__tcp_server.wait_closed()
+        self.__udp_transport.close()
+
+
+    def stop(self):
+        """ Cancels all connection coroutines, closes the transports and stops the event loop. """
+        if not self._begin_stop():
+            return
+        log_server("Stopping network...", LogType.INFO)
+
+        self._run(self.__shutdown())
+        self._stop_loop()
+        self._close_all()
+        self.__fire_events()
+
+        log_server("Network stopped.", LogType.INFO)
+
+#?endif
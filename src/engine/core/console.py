@@ -29,6 +29,8 @@ class Console:
             "stat_level_updates": "print('level_updates:', self.get_stat('level_updates'), 'ms')",
             "stat_widget_tick": "print('widget_tick:', self.get_stat('widget_tick'), 'ms')",
             "stat_network": "print('network:', self.get_stat('network'), 'ms')",
+            "stat_queues": "for client_id, depth in self.network.queue_depths.items():\n\tprint('client', client_id, 'queue:', depth, 'bytes')",
+            "stat_udp": "for client_id, channel in self.network.udp_channels.items():\n\tprint('client', client_id, 'received:', channel.received, 'lost:', channel.lost, 'late:', channel.late, 'loss:', round(channel.loss_rate * 100, 2), '%')\n\tprint('\tsent:', channel.bytes_sent, 'bytes in', channel.datagrams_sent, 'datagrams, received:', channel.bytes_received, 'bytes in', channel.datagrams_received, 'datagrams, dropped fragments:', channel.dropped_fragments)",
             "stat_all": "for stat in ('tps', 'console_cmds', 'level_updates', 'network'):\n\tprint(stat + ': ' + self.get_stat(stat))",
         }
 
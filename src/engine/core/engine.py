@@ -5,11 +5,17 @@ It handles all the game logic and physics.
 
 #?ifdef CLIENT
 from .renderer import Renderer
+from .interpolation import InterpolationBuffer
+from .tiles import unpack_tiles
 #?endif
 #?ifdef SERVER
 from .console import Console
+from .replication import EMPTY_BOUNDS, ChunkSubscription, InterestIndex, ReplicationState, UpdateScheduler
+from .tiles import ChunkPayload, pack_tiles
 #?endif
 from .network import *
+from .async_network import *
+from .loopback_network import *
 from engine.log import *
 
 #?ifdef CLIENT
@@ -135,12 +141,25 @@ class ClientEngine(Engine, Renderer):
         self.__requested_background = None
         self.__current_background = None
 
+        self.__net_ids = {}
+        self.__partial_snapshots = {}
+        self.__interpolation = InterpolationBuffer()
+        self.__predicted_keys = {}
+        self.__input_sequence = 0
+        self.__pending_inputs = []
+        self.__player_state = None
+        self.__session_token = ""
+
         self.__network_commands = {
             "register_actor": self.__register_actor,
+            "register_chunk": self.__register_chunk,
             "update_actor": self.__update_actor,
+            "snapshot": self.__snapshot,
+            "player_state": self.__player_state_received,
             "destroy_actor": self.__destroy_actor,
             "background": self.__background,
             "play_sound": self.__play_sound,
+            "session": self.__session,
         }
 
         network_thread = threading.Thread(target=self.__handle_network)
@@ -213,6 +232,18 @@ class ClientEngine(Engine, Renderer):
         return self.__network
     
 
+    @property
+    def session_token(self):
+        """ str - Token of the last session issued by the server. It is used to resume the session after a disconnect. Empty if there is none. """
+        return self.__session_token
+
+
+    @property
+    def interpolation(self):
+        """ InterpolationBuffer - Buffer, which smooths movement of remote rigidbodies between snapshots. """
+        return self.__interpolation
+    
+
     @property
     def level(self):
         """ Level - Client level object. It is used to handle all actors (including physics). """
@@ -353,14 +384,55 @@ class ClientEngine(Engine, Renderer):
             raise TypeError("Command must be a string and function must be a function:", cmd, func)
     
 
-    def connect(self, address: str, port: int):
+    def register_predicted_key(self, key: Keys, func: Callable[['ClientEngine', Level, int, float], None]):
+        """
+        Registers key, which moves the player's character, so the client can predict the movement before the server confirms it.
+        Server must register the same function for the key with KeyPressType.PREDICTED.
+        Args:
+            key: Key to be registered. It must be subclass of Keys.
+            func: Function that will be called for each input command, while the key is held. It must take four arguments - engine_ref, level_ref, player_id and delta_time.
+        Raises:
+            TypeError: If key is not subclass of Keys or func is not callable.
+            ValueError: If key is already registered.
+        """
+        if key in self.__predicted_keys:
+            raise ValueError(f"Keys {key} is already registered")
+        if not key in Keys or not callable(func):
+            raise TypeError("Key must be a Keys and func must be a function:", key, func)
+        self.__predicted_keys[key] = func
+
+
+    def connect(self, address: str, port: int, network_class: type = ClientNetwork):
         """
         Tries to connect to the server.
         Args:
             address: Server address. It must be a string.
             port: Server port. It must be an integer.
+            network_class: Network implementation to use, ClientNetwork, AsyncClientNetwork or LoopbackClientNetwork.
         """
-        self.__network = ClientNetwork(address, port)
+        self.__network = network_class(address, port)
+
+
+    def resume(self, address: str, port: int, network_class: type = ClientNetwork) -> bool:
+        """
+        Reconnects to the server and resumes the last session instead of logging in. If the session is still alive, the character is kept and the client receives only changes it missed.
+        Otherwise the network id will be -4 and the client has to log in again.
+        Args:
+            address: Server address. It must be a string.
+            port: Server port. It must be an integer.
+            network_class: Network implementation to use, ClientNetwork, AsyncClientNetwork or LoopbackClientNetwork.
+        Returns:
+            bool - False if there is no session to resume, True if the request was sent.
+        """
+        if not self.__session_token:
+            return False
+        if self.network:
+            self.network.stop()
+        self.connect(address, port, network_class)
+        self.network.send("resume", self.__session_token)
+        # token is single use, the server issues a new one
+        self.__session_token = ""
+        return True
 
 
     def join_level(self, level_name: str):
@@ -457,6 +529,14 @@ class ClientEngine(Engine, Renderer):
         old_actors = self.level.get_destroyed()
         for actor in old_actors:
             self.remove_actor_from_draw(actor)
+            self.interpolation.remove(actor)
+
+        for actor, position in self.interpolation.sample(time.time()):
+            if self.level.actors.get(actor.name) is actor:
+                actor.position = position
+                self.level.update_actor_chunk(actor)
+
+        self.__predict(delta_time)
 
         self.__time("network")
 
@@ -574,7 +654,15 @@ class ClientEngine(Engine, Renderer):
         if actor_name in self.level.actors:
             return
 
-        self.level.register_actor(self.__actor_templates[actor_type](actor_name, data[2])) # if it crashes in this line, it's because actor class you provided doesn't have correct attributes. It should have only name, position, everything else should be hardcoded
+        actor = self.__actor_templates[actor_type](actor_name, data[2]) # if it crashes in this line, it's because actor class you provided doesn't have correct attributes. It should have only name, position, everything else should be hardcoded
+        actor.net_id = data[3]
+        self.__net_ids[actor.net_id] = actor_name
+        self.level.register_actor(actor)
+
+
+    def __register_chunk(self, data):
+        for record in unpack_tiles(data):
+            self.__register_actor(record)
 
 
     def __update_actor(self, data):
@@ -588,7 +676,87 @@ class ClientEngine(Engine, Renderer):
             self.level.update_actor_chunk(actor)
 
 
+    def __snapshot(self, data):
+        sequence, index, count, entries = data
+        actors = self.level.actors
+        net_ids = self.__net_ids
+        missing = []
+        now = time.time()
+        self.interpolation.on_snapshot(now)
+        player_actor_name = self.get_player_actor(self.network.id)
+        for net_id, sync_data in entries:
+            actor = actors.get(net_ids.get(net_id))
+            if not actor:
+                missing.append(net_id)
+                continue
+
+            if "position" in sync_data and isinstance(actor, Rigidbody):
+                if actor.name != player_actor_name:
+                    # remote rigidbodies are moved by the interpolation buffer in tick
+                    self.interpolation.push(actor, Vector(*sync_data.pop("position")), now)
+                elif self.__predicted_keys:
+                    # player's character is predicted and corrected only by player_state
+                    del sync_data["position"]
+            actor.update_from_net_sync(sync_data)
+
+            if "position" in sync_data:
+                self.level.update_actor_chunk(actor)
+
+        if count > 1:
+            # snapshot is acknowledged only when all of its records arrive
+            received, all_missing = self.__partial_snapshots.setdefault(sequence, [0, []])
+            all_missing.extend(missing)
+            self.__partial_snapshots[sequence][0] = received = received + 1
+            if received < count:
+                while len(self.__partial_snapshots) > 64:
+                    del self.__partial_snapshots[next(iter(self.__partial_snapshots))]
+                return
+            missing = self.__partial_snapshots.pop(sequence)[1]
+
+        self.network.send("snapshot_ack", [sequence, missing], True)
+
+
+    def __player_state_received(self, data):
+        self.__player_state = data
+
+
+    def __predict(self, delta_time):
+        if not self.__predicted_keys or not self.check_network():
+            return
+        actor = self.level.actors.get(self.get_player_actor(self.network.id))
+        if not isinstance(actor, Rigidbody):
+            return
+
+        state, self.__player_state = self.__player_state, None
+        if state:
+            # reconcile, start from the authoritative state and replay input commands, which the server didn't simulate yet
+            sequence, position, velocity, collided_sides = state
+            self.__pending_inputs = [command for command in self.__pending_inputs if command[0] > sequence]
+            actor.position = Vector(*position)
+            actor.velocity = Vector(*velocity)
+            actor.collided_sides = list(collided_sides)
+            for command in self.__pending_inputs:
+                self.__apply_input(actor, command)
+
+        self.__input_sequence += 1
+        keys = [int(key) for key in self.pressed_keys if key in self.__predicted_keys]
+        command = [self.__input_sequence, keys, min(delta_time, MAX_INPUT_DELTA_TIME)]
+        self.__pending_inputs.append(command)
+        del self.__pending_inputs[:-256]
+        self.network.send("input", self.__pending_inputs[-8:], True)
+        self.__apply_input(actor, command)
+
+
+    def __apply_input(self, actor, command):
+        _, keys, delta_time = command
+        for key in keys:
+            self.__predicted_keys[key](self, self.level, self.network.id, delta_time)
+        self.level.simulate((actor,), delta_time, False)
+
+
     def __destroy_actor(self, data):
+        if data in self.level.actors:
+            self.__net_ids.pop(self.level.actors[data].net_id, None)
         self.level.destroy_actor_by_name(data)
 
 
@@ -596,6 +764,10 @@ class ClientEngine(Engine, Renderer):
         self.set_background(data)
 
 
+    def __session(self, data):
+        self.__session_token = data
+
+
     def __play_sound(self, data):
         self.play_sound(*data)
 
@@ -611,32 +783,43 @@ class Player:
     def __init__(self):
         self.level = ""
         self.previous_chunk = Vector()
-        self.previous_different_chunk = Vector()
-        self.synced_chuks = set()
+        self.subscription = ChunkSubscription() # chunks the client sees
         self.world_mouse_pos = Vector()
         self.update_distance = 0
         self.position = Vector()
         self.triggered_keys = set()
         self.pressed_keys = set()
         self.released_keys = set()
+        self.replication = ReplicationState()
+        self.input_driven = False # True after the first input command, then the character is simulated only by input commands
+        self.inputs = [] # [sequence, keys, delta_time] input commands waiting for simulation
+        self.input_sequence = 0 # sequence number of the last simulated input command
+        self.sent_input_sequence = 0
+        self.input_time = 0 # simulation time, which input commands can still use, so the client can't move faster than the server runs
+        self.disconnect_time = 0 # time when the client disconnected, while its session can be resumed, 0 if it is connected
+        self.missed_actors = {} # actor name -> actor registered or None if destroyed, while the client was disconnected
 
 
 
 class TPS:
     """ Used to limit the ticks per second of the server. """
 
-    def __init__(self, max_tps):
+    def __init__(self, max_tps, clock = time):
         self.max_tps = max_tps
-        self.__last_time = time.time()
+        self.last_delta_time = 0
+        self.clock = clock
+        self.__last_time = clock.time()
 
 
     def tick(self):
-        delta_time = time.time() - self.__last_time
-        self.__last_time = time.time()
+        delta_time = self.clock.time() - self.__last_time
         min_ms = 1 / self.max_tps
         if delta_time < min_ms:
-            time.sleep(min_ms - delta_time)
+            self.clock.sleep(min_ms - delta_time)
             delta_time = min_ms
+        # time spent sleeping belongs to this tick, otherwise the next tick wouldn't wait
+        self.__last_time += delta_time
+        self.last_delta_time = delta_time
         return delta_time        
 
 
@@ -649,12 +832,22 @@ class ServerEngine(Engine):
 
         self.__max_tps = 120
         self.min_tps = 30
+        self.snapshot_rate = 30
+        self.session_grace_time = 30
+        self.simulation_distance = 8
+        self.__snapshot_time = 0
+        self.__unsent_new_actors = {}
+        self.__unsent_destroyed_actors = {}
+        self.__chunk_payloads = {}
+        self.__interest = {}
 
         self.__network = None
+        self.__scheduler = UpdateScheduler()
 
         self.__players = {}
         self.__new_players = {}
         self.__destroyed_players = set()
+        self.__resumed_players = set()
         self.__levels = {}
         self.__registered_keys = {}
 
@@ -676,6 +869,8 @@ class ServerEngine(Engine):
             "update_distance": self.__update_distance,
             "key_down": self.__key_down,
             "key_up": self.__key_up,
+            "snapshot_ack": self.__snapshot_ack,
+            "input": self.__input,
         }
 
         self.__clock = TPS(self.max_tps)
@@ -704,6 +899,20 @@ class ServerEngine(Engine):
             raise TypeError("TPS must be a positive number:", value)
         
 
+    @property
+    def clock(self):
+        """ Object with time() and sleep() methods, which measures and limits tick time. Default is the time module. ManualClock makes ticks independent of real time. """
+        return self.__clock.clock
+
+
+    @clock.setter
+    def clock(self, value):
+        if callable(getattr(value, "time", None)) and callable(getattr(value, "sleep", None)):
+            self.__clock = TPS(self.max_tps, value)
+        else:
+            raise TypeError("Clock must have time and sleep methods:", value)
+
+
     @property
     def min_tps(self):
         """ float - Minimum ticks per second. Default is 30. """
@@ -718,12 +927,73 @@ class ServerEngine(Engine):
             raise TypeError("TPS must be a positive number:", value)
 
 
+    @property
+    def snapshot_rate(self):
+        """ float - Number of snapshots sent to clients per second. Changes between snapshots are accumulated. It is independent of TPS, but can't be higher. Default is 30. """
+        return self.__snapshot_rate
+
+
+    @snapshot_rate.setter
+    def snapshot_rate(self, value):
+        if isinstance(value, (int, float)) and value > 0:
+            self.__snapshot_rate = value
+        else:
+            raise TypeError("Snapshot rate must be a positive number:", value)
+
+
+    @property
+    def simulation_distance(self):
+        """ int - Distance in chunks from each player, within which actors are simulated. Update distance of the player is used, if it is larger, so the client never sees frozen actors. Actors elsewhere are frozen, unless their chunk is pinned with Level.pin_chunk. Default is 8. """
+        return self.__simulation_distance
+
+
+    @simulation_distance.setter
+    def simulation_distance(self, value):
+        if isinstance(value, int) and value >= 0:
+            self.__simulation_distance = value
+        else:
+            raise TypeError("Simulation distance must be a non-negative integer:", value)
+
+
+    @property
+    def session_grace_time(self):
+        """ float - Seconds, for which a disconnected player keeps its character, so the client can resume its session and receive only changes it missed. 0 disables resuming. Default is 30. """
+        return self.__session_grace_time
+
+
+    @session_grace_time.setter
+    def session_grace_time(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__session_grace_time = value
+        else:
+            raise TypeError("Session grace time must be a non-negative number:", value)
+
+
     @property
     def network(self):
         """ ServerNetwork - used to handle connection and authentication with clients. """
         return self.__network
     
 
+    @property
+    def scheduler(self):
+        """ UpdateScheduler - Decides which actor updates fit in each client's byte budget and which are deferred. """
+        return self.__scheduler
+
+
+    def get_interest(self, level_name: str) -> InterestIndex:
+        """
+        Args:
+            level_name: Name of the level.
+        Returns:
+            InterestIndex - Index of players subscribed to chunks of the level.
+        """
+        interest = self.__interest.get(level_name)
+        if interest is None:
+            interest = self.__interest[level_name] = InterestIndex()
+        return interest
+
+
     @property
     def players(self):
         """ dict[int, Player] - Dictionary of all connected players. Key is player id, value is player object. """
@@ -769,7 +1039,8 @@ class ServerEngine(Engine):
         Args:
             key: Key to be registered. It must be subclass of Keys.
             press_type: Press type. It must be subclass of KeyPressType.
-            func: Function that will be called based on the press type. It must take three arguments - engine_ref, level_ref and player_id. If press_type is HOLD, you will need to pass additional argument - delta_time.
+            func: Function that will be called based on the press type. It must take three arguments - engine_ref, level_ref and player_id. If press_type is HOLD or PREDICTED, you will need to pass additional argument - delta_time.
+                PREDICTED keys are applied for each input command of the player and the client should register the same function with register_predicted_key. For players, whose client doesn't send input commands, they work as HOLD.
         Raises:
             TypeError: If key is not subclass of Keys or press_type is not subclass of KeyPressType or func is not callable.
             ValueError: If key is already registered.
@@ -781,15 +1052,16 @@ class ServerEngine(Engine):
         self.__registered_keys[key] = (press_type, func)
         
 
-    def start_network(self, address: str, port: int, max_connections: int):
+    def start_network(self, address: str, port: int, max_connections: int, network_class: type = ServerNetwork):
         """
         Starts the server network.
         Args:
             address: Server address. It must be a string.
             port: Server port. It must be a positive integer.
             max_connections: Maximum number of connections. It must be a positive integer.
+            network_class: Network implementation to use, ServerNetwork, AsyncServerNetwork or LoopbackServerNetwork.
         """
-        self.__network = ServerNetwork(address, port, max_connections, self.__on_player_connect, self.__on_player_disconnect)
+        self.__network = network_class(address, port, max_connections, self.__on_player_connect, self.__on_player_disconnect, on_resume=self.__on_player_resume)
 
 
     def play_sound(self, sound: str, level: str, location: Vector | None, distance: float, volume: float = 1.0):
@@ -843,26 +1115,27 @@ class ServerEngine(Engine):
     
 
     @staticmethod
-    def get_actors_from_chk_pkg(chk_pkd: dict[Vector, Actor], bottom_left: Vector, top_right: Vector, add_method: Callable[[set, Actor], None] = lambda a, el: a.extend(el)):
+    def encode_updates(updates_pkg: dict[Vector, dict[Actor, dict]]):
         """
-        Retrieves actors from the chunk package based on the given coordinates.
+        Turns actor updates into snapshot parts, which are encoded only once and shared by all players, which see the chunk.
         Args:
-            chk_pkd: Dictionary of actors by their chunk coordinates.
-            bottom_left: Bottom left corner of the rectangle.
-            top_right: Top right corner of the rectangle.
-            add_method: Method to add actors to the list. Default is to extend the set with the actors.
+            updates_pkg: Dictionary of actor updates by their chunk coordinates, as returned by Level.get_updates.
         Returns:
-            list[Actor] - List of actors in the given rectangle.
+            dict[Vector, tuple[Vector, EncodedPart | None, list[Actor], dict[Actor, bool]]] - For each chunk, the chunk, snapshot part with (net id, sync data) entries, actors of the entries and actors, which changed visibility.
         """
-        actors = []
-        for x in range(bottom_left.int[0], top_right.int[0] + 1):
-            for y in range(bottom_left.int[1], top_right.int[1] + 1):
-                chk = Vector(x, y)
-                if chk not in chk_pkd:
+        parts_pkg = {}
+        for chunk, actor_dict in updates_pkg.items():
+            entries = []
+            actors = []
+            visibility = {}
+            for actor, sync_data in actor_dict.items():
+                if "visible" in sync_data:
+                    visibility[actor] = sync_data["visible"]
                     continue
-                add_method(actors, chk_pkd[chk])
-
-        return actors
+                entries.append((actor.net_id, sync_data))
+                actors.append(actor)
+            parts_pkg[chunk] = (chunk, EncodedPart("snapshot", entries) if entries else None, actors, visibility)
+        return parts_pkg
 
 
     def tick(self):
@@ -882,74 +1155,121 @@ class ServerEngine(Engine):
 
         self.__time("console_cmds")
 
+        # snapshot is due, when enough time accumulated, remainder is kept, so the rate doesn't drift with tick length
+        snapshot_interval = 1 / self.snapshot_rate
+        self.__snapshot_time += self.__clock.last_delta_time
+        is_snapshot_tick = self.__snapshot_time >= snapshot_interval
+        if is_snapshot_tick:
+            self.__snapshot_time = min(self.__snapshot_time - snapshot_interval, snapshot_interval)
+
         for level in self.levels.values():
-            new_actors = level.get_new_actors()
-            destroyed_actors = level.get_destroyed()
-            updates_pkg = level.get_updates((player for player in self.__players.values() if player.level == level.name))
+            new_actors = self.__unsent_new_actors.setdefault(level.name, [])
+            destroyed_actors = self.__unsent_destroyed_actors.setdefault(level.name, [])
+            new_actors.extend(level.get_new_actors())
+            destroyed_actors.extend(level.get_destroyed())
+
+            input_driven_actors = self.__simulate_inputs(level, delta_time)
+            level.update_active_region(self.__get_active_centers(level))
+
+            if not is_snapshot_tick:
+                # actor setters keep changes marked as outdated until the next snapshot
+                level.tick(delta_time, input_driven_actors)
+                continue
+
+            self.__unsent_new_actors[level.name] = []
+            self.__unsent_destroyed_actors[level.name] = []
+            interest = self.get_interest(level.name)
+            updates_pkg = level.get_updates(interest.chunks)
 
             new_actors_pkg = self.package_as_chunks(new_actors)
             destroyed_actors_pkg = self.package_as_chunks(destroyed_actors)
+            snapshot_parts_pkg = self.encode_updates(updates_pkg)
 
-            level.tick(delta_time)
+            level.tick(delta_time, input_driven_actors)
 
+            entered = {}
             for player_id, player in self.__players.items():
                 if player.level != level.name:
                     continue
 
-                new_actors = set()
-                destroyed_actors = set()
-
                 player.position = level.actors[self.get_player_actor(player_id)].position
                 c_chk = get_chunk_cords(player.position)
-                p_chk = player.previous_chunk.copy
-                pd_chk = player.previous_different_chunk.copy
-                if p_chk != c_chk:
-                    player.previously_loaded_chunk = p_chk
+                subscription = player.subscription
+                bounds = subscription.bounds
+                entered[player_id], _ = subscription.update(c_chk.int, player.update_distance)
+                if subscription.bounds != bounds:
+                    interest.move(player_id, bounds, subscription.bounds)
                 player.previous_chunk = c_chk
-                
-                bl_chk_pos = Vector(
-                    min((get_chunk_cords(player.position).x - player.update_distance), pd_chk.x - player.update_distance),
-                    min((get_chunk_cords(player.position).y - player.update_distance), pd_chk.y - player.update_distance)
-                ).floored - 1
-                tr_chk_pos = Vector(
-                    max((get_chunk_cords(player.position).x + player.update_distance), pd_chk.x + player.update_distance),
-                    max((get_chunk_cords(player.position).y + player.update_distance), pd_chk.y + player.update_distance)
-                ).floored
-
-                for actor in self.get_actors_from_chk_pkg(new_actors_pkg, bl_chk_pos, tr_chk_pos):
-                    new_actors.add(actor)
-
-                for actor in self.get_actors_from_chk_pkg(destroyed_actors_pkg, bl_chk_pos, tr_chk_pos):
-                    destroyed_actors.add(actor)
-
-                for actor_dict in self.get_actors_from_chk_pkg(updates_pkg, bl_chk_pos, tr_chk_pos, lambda a, el: a.append(el)):
-                    for actor, sync_data in actor_dict.items():
-                        if "visible" in sync_data:
-                            visible = sync_data["visible"]
-                            if not visible:
-                                destroyed_actors.add(actor)
-                            else:
-                                new_actors.add(actor)
-                            continue
-                            
-                        self.network.send(player_id, "update_actor", (actor.name, sync_data), True)
-
-                prev_synced_chunks = player.synced_chuks.copy()
-                player.synced_chuks.clear()
-                for x in range(c_chk.int[0] - player.update_distance, c_chk.int[0] + player.update_distance + 1):
-                    for y in range(c_chk.int[1] - player.update_distance, c_chk.int[1] + player.update_distance + 1):
-                        player.synced_chuks.add(Vector(x, y))
-                        chk = Vector(x, y)
-                        if chk not in level.chunks or chk in prev_synced_chunks:
-                            continue
-
-                        for actor in level.chunks[chk]:
-                            new_actors.add(actor)
 
+            # changes are fanned out per chunk only to players, who are subscribed to it
+            player_new_actors = {player_id: set() for player_id in entered}
+            player_destroyed_actors = {player_id: set() for player_id in entered}
+            player_chunk_parts = {player_id: {} for player_id in entered}
+            for chunk, actors in new_actors_pkg.items():
+                for player_id in interest.get(chunk):
+                    player_new_actors[player_id].update(actors)
+            for chunk, actors in destroyed_actors_pkg.items():
+                for player_id in interest.get(chunk):
+                    player_destroyed_actors[player_id].update(actors)
+            for chunk, part, actors, visibility in snapshot_parts_pkg.values():
+                for player_id in interest.get(chunk):
+                    for actor, visible in visibility.items():
+                        if not visible:
+                            player_destroyed_actors[player_id].add(actor)
+                        else:
+                            player_new_actors[player_id].add(actor)
+                    if part:
+                        player_chunk_parts[player_id][chunk] = (part, actors)
+
+            for player_id, entered_chunks in entered.items():
+                player = self.__players[player_id]
+                subscription = player.subscription
+                c_chk = player.previous_chunk
+                new_actors = player_new_actors[player_id]
+                destroyed_actors = player_destroyed_actors[player_id]
+                chunk_parts = player_chunk_parts[player_id]
+
+                def is_relevant(actor, level=level, subscription=subscription):
+                    return actor.visible and level.actors.get(actor.name) is actor and subscription.contains(get_chunk_cords(actor.position))
+
+                codec = self.network.get_codec(player_id) or self.network.codec
+                select = lambda units, c_chk=c_chk, codec=codec: self.scheduler.select(units, c_chk, codec)
+                sequence, snapshot_parts = player.replication.build(chunk_parts, is_relevant, select)
+                if snapshot_parts:
+                    self.network.send_parts(player_id, "snapshot", snapshot_parts, True, sequence)
+
+                if player.input_driven and player.input_sequence != player.sent_input_sequence:
+                    # authoritative state after the last simulated input command, client replays newer commands on top of it
+                    player_actor = level.actors[self.get_player_actor(player_id)]
+                    self.network.send(player_id, "player_state", [player.input_sequence, player_actor.position, player_actor.velocity, player_actor.collided_sides], True)
+                    player.sent_input_sequence = player.input_sequence
+
+                covered_chunks = set()
+                for chk in entered_chunks:
+                    if chk not in level.chunks:
+                        continue
+                    covered_chunks.add(chk)
+                    self.__send_chunk(player_id, player, self.__get_chunk_payload(level, chk))
+
+                registered = []
                 for actor in new_actors - destroyed_actors:
-                    self.network.send(player_id, "register_actor", actor.get_for_full_net_sync())
+                    if actor.chunk in covered_chunks:
+                        # already registered with its chunk
+                        continue
+                    player.replication.forget(actor)
+                    if player.disconnect_time:
+                        player.missed_actors[actor.name] = actor
+                    else:
+                        registered.append(actor)
+                self.__send_actors(player_id, registered)
                 for actor in destroyed_actors - new_actors:
-                    self.network.send(player_id, "destroy_actor", actor.name)
+                    if actor.chunk in covered_chunks and level.actors.get(actor.name) is actor:
+                        continue
+                    player.replication.forget(actor)
+                    if player.disconnect_time:
+                        player.missed_actors[actor.name] = None
+                    else:
+                        self.network.send(player_id, "destroy_actor", actor.name)
 
         self.__time("level_updates")
 
@@ -960,15 +1280,145 @@ class ServerEngine(Engine):
         return delta_time
     
 
+    def __get_chunk_payload(self, level, chunk):
+        """ Returns the cached payload of the chunk. It is encoded again only after the chunk version changes. """
+        payloads = self.__chunk_payloads.setdefault(level.name, {})
+        version = level.get_chunk_version(chunk)
+        payload = payloads.get(chunk)
+        if payload is None or payload.version != version:
+            payload = payloads[chunk] = ChunkPayload(version, level.chunks[chunk])
+        return payload
+
+
+    def __send_chunk(self, player_id, player, payload):
+        """ Registers all actors of the chunk, which the player's view newly covers, on the client. """
+        if player.replication.unacked_count:
+            for actor in payload.actors:
+                player.replication.forget(actor)
+
+        if player.disconnect_time:
+            for actor in payload.actors:
+                player.missed_actors[actor.name] = actor
+            return
+
+        for message in payload.messages:
+            self.network.send_encoded(player_id, message)
+        self.__send_actors(player_id, payload.rigidbodies)
+
+
+    def __send_actors(self, player_id, actors):
+        """ Registers actors on the client. Static actors aligned to the grid are sent together as tiles of their chunks in one register_chunk message. """
+        records = []
+        for actor in actors:
+            record = actor.get_for_full_net_sync()
+            if isinstance(actor, Rigidbody):
+                self.network.send(player_id, "register_actor", record)
+            else:
+                records.append(record)
+
+        tiles, records = pack_tiles(records)
+        if tiles:
+            self.network.send(player_id, "register_chunk", tiles)
+        for record in records:
+            self.network.send(player_id, "register_actor", record)
+
+
     def __on_player_connect(self, id):
+        # player, who logged in again instead of resuming, starts over
+        if id in self.__players:
+            self.__destroyed_players.add(id)
         self.__new_players[id] = Player()
 
 
     def __on_player_disconnect(self, id):
-        if id in self.players:      
+        if id in self.__new_players:
+            del self.__new_players[id]
+            return
+        if id not in self.__players or id in self.__destroyed_players:
+            return
+
+        player = self.__players[id]
+        if not self.session_grace_time or not player.level:
             self.__destroyed_players.add(id)
+            self.network.end_session(id)
+            return
+
+        # character stays in the level, until the session expires or the client resumes it
+        player.disconnect_time = self.clock.time()
+        player.pressed_keys.clear()
+        player.triggered_keys.clear()
+        player.released_keys.clear()
+        player.inputs.clear()
+        self.__resumed_players.discard(id)
+
+
+    def __on_player_resume(self, id):
+        player = self.__players.get(id)
+        if not player or id in self.__destroyed_players:
+            self.__on_player_connect(id)
+            return
+
+        player.disconnect_time = 0
+        self.__resumed_players.add(id)
+
+
+    def __resume_player(self, id):
+        """ Sends the resumed client only what it missed, while it was disconnected. """
+        player = self.__players[id]
+        level = self.levels[player.level]
+        registered = []
+        for name, actor in player.missed_actors.items():
+            if actor is None:
+                self.network.send(id, "destroy_actor", name)
+            elif level.actors.get(name) is actor:
+                registered.append(actor)
+        self.__send_actors(id, registered)
+        log_server(f"Client {id} resumed its session, {len(player.missed_actors)} missed actors sent.", LogType.INFO)
+        player.missed_actors.clear()
+        # snapshots sent while the client was away are lost, unsent input acknowledgement is sent again
+        player.replication.defer_unacked()
+        player.sent_input_sequence = -1
+        self.on_connect(id)
     
 
+    def __get_active_centers(self, level):
+        """ Returns (chunk x, chunk y, distance) of each player in the level, around which actors are simulated. """
+        centers = []
+        for player_id, player in self.__players.items():
+            if player.level != level.name:
+                continue
+            actor = level.actors.get(self.get_player_actor(player_id))
+            if actor:
+                x, y = get_chunk_cords(actor.position).int
+                centers.append((x, y, max(self.simulation_distance, player.update_distance)))
+        return centers
+
+
+    def __simulate_inputs(self, level, delta_time):
+        """ Simulates characters of players in the level, who send input commands, and returns them, so the level tick skips them. """
+        actors = set()
+        for player_id, player in self.__players.items():
+            if not player.input_driven or player.level != level.name:
+                continue
+            actor = level.actors.get(self.get_player_actor(player_id))
+            if not actor:
+                continue
+            actors.add(actor)
+
+            player.input_time = min(player.input_time + delta_time, 0.25)
+            while player.inputs and player.inputs[0][2] <= player.input_time:
+                sequence, keys, command_delta_time = player.inputs.pop(0)
+                player.input_time -= command_delta_time
+                for key in keys:
+                    press_type, func = self.__registered_keys.get(key, (None, None))
+                    if press_type == KeyPressType.PREDICTED:
+                        func(self, level, player_id, command_delta_time)
+                level.simulate((actor,), command_delta_time)
+                player.input_sequence = sequence
+
+        return actors
+
+
     def __handle_network(self, delta_time):
         self.network.tick()
 
@@ -985,7 +1435,7 @@ class ServerEngine(Engine):
             for key in self.__players[id].pressed_keys:
                 if key in self.__registered_keys:
                     press_type, func = self.__registered_keys[key]
-                    if press_type == KeyPressType.HOLD:
+                    if press_type == KeyPressType.HOLD or (press_type == KeyPressType.PREDICTED and not self.__players[id].input_driven):
                         func(self, self.levels[self.players[id].level], id, delta_time)
 
             for key in self.__players[id].released_keys:
@@ -1001,15 +1451,27 @@ class ServerEngine(Engine):
             log_server("Network is not initialized", LogType.ERROR)
             return
         
-        self.__players.update(self.__new_players)
+        now = self.clock.time()
+        for id, player in self.__players.items():
+            if player.disconnect_time and now - player.disconnect_time > self.session_grace_time:
+                log_server(f"Session of client {id} expired.", LogType.INFO)
+                self.__destroyed_players.add(id)
+                self.network.end_session(id)
+
         ignore_ids = self.__destroyed_players - set(self.__new_players)
-        self.__new_players.clear()
         for id in self.__destroyed_players:
-            player = self.__players[id]
-            if player.level:
+            player = self.__players.pop(id, None)
+            if player and player.level:
+                self.get_interest(player.level).move(id, player.subscription.bounds, EMPTY_BOUNDS)
                 level = self.levels[player.level]
                 level.destroy_actor(level.actors[self.get_player_actor(id)])
-            del self.__players[id]
+        self.__players.update(self.__new_players)
+        self.__new_players.clear()
+
+        for id in self.__resumed_players:
+            if id in self.__players:
+                self.__resume_player(id)
+        self.__resumed_players.clear()
 
         data_buffer = self.network.get_data(100)
         for id, packed_data in data_buffer:
@@ -1051,13 +1513,18 @@ class ServerEngine(Engine):
 
     def __join_level(self, id, data):
         level_name = data
-        if level_name in self.levels:
+        if self.__players[id].level == level_name and self.get_player_actor(id) in self.levels[level_name].actors:
+            # resumed client joins again, its character is kept
+            self.on_connect(id)
+        elif level_name in self.levels:
+            if self.__players[id].level:
+                self.get_interest(self.__players[id].level).move(id, self.__players[id].subscription.bounds, EMPTY_BOUNDS)
+            self.__players[id].subscription = ChunkSubscription()
             self.__players[id].level = level_name
             player_actor = self.levels[level_name].default_character(self.get_player_actor(id), Vector()) # if it crashes in this line, it's because character class you provided doesn't have correct attributes. It should have only name, position, everything else should be hardcoded
             player_actor.id = id
             self.levels[level_name].register_actor(player_actor)
             self.__players[id].previous_chunk = get_chunk_cords(player_actor.position)
-            self.__players[id].previous_different_chunk = self.__players[id].previous_chunk
             self.on_connect(id)
         else:
             log_server(f"Client {id} tried to join non-existing level {level_name}", LogType.WARNING)
@@ -1081,6 +1548,38 @@ class ServerEngine(Engine):
             self.__players[id].pressed_keys.remove(data)
         self.__players[id].released_keys.add(data)
 
+
+    def __snapshot_ack(self, id, data):
+        self.__players[id].replication.ack(data[0], data[1])
+
+
+    def __input(self, id, data):
+        # data are the last input commands, which the client didn't see acknowledged, so a lost datagram doesn't lose input
+        if not isinstance(data, list):
+            log_server(f"Invalid input data format from client {id}.", LogType.WARNING)
+            return
+
+        player = self.__players[id]
+        player.input_driven = True
+        last_sequence = player.inputs[-1][0] if player.inputs else player.input_sequence
+        for command in data:
+            try:
+                sequence, keys, delta_time = command
+            except (TypeError, ValueError):
+                log_server(f"Invalid input command format from client {id}.", LogType.WARNING)
+                continue
+
+            if (not isinstance(sequence, int) or not isinstance(keys, list) or not all(isinstance(key, int) for key in keys)
+                or not isinstance(delta_time, int | float) or not math.isfinite(delta_time)):
+                log_server(f"Invalid input command format from client {id}.", LogType.WARNING)
+                continue
+
+            if sequence <= last_sequence:
+                continue
+            player.inputs.append([sequence, keys, min(max(delta_time, 0), MAX_INPUT_DELTA_TIME)])
+            last_sequence = sequence
+        del player.inputs[:-64]
+
 #?endif
 
 
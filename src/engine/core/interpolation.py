@@ -0,0 +1,166 @@
+#?attr CLIENT
+
+"""
+Client side interpolation of remote actors. Positions received in snapshots are timestamped and actors are rendered
+a bit in the past, between two received positions, so irregular or lower snapshot rate doesn't show up as stutter.
+"""
+
+from engine.components.actors.actor import Actor
+from engine.datatypes import *
+
+import threading
+from typing import Dict, List, Tuple
+
+
+
+class InterpolationBuffer:
+    """
+    Stores received positions of actors and returns their positions for the current render time.
+    Render time is interpolation delay behind the newest snapshot time, so there are usually two samples around it.
+    If there is no newer sample, because snapshots were lost, actor is extrapolated for at most max extrapolation time.
+    Positions are pushed from the network thread and sampled from the main thread.
+    """
+
+    def __init__(self, interpolation_delay: float = 0.1, max_extrapolation: float = 0.1):
+        """
+        Args:
+            interpolation_delay: How many seconds behind the received snapshots are actors rendered.
+            max_extrapolation: Maximum number of seconds, for which actor is extrapolated, when there is no newer sample.
+        """
+        self.interpolation_delay = interpolation_delay
+        self.max_extrapolation = max_extrapolation
+        self.__samples: Dict[Actor, List[Tuple[float, Vector]]] = {}
+        self.__velocities: Dict[Actor, Vector] = {}
+        self.__last_snapshot_time = 0
+        self.__previous_snapshot_time = 0
+        self.__snapshot_interval = 1 / 30
+        self.__lock = threading.Lock()
+
+
+    @property
+    def interpolation_delay(self):
+        """ float - How many seconds behind the received snapshots are actors rendered. """
+        return self.__interpolation_delay
+
+
+    @interpolation_delay.setter
+    def interpolation_delay(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__interpolation_delay = value
+        else:
+            raise TypeError("Interpolation delay must be a non-negative number:", value)
+
+
+    @property
+    def max_extrapolation(self):
+        """ float - Maximum number of seconds, for which actor is extrapolated, when there is no newer sample. """
+        return self.__max_extrapolation
+
+
+    @max_extrapolation.setter
+    def max_extrapolation(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__max_extrapolation = value
+        else:
+            raise TypeError("Max extrapolation must be a non-negative number:", value)
+
+
+    @property
+    def snapshot_interval(self):
+        """ float - Estimated time between two received snapshots. """
+        return self.__snapshot_interval
+
+
+    def on_snapshot(self, timestamp: float):
+        """
+        Called for every received snapshot record, even if it has no buffered actors. It is used to estimate the snapshot interval.
+        Args:
+            timestamp: Time when the snapshot was received.
+        """
+        with self.__lock:
+            interval = timestamp - self.__last_snapshot_time
+            if interval > 0.001 and self.__last_snapshot_time:
+                self.__snapshot_interval += (min(interval, 1) - self.__snapshot_interval) * 0.1
+            if interval > 0.001:
+                self.__previous_snapshot_time = self.__last_snapshot_time
+                self.__last_snapshot_time = timestamp
+
+
+    def push(self, actor: Actor, position: Vector, timestamp: float):
+        """
+        Adds received position of the actor.
+        Args:
+            actor: Actor, whose position was received.
+            position: Received position.
+            timestamp: Time when the snapshot was received.
+        """
+        with self.__lock:
+            samples = self.__samples.get(actor)
+            if samples is None:
+                # start from the position, that is currently displayed
+                self.__samples[actor] = [(timestamp - self.__snapshot_interval, actor.position.copy), (timestamp, position)]
+                return
+
+            last_time, last_position = samples[-1]
+            if self.__previous_snapshot_time > last_time and timestamp - last_time > self.__snapshot_interval * 2:
+                # actor wasn't in the last snapshots, so it didn't move and it starts moving just before this sample, not at the old one
+                samples.append((timestamp - self.__snapshot_interval, last_position))
+                self.__velocities.pop(actor, None)
+            elif timestamp > last_time:
+                # velocity is known only from two received positions, it is used for extrapolation
+                self.__velocities[actor] = (position - last_position) / (timestamp - last_time)
+            samples.append((timestamp, position))
+
+
+    def remove(self, actor: Actor):
+        """
+        Stops interpolating the actor, e.g. when it is destroyed.
+        Args:
+            actor: Actor to remove.
+        """
+        with self.__lock:
+            self.__samples.pop(actor, None)
+            self.__velocities.pop(actor, None)
+
+
+    def clear(self):
+        """ Removes all samples. """
+        with self.__lock:
+            self.__samples.clear()
+            self.__velocities.clear()
+
+
+    def sample(self, now: float) -> List[Tuple[Actor, Vector]]:
+        """
+        Args:
+            now: Current time.
+        Returns:
+            list[tuple[Actor, Vector]] - Actors and their positions at render time. Actors, which reached their last received position, are returned once more and then forgotten until they move again.
+        """
+        render_time = now - self.interpolation_delay
+        out = []
+        with self.__lock:
+            for actor, samples in list(self.__samples.items()):
+                # keep one sample before render time
+                i = 0
+                while i + 1 < len(samples) and samples[i + 1][0] <= render_time:
+                    i += 1
+                if i:
+                    del samples[:i]
+
+                if len(samples) > 1:
+                    (t0, p0), (t1, p1) = samples[0], samples[1]
+                    alpha = max(0, (render_time - t0) / (t1 - t0)) if t1 > t0 else 1
+                    out.append((actor, p0 + (p1 - p0) * alpha))
+                    continue
+
+                t1, p1 = samples[0]
+                # nothing was received after this sample, so snapshots were probably lost, otherwise the actor stopped moving
+                if self.__last_snapshot_time <= t1 and render_time - t1 <= self.max_extrapolation and actor in self.__velocities:
+                    out.append((actor, p1 + self.__velocities[actor] * (render_time - t1)))
+                else:
+                    out.append((actor, p1))
+                    del self.__samples[actor]
+                    self.__velocities.pop(actor, None)
+
+        return out
@@ -0,0 +1,569 @@
+"""
+In-process network with the same API as the network module. Server and clients exchange messages through in-memory queues instead of sockets,
+so a server and any number of clients can run in a single process and thread, for example in benchmarks and tests.
+Messages are encoded, batched and fragmented the same way as on the real network. Optional link model delays, reorders and drops them.
+Delivery depends only on the clock and on the seeded random generator of the link model, so with ManualClock network conditions are reproducible.
+"""
+
+from .network import *
+from .protocol import *
+from engine.datatypes import *
+from engine.log import *
+
+import heapq
+import random
+import threading
+import time
+from typing import Any, Callable, List, Tuple, Dict
+
+
+
+# loopback servers by their address and port, so clients can find them like with sockets
+_servers: Dict[Tuple[str, int], "LoopbackServerNetwork"] = {}
+
+
+
+class ManualClock:
+    """
+    Clock, which moves only when it is advanced or slept on. It has the same time() and sleep() as the time module, which it can replace
+    in the loopback network and in the server engine, so ticks take exactly as much simulated time as the engine asks for.
+    """
+
+    def __init__(self, start: float = 0.0):
+        """
+        Args:
+            start: Initial time in seconds.
+        """
+        self.__now = start
+
+
+    def time(self) -> float:
+        """ Returns current time in seconds. """
+        return self.__now
+
+
+    def sleep(self, seconds: float):
+        """ Advances the clock instead of waiting. """
+        self.advance(seconds)
+
+
+    def advance(self, seconds: float):
+        """
+        Moves the clock forward.
+        Args:
+            seconds: Number of seconds to move the clock by. Negative values are ignored.
+        """
+        if seconds > 0:
+            self.__now += seconds
+
+
+
+class LinkModel:
+    """
+    Simulated conditions of a link. Each message is delayed by latency plus random jitter.
+    Datagrams can also be lost and they can arrive out of order. Reliable messages are never lost and they keep their order, like with TCP.
+    """
+
+    def __init__(self, latency: float = 0, jitter: float = 0, loss: float = 0, seed: int = 0):
+        """
+        Args:
+            latency: One way delay of every message in seconds.
+            jitter: Maximum random delay in seconds, which is added to the latency.
+            loss: Probability between 0 and 1, that a datagram is lost.
+            seed: Seed of the random generator, which decides jitter and loss.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.__random = random.Random(seed)
+
+
+    @property
+    def latency(self):
+        """ float - One way delay of every message in seconds. """
+        return self.__latency
+
+
+    @latency.setter
+    def latency(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__latency = value
+        else:
+            raise TypeError("Latency must be a non-negative number:", value)
+
+
+    @property
+    def jitter(self):
+        """ float - Maximum random delay in seconds, which is added to the latency. """
+        return self.__jitter
+
+
+    @jitter.setter
+    def jitter(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__jitter = value
+        else:
+            raise TypeError("Jitter must be a non-negative number:", value)
+
+
+    @property
+    def loss(self):
+        """ float - Probability between 0 and 1, that a datagram is lost. """
+        return self.__loss
+
+
+    @loss.setter
+    def loss(self, value):
+        if isinstance(value, (int, float)) and 0 <= value <= 1:
+            self.__loss = value
+        else:
+            raise TypeError("Loss must be a number between 0 and 1:", value)
+
+
+    def get_delay(self, reliable: bool) -> float | None:
+        """
+        Args:
+            reliable: True for messages of the reliable stream, which can't be lost.
+        Returns:
+            float | None - Delay of the next message in seconds or None if it is lost.
+        """
+        if not reliable and self.loss and self.__random.random() < self.loss:
+            return None
+        if self.jitter:
+            return self.latency + self.__random.uniform(0, self.jitter)
+        return self.latency
+
+
+
+class LoopbackPipe:
+    """ One direction of a loopback link. Messages can be taken after their delay passes. """
+
+    def __init__(self, model: LinkModel | None, clock):
+        self.__model = model
+        self.__clock = clock
+        self.__queue: List[Tuple[float, int, bool, bytes]] = []
+        self.__order = 0
+        self.__last_reliable_time = 0
+        self.__reliable_size = 0
+        self.__lock = threading.Lock()
+
+
+    @property
+    def pending(self):
+        """ int - Number of messages, which weren't taken yet. """
+        return len(self.__queue)
+
+
+    @property
+    def reliable_size(self):
+        """ int - Number of bytes of reliable messages, which weren't taken yet. """
+        return self.__reliable_size
+
+
+    def put(self, data: bytes, reliable: bool):
+        """
+        Sends a message through the pipe.
+        Args:
+            data: Message to send.
+            reliable: If True, message is never lost and it is delivered after all previous reliable messages.
+        """
+        with self.__lock:
+            delivery_time = self.__clock.time()
+            if self.__model:
+                delay = self.__model.get_delay(reliable)
+                if delay is None:
+                    return
+                delivery_time += delay
+
+            if reliable:
+                delivery_time = max(delivery_time, self.__last_reliable_time)
+                self.__last_reliable_time = delivery_time
+                self.__reliable_size += len(data)
+
+            self.__order += 1
+            heapq.heappush(self.__queue, (delivery_time, self.__order, reliable, data))
+
+
+    def take(self) -> List[Tuple[bool, bytes]]:
+        """
+        Returns:
+            list[tuple[bool, bytes]] - Messages, whose delay passed, in order of delivery, and whether they are reliable.
+        """
+        now = self.__clock.time()
+        messages = []
+        with self.__lock:
+            while self.__queue and self.__queue[0][0] <= now:
+                _, _, reliable, data = heapq.heappop(self.__queue)
+                if reliable:
+                    self.__reliable_size -= len(data)
+                messages.append((reliable, data))
+        return messages
+
+
+
+class LoopbackLink:
+    """ Connection between the loopback server and a single client. Either side can close it. Messages, which were already sent, are still delivered. """
+
+    def __init__(self, model: LinkModel | None, clock, name: str):
+        self.to_server = LoopbackPipe(model, clock)
+        self.to_client = LoopbackPipe(model, clock)
+        self.closed = False
+        self.name = name
+
+
+
+#?ifdef CLIENT
+class LoopbackClientNetwork(Network):
+    """
+    Loopback network for the client. It connects to the loopback server with the same address and port in this process.
+    Reliable messages and datagrams are exchanged the same way as over TCP and UDP, but there are no sockets and threads.
+    """
+
+    def __init__(self, address: str, port: int, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name), link_model: LinkModel = None):
+        """
+        Args:
+            address: The address of the loopback server.
+            port: The port of the loopback server.
+            codecs: Names of codecs the client offers to the server, in order of preference. Until server picks one, JSON is used.
+            link_model: Simulated conditions of the link. If None, the server's link model is used.
+        """
+        super().__init__(address, port)
+        self.__codecs = codecs
+        self.__id = 0
+        self.__udp_channel = DatagramChannel()
+        self.tcp_bytes_sent = 0
+        self.tcp_bytes_received = 0
+
+        server = _servers.get((self.address, self.port))
+        self.__link = server.accept(link_model) if server else None
+        if not self.__link:
+            log_client(f"Failed to connect to loopback server at {self.address}:{self.port}", LogType.INFO)
+            self.__id = -10
+            self.stop()
+            return
+
+        self.__clock = server.clock
+        log_client(f"Connected to loopback server at {self.address}:{self.port}", LogType.INFO)
+        self.__send_reliable(self._codec.pack([self._parse_for_send("hello", list(self.__codecs))]))
+
+
+    @property
+    def connected(self):
+        """ bool - True if the link to the server is open, False otherwise. """
+        return self.__link is not None and not self.__link.closed
+
+
+    @property
+    def id(self):
+        """ int - The id of the client. Refer to the ClientNetwork class for more information. """
+        return self.__id
+
+
+    @property
+    def udp_channel(self):
+        """ DatagramChannel - Sequence numbers and loss counters of datagrams exchanged with the server. """
+        return self.__udp_channel
+
+
+    @property
+    def bytes_sent(self):
+        """ int - Number of bytes sent to the server, including framing and datagram headers, which would be sent over TCP and UDP. """
+        return self.tcp_bytes_sent + self.__udp_channel.bytes_sent
+
+
+    @property
+    def bytes_received(self):
+        """ int - Number of bytes received from the server, including framing and datagram headers, which would be sent over TCP and UDP. """
+        return self.tcp_bytes_received + self.__udp_channel.bytes_received
+
+
+    def send(self, cmd: str, data, has_priority=False):
+        """
+        Adds data to the output buffer to be sent on the next tick.
+        Args:
+            cmd: The command to send.
+            data: The data to send.
+            has_priority: If True, data will be sent as a datagram; otherwise through the reliable stream.
+        """
+        if not self.running:
+            return
+        parsed_data = self._parse_for_send(cmd, data)
+
+        if has_priority:
+            self._send_priority_buffer.add_data(parsed_data)
+        else:
+            self._send_unpriority_buffer.add_data(parsed_data)
+
+
+    def tick(self):
+        """
+        Called only by the engine.
+        Sends data from the output buffer to the server and receives messages, which arrived.
+        """
+        if not self.running:
+            return
+
+        udp_payloads = self._send_priority_buffer.get_all_data()
+        tcp_payloads = self._send_unpriority_buffer.get_all_data()
+
+        # messages, which the server sent before it closed the link, are still received
+        if self.connected:
+            if udp_payloads:
+                for datagram in self._pack_datagrams(self._codec, udp_payloads, self.__udp_channel):
+                    self.__link.to_server.put(datagram, False)
+            if tcp_payloads:
+                self.__send_reliable(self._codec.pack(tcp_payloads))
+
+        self.__receive()
+
+
+    def get_data(self, size=1) -> List[Any]:
+        """
+        Called only by the engine.
+        Receives messages, which arrived, and returns the data from the input buffer.
+        """
+        if self.running:
+            self.__receive()
+        return super().get_data(size)
+
+
+    def __send_reliable(self, batch: bytes):
+        self.__link.to_server.put(batch, True)
+        self.tcp_bytes_sent += FRAME_HEADER.size + len(batch)
+
+
+    def __receive(self):
+        """ Moves messages, whose delay passed, to the input buffers. """
+        link = self.__link
+        for reliable, data in link.to_client.take():
+            if not reliable:
+                try:
+                    batch = self.__udp_channel.receive(data, self.__clock.time())
+                except (ValueError, struct.error) as e:
+                    log_client(f"Invalid datagram: {e}", LogType.WARNING)
+                    continue
+                # stale, duplicated or incomplete fragment
+                if batch is not None:
+                    self._receive_priority_buffer.add_data_multiple(self._parse_data(batch))
+                continue
+
+            self.tcp_bytes_received += FRAME_HEADER.size + len(data)
+            unpriority_data = []
+            for payload in self._parse_data(data):
+                cmd, response_data = payload
+                if cmd == "codec":
+                    self._codec = self._select_codec((response_data,), self.__codecs)
+                    log_client(f"Using {self._codec.name} codec.", LogType.INFO)
+                    continue
+
+                unpriority_data.append(payload)
+
+                match cmd:
+                    case "register_outcome":
+                        if self.__id <= 0:
+                            self.__id = response_data
+                            if self.__id > 0:
+                                log_client(f"Registered with ID {self.__id}.", LogType.INFO)
+
+                    case "connected_from_another_location":
+                        log_client(f"Connected from another location. Disconnecting...", LogType.INFO)
+                        self.stop()
+
+            self._receive_unpriority_buffer.add_data_multiple(unpriority_data)
+
+        if link.closed and not link.to_client.pending:
+            log_client("Loopback link closed by server.", LogType.INFO)
+            self.stop()
+
+
+    def stop(self):
+        """ Closes the link to the server. """
+        if not self._running:
+            return
+        log_client("Stopping network...", LogType.INFO)
+        self._running = False
+
+        if self.__link:
+            self.__link.closed = True
+
+        self.__id = -10
+        log_client("Network stopped.", LogType.INFO)
+
+#?endif
+
+
+
+#?ifdef SERVER
+class LoopbackConnection(Connection):
+    """ State of a single loopback client on the server. It should be updated only by the LoopbackServerNetwork. """
+
+    def __init__(self, link: LoopbackLink, codec: Codec):
+        super().__init__(link, link.name, codec)
+        self.link = link
+        # datagrams travel through the link, so the client doesn't have to register its address
+        self.udp_addr = link.name
+
+
+    @property
+    def buffered(self):
+        """ int - Number of bytes of reliable messages, which the client didn't take yet. """
+        return self.link.to_client.reliable_size
+
+
+
+class LoopbackServerNetwork(ServerNetworkBase):
+    """
+    Loopback network for the server. Clients in the same process connect to it by its address and port.
+    Everything is handled on the engine's tick, so no threads are used. Even logins are checked on the tick, so they finish in the same order in every run.
+    Reliable messages count against the high-water mark until the client takes them, so a client, which ticks rarely or has a slow link, is handled like a slow TCP client.
+    """
+
+    def __init__(self, address: str, port: int, max_connections: int, on_connect: Callable[[int], None], on_disconnect: Callable[[int], None] = None, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name), link_model: LinkModel = None, clock = time, database: str = ":memory:", on_resume: Callable[[int], None] = None, high_water_mark: int = 256 * 1024, max_over_budget_time: float = 5, hash_iterations: int = 1_000):
+        """
+        Args:
+            address: The address of the server. It is used only to find the server.
+            port: The port of the server. It is used only to find the server.
+            max_connections: The maximum number of connected clients.
+            on_connect: A function called when a client successfully logs in (passes client ID).
+            on_disconnect: A function called when a client disconnects (passes client ID).
+            codecs: Names of codecs the server accepts. Client's most preferred codec from this list is used for that client.
+            link_model: Simulated conditions of links to clients, which don't have their own. If None, messages are delivered on the next tick.
+            clock: Object with time() method, like the time module or ManualClock. It is used to delay messages and to measure time over the send budget.
+            database: Path to the sqlite database with users. By default it is in memory, so every run starts without users.
+            on_resume: A function called instead of on_connect, when a client reconnects with its session token (passes client ID). If None, on_connect is called.
+            high_water_mark: Number of bytes per client, which weren't delivered yet, above which new reliable messages are deferred and datagrams are dropped.
+            max_over_budget_time: Time in seconds a client can stay above the high-water mark before it is disconnected.
+            hash_iterations: Number of PBKDF2 iterations of new password hashes. Logins are checked on the tick, so it is low by default, which is fine for bots in a database in memory.
+        Raises:
+            OSError: If another loopback server runs on the same address and port.
+        """
+        if (address, port) in _servers:
+            raise OSError(f"Loopback address {address}:{port} is already in use")
+
+        super().__init__(address, port, max_connections, on_connect, on_disconnect, codecs, high_water_mark, max_over_budget_time, UserDatabase(database, 0, hash_iterations), on_resume)
+        self.link_model = link_model
+        self.__clock = clock
+        self.__accepted = 0
+
+        _servers[(self.address, self.port)] = self
+        log_server(f"Loopback server listening on {self.address}:{self.port}", LogType.INFO)
+
+
+    @property
+    def link_model(self):
+        """ LinkModel | None - Simulated conditions of links to clients, which don't have their own. None means ideal links. """
+        return self.__link_model
+
+
+    @link_model.setter
+    def link_model(self, value):
+        if value is None or isinstance(value, LinkModel):
+            self.__link_model = value
+        else:
+            raise TypeError("Link model must be a LinkModel or None:", value)
+
+
+    @property
+    def clock(self):
+        """ Object with time() method, which is used to delay messages. Clients use the clock of their server. """
+        return self.__clock
+
+
+    def accept(self, link_model: LinkModel = None) -> LoopbackLink | None:
+        """
+        Called only by the LoopbackClientNetwork.
+        Args:
+            link_model: Simulated conditions of the link. If None, server's link model is used.
+        Returns:
+            LoopbackLink | None - Link to the server or None if the server isn't running or it is full.
+        """
+        if not self.running:
+            return None
+
+        self.__accepted += 1
+        link = LoopbackLink(link_model or self.link_model, self.__clock, f"loopback:{self.__accepted}")
+        log_server(f"Accepted loopback connection {link.name}", LogType.INFO)
+
+        if len(self._connections) >= self.max_connections:
+            log_server(f"Max connections reached. Closing connection {link.name}.", LogType.INFO)
+            return None
+
+        self._connections[link] = LoopbackConnection(link, self._codec)
+        return link
+
+
+    def tick(self):
+        """
+        Called only by the engine.
+        Receives messages, which arrived from clients, and then sends data from the output buffer to clients.
+        """
+        if not self.running:
+            return
+
+        self.__receive()
+        self._finish_logins()
+        self._dispatch(*self._take_output(), self.__clock.time())
+
+
+    def __receive(self):
+        """ Moves messages of all clients, whose delay passed, to the input buffers and handles login. """
+        now = self.__clock.time()
+        priority_packets = []
+
+        for conn in list(self._connections.values()):
+            self.__receive_from(conn, now, priority_packets)
+            if conn.link.closed and not conn.link.to_server.pending and conn.link in self._connections:
+                log_server(f"Loopback connection closed by client {conn.client_id or conn.link.name}.", LogType.INFO)
+                self._close_connection(conn)
+
+        self._receive_priority_buffer.add_data_multiple(priority_packets)
+
+
+    def __receive_from(self, conn: LoopbackConnection, now: float, priority_packets: list):
+        """ Handles messages of a single client, whose delay passed. """
+        for reliable, data in conn.link.to_server.take():
+            if reliable:
+                if not self._handle_payloads(conn, self._parse_data(data)):
+                    return
+                continue
+
+            if conn.client_id <= 0:
+                log_server(f"Received datagram from {conn.link.name} before login. Ignoring.", LogType.INFO)
+                continue
+            try:
+                batch = conn.udp_channel.receive(data, now)
+            except (ValueError, struct.error) as e:
+                log_server(f"Invalid datagram from {conn.link.name}: {e}", LogType.WARNING)
+                continue
+            # stale, duplicated or incomplete fragment
+            if batch is not None:
+                priority_packets.extend((conn.client_id, payload) for payload in self._parse_data(batch))
+
+
+    def _write(self, conn: LoopbackConnection, batch: bytes):
+        conn.link.to_client.put(batch, True)
+
+
+    def _send_datagram(self, conn: LoopbackConnection, datagram: bytes) -> bool:
+        conn.link.to_client.put(datagram, False)
+        return True
+
+
+    def _release(self, conn: LoopbackConnection):
+        conn.link.closed = True
+
+
+    def stop(self):
+        """ Stops the server network and closes all links. """
+        if not self._running:
+            return
+        log_server("Stopping network...", LogType.INFO)
+        self._running = False
+
+        self._close_all()
+        if _servers.get((self.address, self.port)) is self:
+            del _servers[(self.address, self.port)]
+
+        log_server("Network stopped.", LogType.INFO)
+
+#?endif
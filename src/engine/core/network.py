@@ -3,23 +3,27 @@ Network module for the game engine.
 Uses TCP for reliable non-priority messages and UDP for fast priority messages.
 """
 
+from .protocol import *
 from engine.datatypes import *
 from engine.log import *
 
 import socket
+import selectors
 import threading
 import sqlite3 as sql
+import struct
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import Future, ThreadPoolExecutor
 from abc import ABC, abstractmethod
-import json
-from typing import Callable, List, Tuple, Any, Dict
+from typing import Callable, List, Tuple, Any, Dict, Iterable
 import time
 
 
 
-RECORD_SEPARATOR = chr(30)
-END_OF_MESSAGE_SEPARATOR = chr(31)
-RECORD_SEPARATOR_BYTES = RECORD_SEPARATOR.encode("ascii")
-END_OF_MESSAGE_SEPARATOR_BYTES = END_OF_MESSAGE_SEPARATOR.encode("ascii")
+MAX_TCP_READ_PER_EVENT = 64 * 1024 # bytes read from a single client per tick, the rest stays in the socket until the next tick
 
 
 
@@ -30,12 +34,14 @@ class Network(ABC):
     """
 
     def __init__(self, address, port):
-        self._packet_size = 4096
+        self.mtu = DEFAULT_MTU
 
         self.port = port
         self.address = address
         self._running = True
 
+        self._codec: Codec = CODECS[JsonCodec.name]
+
         self._receive_priority_buffer = AdvancedQueue()
         self._receive_unpriority_buffer = AdvancedQueue()
         self._send_priority_buffer = AdvancedQueue()
@@ -71,74 +77,113 @@ class Network(ABC):
 
 
     @property
-    def running(self):
-        """ bool - True if the network is running, False otherwise. """
-        return self._running
+    def mtu(self):
+        """ int - Maximum size of a sent UDP datagram in bytes. Larger messages are fragmented. Default is 1200, which fits typical path MTU without IP fragmentation. """
+        return self.__mtu
 
 
-    @staticmethod
-    def _parse_data(data: bytes) -> List[Tuple[bool, Any]]:
-        """ Parses a raw byte stream potentially containing multiple messages """
-        parsed_data = []
-        try:
-            if data.endswith(END_OF_MESSAGE_SEPARATOR_BYTES):
-                data = data[:-1]
+    @mtu.setter
+    def mtu(self, value):
+        if isinstance(value, int) and 576 <= value <= MAX_DATAGRAM_SIZE:
+            self.__mtu = value
+        else:
+            raise TypeError(f"MTU must be an integer between 576 and {MAX_DATAGRAM_SIZE}:", value)
 
-            decoded = data.decode("ascii")
-            data_stream = decoded.split(RECORD_SEPARATOR)
 
-            def convert(obj):
-                if isinstance(obj, dict):
-                    if obj.get("_type") == "Vector":
-                        return Vector(obj["x"], obj["y"])
-                    return {k: convert(v) for k, v in obj.items()}
+    @property
+    def running(self):
+        """ bool - True if the network is running, False otherwise. """
+        return self._running
 
-                if isinstance(obj, (list, tuple)):
-                    return [convert(item) for item in obj]
 
-                return obj
+    @property
+    def codec(self):
+        """ Codec - Codec used to encode outgoing messages. Incoming messages are always decoded with the codec they were encoded with. """
+        return self._codec
 
-            for json_str in data_stream:
-                if not json_str:
-                    continue
 
-                payload = convert(json.loads(json_str))
-                parsed_data.append(payload)
+    @staticmethod
+    def _parse_data(data: bytes) -> List[Tuple[str, Any]]:
+        """ Parses a raw batch potentially containing multiple messages """
+        parsed_data = []
+        try:
+            parsed_data = get_codec_for(data).decode(data)
 
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        except (ValueError, TypeError, IndexError, struct.error, UnicodeDecodeError) as e:
             #?ifdef CLIENT
-            log_client(f"Error parsing data chunk: {e} (Data: {data[:100]}...)", LogType.WARNING)
+            log_client(f"Error parsing data chunk: {e} (Data: {bytes(data[:100])}...)", LogType.WARNING)
             #?endif
             #?ifdef ENGINE
             return parsed_data
             #?endif
             #?ifdef SERVER
-            log_server(f"Error parsing data chunk: {e} (Data: {data[:100]}...)", LogType.WARNING)
+            log_server(f"Error parsing data chunk: {e} (Data: {bytes(data[:100])}...)", LogType.WARNING)
             #?endif
         except Exception as e:
             #?ifdef CLIENT
-            log_client(f"Unexpected error parsing data: {e} (Data: {data[:100]}...)", LogType.ERROR)
+            log_client(f"Unexpected error parsing data: {e} (Data: {bytes(data[:100])}...)", LogType.ERROR)
             #?endif
             #?ifdef ENGINE
             return parsed_data
             #?endif
             #?ifdef SERVER
-            log_server(f"Unexpected error parsing data: {e} (Data: {data[:100]}...)", LogType.ERROR)
+            log_server(f"Unexpected error parsing data: {e} (Data: {bytes(data[:100])}...)", LogType.ERROR)
             #?endif
         return parsed_data
 
 
+    def _parse_for_send(self, cmd: str, data: Any, codec: Codec = None) -> bytes:
+        """ Encodes a single message with the given codec or with the negotiated one. """
+        return (codec or self._codec).encode(cmd, data)
+
+
     @staticmethod
-    def _parse_for_send(cmd: str, data: Any) -> str:
-        class VectorEncoder(json.JSONEncoder):
-            def default(self, obj):
-                if isinstance(obj, Vector):
-                    return {"_type": "Vector", "x": obj.x, "y": obj.y}
-                return super().default(obj)
+    def _select_codec(offered: Iterable[str], supported: Iterable[str]) -> Codec:
+        """ Returns the first offered codec, which is also supported, or the JSON codec if there is none. """
+        for name in offered:
+            if name in supported and name in CODECS:
+                return CODECS[name]
+        return CODECS[JsonCodec.name]
+
+
+    def _pack_datagrams(self, codec: Codec, payloads: List[bytes], channel: DatagramChannel) -> List[bytes]:
+        """
+        Packs encoded messages into as few batches as possible, each fitting in a single datagram of MTU size.
+        Batch, which doesn't fit in a datagram, because of a single large message, is sent as fragments.
+        Returns:
+            list[bytes] - Datagrams prefixed with the channel's sequence numbers.
+        """
+        max_batch_size = self.mtu - DATAGRAM_HEADER.size
+        batches = []
+        current_batch = []
+        current_batch_size = codec.batch_overhead
 
-        payload = (cmd, data)
-        encoded = json.dumps(payload, cls=VectorEncoder)
-        return encoded
+        for payload in payloads:
+            payload_len = len(payload) + codec.record_overhead
+
+            if current_batch and current_batch_size + payload_len > max_batch_size:
+                batches.append(codec.pack(current_batch))
+                current_batch = []
+                current_batch_size = codec.batch_overhead
+
+            current_batch.append(payload)
+            current_batch_size += payload_len
+
+        if current_batch:
+            batches.append(codec.pack(current_batch))
+
+        datagrams = []
+        for batch in batches:
+            try:
+                datagrams.extend(channel.to_datagrams(batch, self.mtu))
+            except ValueError as e:
+                #?ifdef CLIENT
+                log_client(f"Batch is too large to be sent: {e}", LogType.WARNING)
+                #?endif
+                #?ifdef SERVER
+                log_server(f"Batch is too large to be sent: {e}", LogType.WARNING)
+                #?endif
+        return datagrams
 
 
     @abstractmethod
@@ -171,14 +216,16 @@ class ClientNetwork(Network):
     UDP for priority data.
     """
 
-    def __init__(self, address: str, port: int):
+    def __init__(self, address: str, port: int, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name)):
         """
         Args:
             address: The address of the server.
             port: The UDP port of the server. TCP port will be port + 1.
+            codecs: Names of codecs the client offers to the server, in order of preference. Until server picks one, JSON is used.
         """
         super().__init__(address, port)
         self.tcp_port = self.port + 1
+        self.__codecs = codecs
 
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -186,12 +233,18 @@ class ClientNetwork(Network):
         self.udp_recv_thread = None
         self.__id = 0
         self.__server_ip = None
+        self.__udp_channel = DatagramChannel()
+        self.tcp_bytes_sent = 0
+        self.tcp_bytes_received = 0
 
         try:
             self.tcp_socket.connect((self.address, self.tcp_port))
             self.__server_ip = self.tcp_socket.getpeername()[0]
             log_client(f"Connected to server at {self.__server_ip}:{self.tcp_port}", LogType.INFO)
 
+            hello_msg = self._codec.pack([self._parse_for_send("hello", list(self.__codecs))])
+            self.tcp_socket.sendall(frame(hello_msg))
+
             self.tcp_conn_thread = threading.Thread(target=self.__handle_tcp_connection, daemon=True)
             self.tcp_conn_thread.start()
 
@@ -223,11 +276,30 @@ class ClientNetwork(Network):
             -1 -> (Server-side meaning, client shouldn't see this directly often)
             -2 -> Registration failed: user already exists.
             -3 -> Login failed: invalid credentials.
+            -4 -> Resume failed: session expired or the token is invalid.
             -10 -> Disconnected or connection failed.
         """
         return self.__id
 
 
+    @property
+    def udp_channel(self):
+        """ DatagramChannel - Sequence numbers and loss counters of UDP datagrams exchanged with the server. """
+        return self.__udp_channel
+
+
+    @property
+    def bytes_sent(self):
+        """ int - Number of bytes sent to the server over TCP and UDP, including framing and datagram headers. """
+        return self.tcp_bytes_sent + self.__udp_channel.bytes_sent
+
+
+    @property
+    def bytes_received(self):
+        """ int - Number of bytes received from the server over TCP and UDP, including framing and datagram headers. """
+        return self.tcp_bytes_received + self.__udp_channel.bytes_received
+
+
     def send(self, cmd: str, data, has_priority=False):
         """
         Adds data to the output buffer to be sent on the next tick.
@@ -259,8 +331,8 @@ class ClientNetwork(Network):
 
         if udp_payloads:
             try:
-                full_udp_message = (RECORD_SEPARATOR.join(udp_payloads) + END_OF_MESSAGE_SEPARATOR).encode('ascii')
-                self.udp_socket.sendto(full_udp_message, (self.address, self.port))
+                for full_udp_message in self._pack_datagrams(self._codec, udp_payloads, self.__udp_channel):
+                    self.udp_socket.sendto(full_udp_message, (self.address, self.port))
             except socket.error as e:
                 log_client(f"UDP send error: {e}", LogType.WARNING)
             except Exception as e:
@@ -268,8 +340,9 @@ class ClientNetwork(Network):
 
         if tcp_payloads:
             try:
-                full_tcp_message = (RECORD_SEPARATOR.join(tcp_payloads) + END_OF_MESSAGE_SEPARATOR).encode('ascii')
+                full_tcp_message = frame(self._codec.pack(tcp_payloads))
                 self.tcp_socket.sendall(full_tcp_message)
+                self.tcp_bytes_sent += len(full_tcp_message)
             except (BrokenPipeError, ConnectionResetError, OSError) as e:
                 log_client(f"TCP send error (connection lost): {e}", LogType.WARNING)
                 self.stop()
@@ -278,24 +351,26 @@ class ClientNetwork(Network):
 
     def __handle_tcp_connection(self):
         """ Handles receiving data from the TCP connection. """
-        buffer = b""
+        reader = FrameReader()
         while self.running:
             try:
-                data = self.tcp_socket.recv(self._packet_size)
-                if not data:
+                if not reader.recv_from(self.tcp_socket):
                     log_client("TCP connection closed by server.", LogType.INFO)
                     break
 
-                buffer += data
-
-                while END_OF_MESSAGE_SEPARATOR_BYTES in buffer:
-                    message, buffer = buffer.split(END_OF_MESSAGE_SEPARATOR_BYTES, 1)
-                    parsed_packets = self._parse_data(message + END_OF_MESSAGE_SEPARATOR_BYTES) # Add back separator for parsing logic
+                for message in reader.frames():
+                    self.tcp_bytes_received += FRAME_HEADER.size + len(message)
+                    parsed_packets = self._parse_data(message)
 
                     unpriority_data = []
                     for payload in parsed_packets:
-                        unpriority_data.append(payload)
                         cmd, response_data = payload
+                        if cmd == "codec":
+                            self._codec = self._select_codec((response_data,), self.__codecs)
+                            log_client(f"Using {self._codec.name} codec.", LogType.INFO)
+                            continue
+
+                        unpriority_data.append(payload)
 
                         match cmd:
                             case "register_outcome":
@@ -305,8 +380,7 @@ class ClientNetwork(Network):
                                     continue
                                 
                                 log_client(f"Registered with ID {self.__id}. Sending UDP registration...", LogType.INFO)
-                                udp_reg_msg = self._parse_for_send("register_udp", self.__id)
-                                full_udp_message = (udp_reg_msg + END_OF_MESSAGE_SEPARATOR).encode('ascii')
+                                full_udp_message = self.__udp_channel.wrap(self._codec.pack([self._parse_for_send("register_udp", self.__id)]))
                                 try:
                                     self.udp_socket.sendto(full_udp_message, (self.address, self.port))
                                     if self.udp_recv_thread and not self.udp_recv_thread.is_alive():
@@ -340,7 +414,7 @@ class ClientNetwork(Network):
 
         while self.running:
             try:
-                data, addr = self.udp_socket.recvfrom(self._packet_size)
+                data, addr = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
                 if not data:
                     continue
 
@@ -348,7 +422,16 @@ class ClientNetwork(Network):
                     log_client(f"Received UDP data from unknown address {addr}. Ignoring data.", LogType.INFO)
                     continue
 
-                parsed_packets = self._parse_data(data)
+                try:
+                    batch = self.__udp_channel.receive(data)
+                except (ValueError, struct.error) as e:
+                    log_client(f"Invalid UDP datagram: {e}", LogType.WARNING)
+                    continue
+                # stale, duplicated or incomplete fragment
+                if batch is None:
+                    continue
+
+                parsed_packets = self._parse_data(batch)
 
                 priority_data = []
                 for payload in parsed_packets:
@@ -397,73 +480,363 @@ class ClientNetwork(Network):
 
 
 #?ifdef SERVER
-class ServerNetwork(Network):
+class UserDatabase:
     """
-    Network class for the server. Handles TCP connections for login/non-priority data
-    and UDP for priority data.
+    Stores registered users in the sqlite database and checks their credentials.
+    Passwords are stored as salted PBKDF2 hashes. Slow hashing is the point, so logins should be submitted to the worker pool,
+    which doesn't block network threads. Each worker has its own connection and the database uses WAL mode, so logins run in parallel.
     """
 
-    def __init__(self, address: str, port: int, max_connections: int, on_connect: Callable[[int], None], on_disconnect: Callable[[int], None] = None):
+    HASH_NAME = "pbkdf2_sha256"
+    SALT_SIZE = 16
+
+    def __init__(self, path: str = "server.db", workers: int = 4, hash_iterations: int = 100_000):
         """
         Args:
-            address: The address of the server.
-            port: The UDP port for the server. TCP port will be port + 1.
-            max_connections: The maximum number of TCP connections allowed.
-            on_connect: A function called when a client successfully connects and logs in (passes client ID).
-            on_disconnect: A function called when a client disconnects (passes client ID).
+            path: Path to the sqlite database file. If it is ":memory:", the database is kept in memory and only a single worker is used.
+            workers: Number of threads, which check credentials. If it is 0, no threads are started and submitted requests are checked right away in the calling thread.
+            hash_iterations: Number of PBKDF2 iterations of new password hashes. Existing hashes keep their number of iterations.
         """
-        super().__init__(address, port)
-        self.max_connections = max_connections
-        self.__tcp_port = self.port + 1
-        self.__on_connect = on_connect
-        self.__on_disconnect = on_disconnect
-
-        self.__db_conn = sql.connect("server.db", check_same_thread=False)
-        self.__db_cursor = self.__db_conn.cursor()
-        self.__db_cursor.execute("""
+        if not isinstance(workers, int) or workers < 0:
+            raise TypeError("Workers must be a non-negative integer:", workers)
+        self.hash_iterations = hash_iterations
+        in_memory = path == ":memory:"
+        # every connection to ":memory:" would have its own database, so connections share a named one
+        self.__path = f"file:users_{id(self)}?mode=memory&cache=shared" if in_memory else path
+        self.__local = threading.local()
+        self.__connections: List[sql.Connection] = []
+        self.__connections_lock = threading.Lock()
+
+        conn = self.__get_connection()
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY,
                 username TEXT UNIQUE,
                 password TEXT
             )
         """)
-        self.__db_conn.commit()
+        conn.commit()
+        # hashed, when the user doesn't exist, so the response time doesn't reveal it
+        self.__dummy_hash = self.__hash_password("", os.urandom(self.SALT_SIZE), self.hash_iterations)
+        self.__pool = ThreadPoolExecutor(1 if in_memory else workers, thread_name_prefix="auth") if workers else None
 
-        self.__id_to_tcp_conn: Dict[int, socket.socket] = {}
-        self.__tcp_conn_to_id: Dict[socket.socket, int] = {}
-        self.__id_to_udp_addr: Dict[int, tuple] = {}
-        self.__udp_addr_to_id: Dict[tuple, int] = {}
-        self.__connected_ids = set()
 
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    @property
+    def hash_iterations(self):
+        """ int - Number of PBKDF2 iterations of new password hashes. """
+        return self.__hash_iterations
+
+
+    @hash_iterations.setter
+    def hash_iterations(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__hash_iterations = value
+        else:
+            raise TypeError("Hash iterations must be a positive integer:", value)
+
+
+    def submit(self, request: str, data: tuple, addr: tuple) -> Future:
+        """
+        Handles 'register' or 'login' request in the worker pool. Without workers, it is handled right away and the returned future is already done.
+        Returns:
+            Future[int] - Result of handle_login.
+        """
+        if self.__pool:
+            return self.__pool.submit(self.handle_login, request, data, addr)
+
+        result = Future()
         try:
-            self.udp_socket.bind((self.address, self.port))
-            log_server(f"UDP Socket listening on {self.address}:{self.port}", LogType.INFO)
-        except socket.error as e:
-            log_server(f"Failed to bind UDP socket: {e}", LogType.ERROR)
-            raise
+            result.set_result(self.handle_login(request, data, addr))
+        except Exception as e:
+            result.set_exception(e)
+        return result
 
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow address reuse
+
+    def handle_login(self, request: str, data: tuple, addr: tuple) -> int:
+        """
+        Handles 'register' or 'login' request in the calling thread.
+        Returns:
+            Positive int: User ID on success.
+            -1: User already logged in (checked later in handler).
+            -2: Registration failed: username exists.
+            -3: Login failed: invalid username/password.
+            0: Invalid request type.
+        """
         try:
-            self.tcp_socket.bind((self.address, self.tcp_port))
-            self.tcp_socket.listen(self.max_connections)
-            log_server(f"TCP Socket listening on {self.address}:{self.tcp_port}", LogType.INFO)
-        except socket.error as e:
-            log_server(f"Failed to bind TCP socket: {e}", LogType.ERROR)
-            self.udp_socket.close()
-            raise
+            username, password = data
+        except (TypeError, ValueError):
+            log_server(f"Invalid login data format from {addr}.", LogType.WARNING)
+            return 0
+
+        if not isinstance(username, str) or not isinstance(password, str):
+            log_server(f"Invalid login data format from {addr}.", LogType.WARNING)
+            return 0
+
+        match request:
+            case "register":
+                result = self.__register(username, password) # Returns ID or -1 (exists)
+                if result == -1:
+                    return -2
+                return result
+
+            case "login":
+                result = self.__login(username, password) # Returns ID or -1 (not found/wrong pass)
+                if result == -1:
+                    return -3
+                return result
+
+            case _:
+                log_server(f"Invalid request type '{request}' from {addr}.", LogType.WARNING)
+                return 0
+
+
+    def __get_connection(self) -> sql.Connection:
+        """ Returns the connection of the current thread. It is opened on the first use. """
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = self.__local.conn = sql.connect(self.__path, timeout=10, check_same_thread=False, uri=self.__path.startswith("file:"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.__connections_lock:
+                self.__connections.append(conn)
+        return conn
+
+
+    def __register(self, username, password) -> int:
+        """ Registers a user. Returns user ID or -1 if username exists. """
+        conn = self.__get_connection()
+        try:
+            if conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone() is not None:
+                return -1
+
+            password_hash = self.__hash_password(password, os.urandom(self.SALT_SIZE), self.hash_iterations)
+            with conn:
+                cursor = conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
+            return cursor.lastrowid
+        except sql.IntegrityError:
+            # registered by another worker in the meantime
+            return -1
+        except sql.Error as e:
+            log_server(f"Database error during registration: {e}", LogType.ERROR)
+            return -1
+
+
+    def __login(self, username, password) -> int:
+        """ Logs in a user. Returns user ID or -1 if not found or wrong password. """
+        conn = self.__get_connection()
+        try:
+            user = conn.execute("SELECT id, password FROM users WHERE username=?", (username,)).fetchone()
+            if user is None:
+                self.__check_password(password, self.__dummy_hash)
+                return -1
+
+            user_id, stored = user
+            if not self.__check_password(password, stored):
+                return -1
+
+            if not stored.startswith(self.HASH_NAME + "$"):
+                # created before passwords were hashed
+                with conn:
+                    conn.execute("UPDATE users SET password=? WHERE id=?", (self.__hash_password(password, os.urandom(self.SALT_SIZE), self.hash_iterations), user_id))
+            return user_id
+        except sql.Error as e:
+            log_server(f"Database error during login: {e}", LogType.ERROR)
+            return -1
+
+
+    @classmethod
+    def __hash_password(cls, password: str, salt: bytes, iterations: int) -> str:
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+        return f"{cls.HASH_NAME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+    @classmethod
+    def __check_password(cls, password: str, stored: str) -> bool:
+        """ Compares the password with the stored hash in constant time. Stored value without the hash prefix is a plaintext password. """
+        parts = stored.split("$")
+        if len(parts) != 4 or parts[0] != cls.HASH_NAME:
+            return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        try:
+            expected = cls.__hash_password(password, bytes.fromhex(parts[2]), int(parts[1]))
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected, stored)
+
+
+    def close(self):
+        """ Waits for submitted requests and closes all database connections. """
+        if self.__pool:
+            self.__pool.shutdown(wait=True, cancel_futures=True)
+        with self.__connections_lock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections.clear()
+
+
+
+class SessionStore:
+    """
+    Resumable session tokens of logged in clients. Client gets a token at login and it can reconnect with it instead of credentials.
+    Each client has at most one valid token and every token can be redeemed only once, so a new one is issued on every login and resume.
+    """
+
+    def __init__(self):
+        self.__tokens: Dict[str, int] = {}
+        self.__client_tokens: Dict[int, str] = {}
+
+
+    def issue(self, client_id: int) -> str:
+        """
+        Replaces the token of the client with a new one.
+        Args:
+            client_id: ID of the logged in client.
+        Returns:
+            str - New token.
+        """
+        self.revoke(client_id)
+        token = secrets.token_urlsafe(24)
+        self.__tokens[token] = client_id
+        self.__client_tokens[client_id] = token
+        return token
+
+
+    def redeem(self, token) -> int:
+        """
+        Invalidates the token.
+        Args:
+            token: Token received from a client.
+        Returns:
+            int - ID of the client, whose session the token belongs to, or 0 if the token is invalid.
+        """
+        if not isinstance(token, str):
+            return 0
+        client_id = self.__tokens.pop(token, 0)
+        self.__client_tokens.pop(client_id, None)
+        return client_id
+
+
+    def revoke(self, client_id: int):
+        """ Invalidates the token of the client, e.g. when its session can't be resumed anymore. """
+        token = self.__client_tokens.pop(client_id, None)
+        if token:
+            del self.__tokens[token]
+
+
+    def clear(self):
+        """ Invalidates all tokens. """
+        self.__tokens.clear()
+        self.__client_tokens.clear()
+
+
+
+class Connection:
+    """ State of a single client on the server, which is common to all transports. It should be updated only by the server network. """
+
+    def __init__(self, handle, addr, codec: Codec):
+        """
+        Args:
+            handle: Transport object of the connection, e.g. its socket. Server network finds the connection by it.
+            addr: Address of the client, which is used in logs and by the user database.
+            codec: Codec used until the client negotiates its own.
+        """
+        self.handle = handle
+        self.addr = addr
+        self.client_id = 0
+        self.codec = codec
+        self.udp_addr = None # address, which priority messages are sent to, once the client registers it
+        self.udp_channel = DatagramChannel()
+        self.deferred: List[bytes] = []
+        self.deferred_size = 0
+        self.over_budget_since = None
+        self.login: Future | None = None # login or registration, which is checked by the worker pool
+        self.backlog = [] # messages received while the login is checked
+
+
+    @property
+    def buffered(self):
+        """ int - Number of bytes, which were handed to the transport, but weren't sent yet. """
+        return 0
+
+
+    @property
+    def queue_depth(self):
+        """ int - Number of bytes waiting to be sent, including deferred messages. """
+        return self.buffered + self.deferred_size
+
+
+    def defer(self, payloads: List[bytes]):
+        """ Holds encoded messages back until the transport drains. """
+        self.deferred.extend(payloads)
+        self.deferred_size += sum(len(payload) for payload in payloads)
+
 
-        self.__tcp_accept_thread = threading.Thread(target=self.__accept_tcp_connections, daemon=True)
-        self.__udp_read_thread = threading.Thread(target=self.__handle_udp_reads, daemon=True)
+    def take_deferred(self) -> List[bytes]:
+        """ Returns all deferred messages and clears them. """
+        payloads = self.deferred
+        self.deferred = []
+        self.deferred_size = 0
+        return payloads
 
-        self.__tcp_accept_thread.start()
-        self.__udp_read_thread.start()
+
+
+class ClientConnection(Connection):
+    """ State of a single TCP connection on the server. It should be updated only by the ServerNetwork. """
+
+    def __init__(self, sock: socket.socket, addr: tuple, codec: Codec):
+        super().__init__(sock, addr, codec)
+        self.sock = sock
+        self.reader = FrameReader()
+        self.outgoing = bytearray()
+
+
+    @property
+    def buffered(self):
+        """ int - Number of bytes in the outgoing buffer. """
+        return len(self.outgoing)
+
+
+
+class ServerNetworkBase(Network):
+    """
+    Common base of server networks. Handles everything, which doesn't depend on the transport:
+    encoding for each client's codec, send budgets, logins, session tokens and registration of datagram addresses.
+    Subclasses move bytes through their transport by implementing _write, _send_datagram and _release.
+    """
+
+    def __init__(self, address: str, port: int, max_connections: int, on_connect: Callable[[int], None], on_disconnect: Callable[[int], None], codecs: Tuple[str], high_water_mark: int, max_over_budget_time: float, users: UserDatabase, on_resume: Callable[[int], None] = None):
+        """
+        Args:
+            address: The address of the server.
+            port: The port of the server.
+            max_connections: The maximum number of connections allowed.
+            on_connect: A function called when a client successfully connects and logs in (passes client ID).
+            on_disconnect: A function called when a client disconnects (passes client ID).
+            codecs: Names of codecs the server accepts. Client's most preferred codec from this list is used for that client.
+            high_water_mark: Number of unsent bytes per client, above which new reliable messages are deferred and priority messages are dropped.
+            max_over_budget_time: Time in seconds a client can stay above the high-water mark before it is disconnected.
+            users: Database, which checks logins and registrations.
+            on_resume: A function called instead of on_connect, when a client reconnects with its session token (passes client ID). If None, on_connect is called.
+        """
+        super().__init__(address, port)
+        self.max_connections = max_connections
+        self.high_water_mark = high_water_mark
+        self.max_over_budget_time = max_over_budget_time
+        self.__codecs = codecs
+        self.__on_connect = on_connect
+        self.__on_disconnect = on_disconnect
+        self.__on_resume = on_resume or on_connect
+
+        self._users = users
+        self.__sessions = SessionStore()
+
+        self._connections: Dict[Any, Connection] = {}
+        self._id_to_conn: Dict[int, Connection] = {}
+        self._udp_addr_to_id: Dict[Any, int] = {}
 
 
     @property
     def max_connections(self):
-        """ int - The maximum number of TCP connections allowed. """
+        """ int - The maximum number of connections allowed. """
         return self.__max_connections
 
 
@@ -471,16 +844,54 @@ class ServerNetwork(Network):
     def max_connections(self, value):
         if isinstance(value, int) and value > 0:
             self.__max_connections = value
-            if hasattr(self, 'tcp_socket') and self.tcp_socket:
-                self.tcp_socket.listen(value)
         else:
             raise TypeError("Max connections must be a positive integer:", value)
-        
+
 
     @property
-    def tcp_port(self):
-        """ int - The TCP port of the server. """
-        return self.__tcp_port
+    def high_water_mark(self):
+        """ int - Number of unsent bytes per client, above which new reliable messages are deferred and priority messages are dropped. """
+        return self.__high_water_mark
+
+
+    @high_water_mark.setter
+    def high_water_mark(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__high_water_mark = value
+        else:
+            raise TypeError("High-water mark must be a positive integer:", value)
+
+
+    @property
+    def max_over_budget_time(self):
+        """ float - Time in seconds a client can stay above the high-water mark before it is disconnected. """
+        return self.__max_over_budget_time
+
+
+    @max_over_budget_time.setter
+    def max_over_budget_time(self, value):
+        if isinstance(value, (int, float)) and value >= 0:
+            self.__max_over_budget_time = value
+        else:
+            raise TypeError("Max over budget time must be a positive float:", value)
+
+
+    @property
+    def queue_depths(self):
+        """ dict[int, int] - Number of unsent bytes for each connected client. """
+        return {client_id: conn.queue_depth for client_id, conn in list(self._id_to_conn.items())}
+
+
+    @property
+    def udp_channels(self):
+        """ dict[int, DatagramChannel] - Datagram sequence numbers and loss counters of each connected client. """
+        return {client_id: conn.udp_channel for client_id, conn in list(self._id_to_conn.items())}
+
+
+    def get_codec(self, client_id: int) -> Codec | None:
+        """ Returns the codec negotiated with the client or None if the client isn't connected. """
+        conn = self._id_to_conn.get(client_id)
+        return conn.codec if conn else None
 
 
     def send(self, client_id: int, cmd: str, data, has_priority=False):
@@ -490,358 +901,564 @@ class ServerNetwork(Network):
             client_id: The ID of the client to send data to.
             cmd: The command to send.
             data: The data to send.
-            has_priority: If True, data will be sent via UDP; otherwise via TCP.
+            has_priority: If True, data will be sent as a datagram; otherwise through the reliable stream.
         """
-        if not self.running:
-            return
+        conn = self.__get_connection(client_id)
+        if conn:
+            self.__enqueue(conn, cmd, self._parse_for_send(cmd, data, conn.codec), has_priority)
 
-        if client_id not in self.__connected_ids:
+
+    def send_encoded(self, client_id: int, message: EncodedMessage, has_priority=False):
+        """
+        Same as send, but the message is encoded only once for all clients, which use the same codec.
+        Args:
+            client_id: The ID of the client to send data to.
+            message: The message to send.
+            has_priority: If True, data will be sent as a datagram; otherwise through the reliable stream.
+        """
+        conn = self.__get_connection(client_id)
+        if conn:
+            self.__enqueue(conn, message.cmd, message.encode(conn.codec), has_priority)
+
+
+    def send_parts(self, client_id: int, cmd: str, parts: List[EncodedPart], has_priority=False, sequence: int = 0):
+        """
+        Joins pre-encoded parts of a list command and sends them to a specific client on the next tick.
+        Parts are split into as many records as needed to fit each in a single datagram.
+        Args:
+            client_id: The ID of the client to send data to.
+            cmd: The list command.
+            parts: Parts to send. Each of them is encoded only once for all clients, which use the same codec.
+            has_priority: If True, data will be sent as a datagram; otherwise through the reliable stream.
+            sequence: Sequence number written to every record. Refer to the join_parts function for more information.
+        """
+        conn = self.__get_connection(client_id)
+        if not conn:
             return
 
-        parsed_data = self._parse_for_send(cmd, data)
+        codec = conn.codec
+        max_size = self.mtu - DATAGRAM_HEADER.size - codec.batch_overhead - codec.record_overhead
+        for record in join_parts(codec, cmd, parts, max_size, sequence):
+            self.__enqueue(conn, cmd, record, has_priority)
+
+
+    def __get_connection(self, client_id: int) -> Connection | None:
+        """ Returns the connection of a logged in client or None if the client isn't connected or the network is stopped. """
+        if not self.running:
+            return None
+        return self._id_to_conn.get(client_id)
+
+
+    def __enqueue(self, conn: Connection, cmd: str, parsed_data: bytes, has_priority: bool):
         if has_priority:
-            if client_id in self.__id_to_udp_addr:
-                self._send_priority_buffer.add_data((client_id, parsed_data))
+            if conn.udp_addr is not None:
+                self._send_priority_buffer.add_data((conn.client_id, parsed_data))
             else:
-                log_server(f"Warning: No UDP address for client {client_id}. Cannot send priority message '{cmd}'.", LogType.WARNING)
+                log_server(f"Warning: No UDP address for client {conn.client_id}. Cannot send priority message '{cmd}'.", LogType.WARNING)
         else:
-            if client_id in self.__id_to_tcp_conn:
-                self._send_unpriority_buffer.add_data((client_id, parsed_data))
-            else:
-                log_server(f"Warning: No TCP connection for client {client_id}. Cannot send non-priority message '{cmd}'.", LogType.WARNING)
+            self._send_unpriority_buffer.add_data((conn.client_id, parsed_data))
 
 
-    def tick(self):
+    def _take_output(self) -> Tuple[Dict[int, List[bytes]], Dict[int, List[bytes]]]:
         """
-        Called only by the engine.
-        Sends data from the output buffer to clients via UDP (priority) or TCP (non-priority).
+        Empties the output buffers.
+        Returns:
+            tuple[dict[int, list[bytes]], dict[int, list[bytes]]] - Priority and non-priority messages by client ID.
         """
-        if not self.running:
-            return
-        
-        udp_payloads = self._send_priority_buffer.get_all_data()
-        tcp_payloads = self._send_unpriority_buffer.get_all_data()
-
         data_by_client_udp = {}
         data_by_client_tcp = {}
-
-        for client_id, parsed_data in udp_payloads:
+        for client_id, parsed_data in self._send_priority_buffer.get_all_data():
             data_by_client_udp.setdefault(client_id, []).append(parsed_data)
-        for client_id, parsed_data in tcp_payloads:
+        for client_id, parsed_data in self._send_unpriority_buffer.get_all_data():
             data_by_client_tcp.setdefault(client_id, []).append(parsed_data)
+        return data_by_client_udp, data_by_client_tcp
+
 
+    def _dispatch(self, data_by_client_udp: Dict[int, List[bytes]], data_by_client_tcp: Dict[int, List[bytes]], now: float):
+        """
+        Sends priority messages as datagrams and hands deferred reliable messages to the transport of every client, which is below the high-water mark.
+        Clients, which stay above it for too long, are disconnected.
+        Args:
+            data_by_client_udp: Priority messages by client ID returned by _take_output.
+            data_by_client_tcp: Non-priority messages by client ID returned by _take_output.
+            now: Current time in seconds.
+        """
         for client_id, payloads in data_by_client_udp.items():
-            udp_addr = self.__id_to_udp_addr.get(client_id)
-            if not udp_addr or not payloads:
+            conn = self._id_to_conn.get(client_id)
+            if not conn or conn.udp_addr is None:
+                continue
+            # Client can't keep up, priority messages are superseded by newer ones anyway
+            if conn.queue_depth > self.high_water_mark:
                 continue
+            for datagram in self._pack_datagrams(conn.codec, payloads, conn.udp_channel):
+                if not self._send_datagram(conn, datagram):
+                    break
 
-            current_batch = []
-            current_batch_size = len(END_OF_MESSAGE_SEPARATOR_BYTES)
+        for client_id, payloads in data_by_client_tcp.items():
+            conn = self._id_to_conn.get(client_id)
+            if conn:
+                conn.defer(payloads)
 
-            for payload in payloads:
-                try:
-                    payload_bytes = payload.encode('ascii')
-                except UnicodeEncodeError as e:
-                    log_server(f"Error encoding UDP payload for client {client_id}: {e}", LogType.ERROR)
-                    continue
+        for conn in list(self._id_to_conn.values()):
+            if conn.deferred and conn.buffered < self.high_water_mark:
+                self._write(conn, conn.codec.pack(conn.take_deferred()))
+            self.__check_budget(conn, now)
 
-                payload_len = len(payload_bytes)
-                separator_len = len(RECORD_SEPARATOR_BYTES) if current_batch else 0
 
-                if payload_len + separator_len + len(END_OF_MESSAGE_SEPARATOR_BYTES) > self._packet_size:
-                    log_server(f"Payload size exceeds packet size for client {client_id}: {payload_len + separator_len + len(END_OF_MESSAGE_SEPARATOR_BYTES)} > {self._packet_size}", LogType.WARNING)
-                    continue
+    def __check_budget(self, conn: Connection, now: float):
+        """ Disconnects the client, if it stays above the high-water mark for too long. """
+        if conn.queue_depth <= self.high_water_mark:
+            conn.over_budget_since = None
+            return
 
-                if current_batch_size + separator_len + payload_len > self._packet_size:
-                    try:
-                        batch_message = (RECORD_SEPARATOR.join(current_batch) + END_OF_MESSAGE_SEPARATOR).encode('ascii')
-                        self.udp_socket.sendto(batch_message, udp_addr)
-                    except socket.error as e:
-                        log_server(f"UDP send error (batch) to {udp_addr} (ID: {client_id}): {e}", LogType.WARNING)
-                        current_batch = []
-                        break
-                    except Exception as e:
-                        log_server(f"Error encoding/sending UDP batch to {udp_addr} (ID: {client_id}): {e}", LogType.ERROR)
-                        current_batch = []
-                        break
-
-                    current_batch = [payload]
-                    current_batch_size = len(END_OF_MESSAGE_SEPARATOR_BYTES) + payload_len
-                else:
-                    current_batch.append(payload)
-                    current_batch_size += separator_len + payload_len
+        if conn.over_budget_since is None:
+            conn.over_budget_since = now
+        elif now - conn.over_budget_since > self.max_over_budget_time:
+            log_server(f"Client {conn.client_id} stayed over its send budget ({conn.queue_depth} bytes queued) for {self.max_over_budget_time} s. Disconnecting.", LogType.WARNING)
+            self._close_connection(conn)
 
-            if not current_batch:
-                continue
-            try:
-                batch_message = (RECORD_SEPARATOR.join(current_batch) + END_OF_MESSAGE_SEPARATOR).encode('ascii')
-                self.udp_socket.sendto(batch_message, udp_addr)
-            except socket.error as e:
-                log_server(f"UDP send error (final batch) to {udp_addr} (ID: {client_id}): {e}", LogType.WARNING)
-            except Exception as e:
-                log_server(f"Error encoding/sending final UDP batch to {udp_addr} (ID: {client_id}): {e}", LogType.ERROR)
 
-        disconnected_clients = []
-        for client_id, payloads in data_by_client_tcp.items():
-            tcp_conn = self.__id_to_tcp_conn.get(client_id)
-            if tcp_conn and payloads:
-                try:
-                    full_tcp_message = (RECORD_SEPARATOR.join(payloads) + END_OF_MESSAGE_SEPARATOR).encode('ascii')
-                    tcp_conn.sendall(full_tcp_message)
-                except (BrokenPipeError, ConnectionResetError, OSError) as e:
-                    log_server(f"TCP send error (connection lost) to client {client_id}: {e}", LogType.INFO)
-                    disconnected_clients.append(client_id)
-                except Exception as e:
-                    log_server(f"Error encoding/sending TCP data to client {client_id}: {e}", LogType.ERROR)
-                    disconnected_clients.append(client_id)
+    def _handle_payloads(self, conn: Connection, payloads: list) -> bool:
+        """
+        Handles reliable messages received from the connection. Messages received while the login is checked wait in the backlog.
+        Returns:
+            bool - False if the connection was closed.
+        """
+        unpriority_packets = []
+        for payload in payloads:
+            if conn.client_id > 0:
+                unpriority_packets.append((conn.client_id, payload))
+            elif conn.login:
+                conn.backlog.append(payload)
+            elif not self.__handle_pre_login(conn, payload):
+                self._close_connection(conn)
+                return False
+        self._receive_unpriority_buffer.add_data_multiple(unpriority_packets)
+        return True
+
+
+    def __handle_pre_login(self, conn: Connection, payload) -> bool:
+        """
+        Handles a message from a client, which has not logged in yet.
+        Returns:
+            bool - False if the message was malformed and the connection should be closed.
+        """
+        # Expecting ('hello', [codecs]) and then ('register', (user, pass)), ('login', (user, pass)) or ('resume', token)
+        try:
+            cmd, login_data = payload
+        except (TypeError, ValueError):
+            log_server(f"Malformed message from {conn.addr} before login.", LogType.WARNING)
+            return False
 
-        for client_id in disconnected_clients:
-            self.__cleanup_client(client_id)
+        if cmd == "hello":
+            conn.codec = self._select_codec(login_data, self.__codecs)
+            self._write(conn, conn.codec.pack([self._parse_for_send("codec", conn.codec.name, conn.codec)]))
+            return True
 
+        if cmd == "resume":
+            client_id = self.__sessions.redeem(login_data)
+            self.__on_login(conn, client_id or -4, True)
+            return True
 
-    def __accept_tcp_connections(self):
-        """ Accepts incoming TCP connections and starts a handler thread for each. """
-        while self.running:
-            try:
-                conn, addr = self.tcp_socket.accept()
-                log_server(f"Accepted TCP connection from {addr}", LogType.INFO)
+        conn.login = self._users.submit(cmd, login_data, conn.addr)
+        return True
 
-                if len(self.__connected_ids) >= self.max_connections:
-                    log_server(f"Max connections reached. Closing connection from {addr}.", LogType.INFO)
-                    conn.close()
-                    continue
 
-                client_thread = threading.Thread(target=self.__handle_client_tcp, args=(conn, addr), daemon=True)
-                client_thread.start()
+    def _finish_logins(self):
+        """ Handles results of all logins, which were already checked. """
+        for conn in list(self._connections.values()):
+            if conn.login and conn.login.done():
+                self._finish_login(conn)
 
-            except socket.error as e:
-                if self.running:
-                    log_server(f"TCP accept error: {e}", LogType.WARNING)
-                break
-            except Exception as e:
-                log_server(f"Unexpected error in TCP accept loop: {e}", LogType.ERROR)
-                break
 
+    def _finish_login(self, conn: Connection) -> bool:
+        """
+        Handles the result of the finished login of the connection and then the messages, which were received while it was checked.
+        Returns:
+            bool - False if the connection was closed.
+        """
+        login, conn.login = conn.login, None
+        try:
+            result_id = login.result()
+        except Exception as e:
+            log_server(f"Unexpected error during login of {conn.addr}: {e}", LogType.ERROR)
+            self._close_connection(conn)
+            return False
 
-    def __handle_client_tcp(self, conn: socket.socket, addr: tuple):
-        """ Handles login, registration, and non-priority data for a single TCP client. """
-        client_id = 0
-        buffer = b""
+        self.__on_login(conn, result_id)
+        backlog, conn.backlog = conn.backlog, []
+        return self._handle_payloads(conn, backlog)
 
-        try:
-            while self.running and client_id == 0:
-                data = conn.recv(self._packet_size)
-                if not data:
-                    log_server(f"TCP connection closed by client {addr}.", LogType.INFO)
-                    conn.close()
-                    return
 
-                buffer += data
-                while END_OF_MESSAGE_SEPARATOR_BYTES in buffer:
-                    message, buffer = buffer.split(END_OF_MESSAGE_SEPARATOR_BYTES, 1)
-                    parsed_packets = self._parse_data(message + END_OF_MESSAGE_SEPARATOR_BYTES)
+    def __on_login(self, conn: Connection, result_id: int, resumed: bool = False):
+        """ Sends the outcome of the login to the client and connects it, if the login succeeded. """
+        if result_id <= 0:
+            self._write(conn, conn.codec.pack([self._parse_for_send("register_outcome", result_id, conn.codec)]))
+            return
 
-                    for payload in parsed_packets:
-                        # Expecting ('register', (user, pass)) or ('login', (user, pass))
-                        cmd, login_data = payload
-                        result_id = self.__handle_login(cmd, login_data, conn)
-
-                        if result_id > 0:
-                            client_id = result_id
-                            if client_id in self.__connected_ids:
-                                log_server(f"Client {addr} attempted to log in with an existing ID {client_id}. Closing connection.", LogType.INFO)
-                                self.send(client_id, "connected_from_another_location", client_id)
-                                time.sleep(0.1)
-                                self.__cleanup_client(client_id)
-
-                            self.__id_to_tcp_conn[client_id] = conn
-                            self.__tcp_conn_to_id[conn] = client_id
-                            self.__connected_ids.add(client_id)
-                            log_server(f"Client {addr} logged in with ID {client_id}.", LogType.INFO)
-                            self.send(client_id, "register_outcome", client_id)
-                            self.__on_connect(client_id)
-                            break
-                        else:
-                            self.send(client_id, "register_outcome", result_id)
-                            fail_msg = self._parse_for_send("register_outcome", result_id)
-                            full_fail_msg = (fail_msg + END_OF_MESSAGE_SEPARATOR).encode('ascii')
-                            conn.sendall(full_fail_msg)
-                            break
-                    if client_id > 0:
-                        break
-
-            while self.running and client_id > 0:
-                data = conn.recv(self._packet_size)
-                if not data:
-                    log_server(f"TCP connection closed by client {client_id if client_id > 0 else addr}.", LogType.INFO)
-                    break
+        old_conn = self._id_to_conn.get(result_id)
+        if old_conn:
+            log_server(f"Client {conn.addr} attempted to log in with an existing ID {result_id}. Closing connection.", LogType.INFO)
+            self._write(old_conn, old_conn.codec.pack([self._parse_for_send("connected_from_another_location", result_id, old_conn.codec)]))
+            self._cleanup_client(result_id)
 
-                buffer += data
-                while END_OF_MESSAGE_SEPARATOR_BYTES in buffer:
-                    message, buffer = buffer.split(END_OF_MESSAGE_SEPARATOR_BYTES, 1)
-                    parsed_packets = self._parse_data(message + END_OF_MESSAGE_SEPARATOR_BYTES)
+        conn.client_id = result_id
+        self._id_to_conn[result_id] = conn
+        log_server(f"Client {conn.addr} {'resumed session' if resumed else 'logged in'} with ID {result_id}.", LogType.INFO)
+        self.send(result_id, "register_outcome", result_id)
+        self.send(result_id, "session", self.__sessions.issue(result_id))
+        self._notify(self.__on_resume if resumed else self.__on_connect, result_id)
 
-                    unpriority_packets = []
-                    for payload in parsed_packets:
-                        unpriority_packets.append((client_id, payload))
 
-                    self._receive_unpriority_buffer.add_data_multiple(unpriority_packets)
+    def _notify(self, callback: Callable[[int], None], client_id: int):
+        """ Calls the connect, resume or disconnect callback. Subclasses, which handle connections outside of the engine thread, can postpone it to the tick. """
+        callback(client_id)
 
-        except (ConnectionResetError, BrokenPipeError, OSError) as e:
-            log_server(f"TCP connection error: {e}", LogType.INFO)
-        except Exception as e:
-            log_server(f"Unexpected error in TCP handler for {client_id if client_id > 0 else addr}: {e}", LogType.ERROR)
-        finally:
-            if client_id > 0:
-                self.__cleanup_client(client_id)
+
+    def _handle_datagram(self, data: bytes, addr):
+        """ Handles a single datagram received from the address. Client registers its address by sending register_udp with its ID. """
+        if not data:
+            return
+
+        client_id = self._udp_addr_to_id.get(addr)
+        try:
+            sequence, batch = split_datagram(data)
+            if client_id is not None:
+                batch = self._id_to_conn[client_id].udp_channel.receive(data)
+        except (ValueError, struct.error) as e:
+            log_server(f"Invalid UDP datagram from {addr}: {e}", LogType.WARNING)
+            return
+        # stale, duplicated or incomplete fragment
+        if batch is None:
+            return
+
+        priority_packets = []
+        for payload in self._parse_data(batch):
+            cmd, packet_data = payload
+
+            if cmd == "register_udp":
+                conn = self._id_to_conn.get(packet_data) if isinstance(packet_data, int) else None
+                if conn and conn.udp_addr is None and addr not in self._udp_addr_to_id:
+                    log_server(f"Client {packet_data} registered UDP address {addr}.", LogType.INFO)
+                    conn.udp_addr = addr
+                    self._udp_addr_to_id[addr] = packet_data
+                    conn.udp_channel.accept(sequence)
+                    client_id = packet_data
+                else:
+                    log_server(f"Client {packet_data} attempted to register UDP address {addr}, but ID not found or already registered. Ignoring.", LogType.INFO)
+                continue
+
+            if client_id is not None:
+                priority_packets.append((client_id, payload))
             else:
-                try:
-                    conn.close()
-                except: pass
-            log_server(f"TCP handler for {client_id if client_id > 0 else addr} stopped.", LogType.INFO)
+                log_server(f"Received UDP data from unknown client {addr}. Ignoring.", LogType.INFO)
 
+        if priority_packets:
+            self._receive_priority_buffer.add_data_multiple(priority_packets)
 
-    def __handle_udp_reads(self):
-        """ Handles receiving all incoming UDP datagrams. """
-        while self.running:
-            try:
-                data, addr = self.udp_socket.recvfrom(self._packet_size)
-                if not data:
-                    continue
 
-                parsed_packets = self._parse_data(data)
-                client_id = self.__udp_addr_to_id.get(addr)
+    def _close_connection(self, conn: Connection):
+        """ Closes the connection and cleans up the client, if it has logged in. """
+        if conn.client_id > 0 and self._id_to_conn.get(conn.client_id) is conn:
+            self._cleanup_client(conn.client_id)
+            return
 
-                priority_packets = []
+        if self._connections.pop(conn.handle, None) is None:
+            return
+        self._release(conn)
+        log_server(f"Connection of {conn.addr} stopped.", LogType.INFO)
 
-                for payload in parsed_packets:
-                    cmd, packet_data = payload
-
-                    if cmd == "register_udp":
-                        reg_id = packet_data
-                        if reg_id in self.__id_to_tcp_conn and reg_id not in self.__id_to_udp_addr:
-                            log_server(f"Client {reg_id} registered UDP address {addr}.", LogType.INFO)
-                            self.__id_to_udp_addr[reg_id] = addr
-                            self.__udp_addr_to_id[addr] = reg_id
-                            client_id = reg_id
-                        else:
-                            log_server(f"Client {reg_id} attempted to register UDP address {addr}, but ID not found or already registered. Ignoring.", LogType.INFO)
-                        continue
-
-                    if client_id is not None:
-                        priority_packets.append((client_id, payload))
-                    else:
-                        log_server(f"Received UDP data from unknown client {addr}. Ignoring.", LogType.INFO)
-
-                if client_id is not None:
-                    self._receive_priority_buffer.add_data_multiple(priority_packets)
 
-            except socket.error as e:
-                if self.running:
-                    log_server(f"UDP receive error: {e}", LogType.INFO)
-                continue
-            except Exception as e:
-                log_server(f"Unexpected error in UDP read loop: {e}", LogType.ERROR)
-                break
+    def _cleanup_client(self, client_id: int):
+        """ Safely cleans up resources associated with a disconnected client. """
+        conn = self._id_to_conn.pop(client_id, None)
+        if not conn:
+            return
+
+        log_server(f"Cleaning up client {client_id}.", LogType.INFO)
+        self._connections.pop(conn.handle, None)
+        if self._udp_addr_to_id.get(conn.udp_addr) == client_id:
+            del self._udp_addr_to_id[conn.udp_addr]
+        self._release(conn)
+
+        if self.__on_disconnect:
+            self._notify(self.__on_disconnect, client_id)
+
 
+    def _close_all(self):
+        """ Closes all connections and invalidates all sessions. Called by stop of subclasses. """
+        for client_id in list(self._id_to_conn.keys()):
+            self._cleanup_client(client_id)
 
-    def __handle_login(self, request: str, data: tuple, conn: socket.socket) -> int:
+        for conn in list(self._connections.values()):
+            self._close_connection(conn)
+
+        self._users.close()
+        self.__sessions.clear()
+
+
+    def end_session(self, client_id: int):
+        """
+        Invalidates the session token of the client, so it can't resume its session and it has to log in again.
+        Args:
+            client_id: ID of the client.
+        """
+        self.__sessions.revoke(client_id)
+
+
+    @abstractmethod
+    def _write(self, conn: Connection, batch: bytes):
+        """ Hands a batch of reliable messages to the transport of the connection. """
+        pass
+
+
+    @abstractmethod
+    def _send_datagram(self, conn: Connection, datagram: bytes) -> bool:
         """
-        Handles 'register' or 'login' requests received via TCP.
+        Sends a datagram to the registered address of the connection.
         Returns:
-            Positive int: User ID on success.
-            -1: User already logged in (checked later in handler).
-            -2: Registration failed: username exists.
-            -3: Login failed: invalid username/password.
-            0: Invalid request type.
+            bool - False if sending failed and the rest of the datagrams for the client should be skipped.
         """
+        pass
+
+
+    @abstractmethod
+    def _release(self, conn: Connection):
+        """ Closes the transport of the connection. It was already removed from the connections. """
+        pass
+
+
+
+class ServerNetwork(ServerNetworkBase):
+    """
+    Network class for the server. Handles TCP connections for login/non-priority data
+    and UDP for priority data.
+    All sockets are non-blocking and are multiplexed by a single selector, which is polled on every tick, so no threads are used.
+    """
+
+    def __init__(self, address: str, port: int, max_connections: int, on_connect: Callable[[int], None], on_disconnect: Callable[[int], None] = None, codecs: Tuple[str] = (BinaryCodec.name, JsonCodec.name), high_water_mark: int = 256 * 1024, max_over_budget_time: float = 5, auth_workers: int = 4, on_resume: Callable[[int], None] = None):
+        """
+        Args:
+            address: The address of the server.
+            port: The UDP port for the server. TCP port will be port + 1.
+            max_connections: The maximum number of TCP connections allowed.
+            on_connect: A function called when a client successfully connects and logs in (passes client ID).
+            on_disconnect: A function called when a client disconnects (passes client ID).
+            codecs: Names of codecs the server accepts. Client's most preferred codec from this list is used for that client.
+            high_water_mark: Number of unsent bytes per client, above which new TCP messages are deferred and UDP messages are dropped.
+            max_over_budget_time: Time in seconds a client can stay above the high-water mark before it is disconnected.
+            auth_workers: Number of threads, which check credentials of logging in clients.
+            on_resume: A function called instead of on_connect, when a client reconnects with its session token (passes client ID). If None, on_connect is called.
+        """
+        super().__init__(address, port, max_connections, on_connect, on_disconnect, codecs, high_water_mark, max_over_budget_time, UserDatabase(workers=auth_workers), on_resume)
+        self.__tcp_port = self.port + 1
+        self.__selector = selectors.DefaultSelector()
+
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            username, password = data
-        except (TypeError, ValueError):
-            log_server(f"Invalid login data format from {conn.getpeername()}.", LogType.WARNING)
-            return 0
+            self.udp_socket.bind((self.address, self.port))
+            log_server(f"UDP Socket listening on {self.address}:{self.port}", LogType.INFO)
+        except socket.error as e:
+            log_server(f"Failed to bind UDP socket: {e}", LogType.ERROR)
+            raise
 
-        match request:
-            case "register":
-                result = self.__register_user(username, password) # Returns ID or -1 (exists)
-                if result == -1:
-                    return -2
-                return result
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow address reuse
+        try:
+            self.tcp_socket.bind((self.address, self.tcp_port))
+            self.tcp_socket.listen(self.max_connections)
+            log_server(f"TCP Socket listening on {self.address}:{self.tcp_port}", LogType.INFO)
+        except socket.error as e:
+            log_server(f"Failed to bind TCP socket: {e}", LogType.ERROR)
+            self.udp_socket.close()
+            raise
 
-            case "login":
-                result = self.__login_user(username, password) # Returns ID or -1 (not found/wrong pass)
-                if result == -1:
-                    return -3
-                return result
+        self.udp_socket.setblocking(False)
+        self.tcp_socket.setblocking(False)
+        self.__selector.register(self.tcp_socket, selectors.EVENT_READ)
+        self.__selector.register(self.udp_socket, selectors.EVENT_READ)
 
-            case _:
-                log_server(f"Invalid request type '{request}' from {conn.getpeername()}.", LogType.WARNING)
+
+    @ServerNetworkBase.max_connections.setter
+    def max_connections(self, value):
+        ServerNetworkBase.max_connections.fset(self, value)
+        if getattr(self, "tcp_socket", None):
+            self.tcp_socket.listen(value)
+
+
+    @property
+    def tcp_port(self):
+        """ int - The TCP port of the server. """
+        return self.__tcp_port
+
+
+    def tick(self):
+        """
+        Called only by the engine.
+        Reads all sockets, which are ready, and then sends data from the output buffer to clients via UDP (priority) or TCP (non-priority).
+        """
+        if not self.running:
+            return
+
+        self.__poll()
+        self._finish_logins()
+        self._dispatch(*self._take_output(), time.time())
+
+        for conn in list(self._connections.values()):
+            if conn.outgoing:
+                self.__flush(conn)
+
+
+    def __poll(self):
+        """ Handles all sockets, which are ready for reading or writing, without blocking. """
+        for key, events in self.__selector.select(0):
+            sock = key.fileobj
+            if sock is self.tcp_socket:
+                self.__accept_tcp_connections()
+            elif sock is self.udp_socket:
+                self.__handle_udp_reads()
+            else:
+                conn = self._connections.get(sock)
+                if not conn:
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    self.__flush(conn)
+                if events & selectors.EVENT_READ and sock in self._connections:
+                    self.__handle_client_tcp(conn)
+
+
+    def __accept_tcp_connections(self):
+        """ Accepts all pending TCP connections. """
+        while self.running:
+            try:
+                sock, addr = self.tcp_socket.accept()
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                log_server(f"TCP accept error: {e}", LogType.WARNING)
                 return
 
+            log_server(f"Accepted TCP connection from {addr}", LogType.INFO)
 
-    def __register_user(self, username, password) -> int:
-        """ Registers a user. Returns user ID or -1 if username exists. """
-        try:
-            if self.__db_cursor.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone() is not None:
-                return -1
+            if len(self._connections) >= self.max_connections:
+                log_server(f"Max connections reached. Closing connection from {addr}.", LogType.INFO)
+                sock.close()
+                continue
 
-            self.__db_cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-            self.__db_conn.commit()
-            user_id = self.__db_cursor.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
-            return user_id[0] if user_id else -1
-        except sql.Error as e:
-            log_server(f"Database error during registration: {e}", LogType.ERROR)
-            self.__db_conn.rollback()
-            return -1
+            sock.setblocking(False)
+            self._connections[sock] = ClientConnection(sock, addr, self._codec)
+            self.__selector.register(sock, selectors.EVENT_READ)
 
 
-    def __login_user(self, username, password) -> int:
-        """ Logs in a user. Returns user ID or -1 if not found or wrong password. """
+    def __handle_client_tcp(self, conn: ClientConnection):
+        """ Reads available data of a single TCP client and handles login, registration and non-priority data. """
         try:
-            user = self.__db_cursor.execute("SELECT id FROM users WHERE username=? AND password=?", (username, password)).fetchone()
-            if user is None:
-                return -1
-            return user[0]
-        except sql.Error as e:
-            log_server(f"Database error during login: {e}", LogType.ERROR)
-            return -1
+            # a client, which keeps its socket readable, can't stall the tick, because the selector reports the rest again on the next tick
+            total_received = 0
+            while total_received < MAX_TCP_READ_PER_EVENT:
+                try:
+                    received = conn.reader.recv_from(conn.sock)
+                except BlockingIOError:
+                    break
 
+                if not received:
+                    log_server(f"TCP connection closed by client {conn.client_id or conn.addr}.", LogType.INFO)
+                    self._close_connection(conn)
+                    return
+                total_received += received
 
-    def __cleanup_client(self, client_id: int):
-        """ Safely cleans up resources associated with a disconnected client. """
-        if client_id not in self.__connected_ids:
+                # frames are handled after every read, so a frame header over the size limit is rejected before the body is buffered
+                for message in conn.reader.frames():
+                    if not self._handle_payloads(conn, self._parse_data(message)):
+                        return
+
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            log_server(f"TCP connection error: {e}", LogType.INFO)
+            self._close_connection(conn)
+        except ValueError as e:
+            log_server(f"Invalid TCP stream from {conn.client_id or conn.addr}: {e}", LogType.WARNING)
+            self._close_connection(conn)
+        except Exception as e:
+            log_server(f"Unexpected error in TCP handler for {conn.client_id or conn.addr}: {e}", LogType.ERROR)
+            self._close_connection(conn)
+
+
+    def __flush(self, conn: ClientConnection):
+        """ Sends as much of the pending TCP data as the socket accepts and waits for writability if something is left. """
+        try:
+            sent = conn.sock.send(conn.outgoing)
+            del conn.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except (BrokenPipeError, ConnectionResetError, OSError) as e:
+            log_server(f"TCP send error (connection lost) to client {conn.client_id or conn.addr}: {e}", LogType.INFO)
+            self._close_connection(conn)
             return
 
-        log_server(f"Cleaning up client {client_id}.", LogType.INFO)
-        if client_id in self.__connected_ids:
-            self.__connected_ids.remove(client_id)
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if conn.outgoing else selectors.EVENT_READ
+        if self.__selector.get_key(conn.sock).events != events:
+            self.__selector.modify(conn.sock, events)
 
-        tcp_conn = self.__id_to_tcp_conn.pop(client_id, None)
-        if tcp_conn:
-            self.__tcp_conn_to_id.pop(tcp_conn, None)
+
+    def __handle_udp_reads(self):
+        """ Handles receiving all pending UDP datagrams. """
+        while self.running:
             try:
-                tcp_conn.shutdown(socket.SHUT_RDWR)
-            except (OSError, socket.error): pass
-            finally:
-                try:
-                    tcp_conn.close()
-                except (OSError, socket.error): pass
+                data, addr = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                # On Windows, ICMP port unreachable of a previous send is reported here
+                log_server(f"UDP receive error: {e}", LogType.INFO)
+                continue
+
+            try:
+                self._handle_datagram(data, addr)
+            except Exception as e:
+                log_server(f"Unexpected error handling UDP datagram from {addr}: {e}", LogType.ERROR)
 
-        udp_addr = self.__id_to_udp_addr.pop(client_id, None)
-        if udp_addr:
-            self.__udp_addr_to_id.pop(udp_addr, None)
 
-        if self.__on_disconnect:
-            self.__on_disconnect(client_id)
+    def _write(self, conn: ClientConnection, batch: bytes):
+        conn.outgoing += frame(batch)
+
+
+    def _send_datagram(self, conn: ClientConnection, datagram: bytes) -> bool:
+        try:
+            self.udp_socket.sendto(datagram, conn.udp_addr)
+            return True
+        except socket.error as e:
+            log_server(f"UDP send error to {conn.udp_addr} (ID: {conn.client_id}): {e}", LogType.WARNING)
+            return False
+
+
+    def _release(self, conn: ClientConnection):
+        try:
+            self.__selector.unregister(conn.sock)
+        except (KeyError, ValueError): pass
+        # last messages, e.g. connected_from_another_location, are sent if the socket accepts them right away
+        if conn.outgoing:
+            try:
+                conn.sock.send(conn.outgoing)
+            except (OSError, socket.error): pass
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error): pass
+        finally:
+            try:
+                conn.sock.close()
+            except (OSError, socket.error): pass
 
 
     def stop(self):
-        """ Stops the server network threads and closes sockets. """
+        """ Stops the server network and closes sockets. """
         if not self._running:
             return
         log_server("Stopping network...", LogType.INFO)
         self._running = False
 
+        self._close_all()
+        self.__selector.close()
+
         if self.tcp_socket:
             try:
                 self.tcp_socket.close()
@@ -854,17 +1471,6 @@ class ServerNetwork(Network):
                 self.udp_socket = None
             except socket.error: pass
 
-        all_client_ids = list(self.__id_to_tcp_conn.keys())
-        for client_id in all_client_ids:
-            self.__cleanup_client(client_id)
-
-        if self.__db_conn:
-            self.__db_conn.close()
-            self.__db_conn = None
-
         log_server("Network stopped.", LogType.INFO)
 
 #?endif
-
-
-
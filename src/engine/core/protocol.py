@@ -0,0 +1,1186 @@
+"""
+Wire protocol for the network module.
+Contains codecs, which turn (command, data) records into bytes and back, and the command registry used by the binary codec.
+"""
+
+from engine.datatypes import *
+
+from abc import ABC, abstractmethod
+import json
+import struct
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+
+RECORD_SEPARATOR = chr(30)
+RECORD_SEPARATOR_BYTES = RECORD_SEPARATOR.encode("ascii")
+
+BINARY_TAG = 0xB1
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I32 = struct.Struct("<i")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+_VECTOR = struct.Struct("<ff")
+FRAME_HEADER = struct.Struct("<I")
+DATAGRAM_HEADER = struct.Struct("<I")
+DEFAULT_MTU = 1200
+MAX_DATAGRAM_SIZE = 65507
+FRAGMENT_TAG = 0xF1
+_FRAGMENT_HEADER = struct.Struct("<BIHH") # tag, sequence number of the first fragment, index, count
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+_MIN_RECV_SIZE = 4096
+
+# value tags of the binary codec
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT32 = 3
+_INT64 = 4
+_FLOAT = 5
+_STR = 6
+_STR32 = 7
+_VECTOR_TAG = 8
+_LIST = 9
+_LIST32 = 10
+_DICT = 11
+_DICT32 = 12
+_BYTES = 13
+
+
+
+def write_value(out: bytearray, value: Any):
+    """
+    Appends a self describing binary representation of the value to the buffer.
+    Args:
+        out: Buffer to write to.
+        value: None, bool, int, float, str, Vector, bytes or list, tuple, set and dict of those.
+    Raises:
+        TypeError: If the value can't be serialized.
+    """
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        if -0x80000000 <= value <= 0x7FFFFFFF:
+            out.append(_INT32)
+            out += _I32.pack(value)
+        elif -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF:
+            out.append(_INT64)
+            out += _I64.pack(value)
+        else:
+            raise TypeError(f"Integer {value} doesn't fit into 64 bits and can't be serialized")
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    elif isinstance(value, str):
+        encoded = value.encode("utf-8")
+        if len(encoded) <= 0xFFFF:
+            out.append(_STR)
+            out += _U16.pack(len(encoded))
+        else:
+            out.append(_STR32)
+            out += _U32.pack(len(encoded))
+        out += encoded
+    elif isinstance(value, Vector):
+        out.append(_VECTOR_TAG)
+        out += _VECTOR.pack(value.x, value.y)
+    elif isinstance(value, (list, tuple, set)):
+        if len(value) <= 0xFFFF:
+            out.append(_LIST)
+            out += _U16.pack(len(value))
+        else:
+            out.append(_LIST32)
+            out += _U32.pack(len(value))
+        for item in value:
+            write_value(out, item)
+    elif isinstance(value, dict):
+        if len(value) <= 0xFFFF:
+            out.append(_DICT)
+            out += _U16.pack(len(value))
+        else:
+            out.append(_DICT32)
+            out += _U32.pack(len(value))
+        for k, v in value.items():
+            write_value(out, k)
+            write_value(out, v)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        out += _U32.pack(len(value))
+        out += value
+    else:
+        raise TypeError(f"Object of type {value.__class__.__name__} can't be serialized")
+
+
+
+def read_value(buf, offset: int) -> Tuple[Any, int]:
+    """
+    Reads a value written by write_value.
+    Args:
+        buf: bytes, bytearray or memoryview to read from.
+        offset: Position of the value in the buffer.
+    Returns:
+        tuple[Any, int] - Read value and the offset right after it. Lists, tuples and sets are all read as lists.
+    Raises:
+        ValueError: If the buffer contains an unknown value tag.
+    """
+    tag = buf[offset]
+    offset += 1
+
+    if tag == _INT32:
+        return _I32.unpack_from(buf, offset)[0], offset + 4
+    if tag == _STR:
+        length = _U16.unpack_from(buf, offset)[0]
+        offset += 2
+        return str(buf[offset:offset + length], "utf-8"), offset + length
+    if tag == _VECTOR_TAG:
+        return Vector(*_VECTOR.unpack_from(buf, offset)), offset + 8
+    if tag == _FLOAT:
+        return _F64.unpack_from(buf, offset)[0], offset + 8
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _LIST or tag == _LIST32:
+        if tag == _LIST:
+            count = _U16.unpack_from(buf, offset)[0]
+            offset += 2
+        else:
+            count = _U32.unpack_from(buf, offset)[0]
+            offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = read_value(buf, offset)
+            items.append(item)
+        return items, offset
+    if tag == _DICT or tag == _DICT32:
+        if tag == _DICT:
+            count = _U16.unpack_from(buf, offset)[0]
+            offset += 2
+        else:
+            count = _U32.unpack_from(buf, offset)[0]
+            offset += 4
+        items = {}
+        for _ in range(count):
+            k, offset = read_value(buf, offset)
+            v, offset = read_value(buf, offset)
+            items[k] = v
+        return items, offset
+    if tag == _INT64:
+        return _I64.unpack_from(buf, offset)[0], offset + 8
+    if tag == _STR32:
+        length = _U32.unpack_from(buf, offset)[0]
+        offset += 4
+        return str(buf[offset:offset + length], "utf-8"), offset + length
+    if tag == _BYTES:
+        length = _U32.unpack_from(buf, offset)[0]
+        offset += 4
+        return bytes(buf[offset:offset + length]), offset + length
+
+    raise ValueError(f"Unknown value tag {tag} at offset {offset - 1}")
+
+
+
+def _write_str(out: bytearray, value: str):
+    encoded = value.encode("utf-8")
+    out += _U16.pack(len(encoded))
+    out += encoded
+
+
+def _read_str(buf, offset: int):
+    length = _U16.unpack_from(buf, offset)[0]
+    offset += 2
+    return str(buf[offset:offset + length], "utf-8"), offset + length
+
+
+def _write_int(out: bytearray, value: int):
+    out += _I32.pack(value)
+
+
+def _read_int(buf, offset: int):
+    return _I32.unpack_from(buf, offset)[0], offset + 4
+
+
+def _write_vector(out: bytearray, value):
+    out += _VECTOR.pack(value[0], value[1])
+
+
+def _read_vector(buf, offset: int):
+    return Vector(*_VECTOR.unpack_from(buf, offset)), offset + 8
+
+
+def _write_register_actor(out: bytearray, value):
+    _write_str(out, value[0])
+    _write_str(out, value[1])
+    _write_vector(out, value[2])
+    out += _U32.pack(value[3])
+
+
+def _read_register_actor(buf, offset: int):
+    class_name, offset = _read_str(buf, offset)
+    name, offset = _read_str(buf, offset)
+    position, offset = _read_vector(buf, offset)
+    net_id = _U32.unpack_from(buf, offset)[0]
+    return [class_name, name, position, net_id], offset + 4
+
+
+_TILE = struct.Struct("<HHI")
+_CHUNK_HEADER = struct.Struct("<iiH")
+
+
+def _write_register_chunk(out: bytearray, value):
+    palette, chunks = value
+    out += _U16.pack(len(palette))
+    for class_name, prefix in palette:
+        _write_str(out, class_name)
+        _write_str(out, prefix)
+    out += _U32.pack(len(chunks))
+    for chunk_x, chunk_y, tiles in chunks:
+        out += _CHUNK_HEADER.pack(chunk_x, chunk_y, len(tiles))
+        for cell, index, net_id in tiles:
+            out += _TILE.pack(cell, index, net_id)
+
+
+def _read_register_chunk(buf, offset: int):
+    count = _U16.unpack_from(buf, offset)[0]
+    offset += 2
+    palette = []
+    for _ in range(count):
+        class_name, offset = _read_str(buf, offset)
+        prefix, offset = _read_str(buf, offset)
+        palette.append([class_name, prefix])
+
+    count = _U32.unpack_from(buf, offset)[0]
+    offset += 4
+    chunks = []
+    for _ in range(count):
+        chunk_x, chunk_y, tile_count = _CHUNK_HEADER.unpack_from(buf, offset)
+        offset += _CHUNK_HEADER.size
+        tiles = [list(_TILE.unpack_from(buf, offset + i * _TILE.size)) for i in range(tile_count)]
+        offset += tile_count * _TILE.size
+        chunks.append([chunk_x, chunk_y, tiles])
+    return [palette, chunks], offset
+
+
+SYNC_FIELDS = ("position", "half_size", "visible", "material")
+_SYNC_EXTRA = 0x80
+
+
+def _write_sync_data(out: bytearray, sync_data: dict):
+    mask = 0
+    extra = None
+    for key in sync_data:
+        if key in SYNC_FIELDS:
+            mask |= 1 << SYNC_FIELDS.index(key)
+        else:
+            extra = extra or {}
+            extra[key] = sync_data[key]
+    if extra:
+        mask |= _SYNC_EXTRA
+
+    out.append(mask)
+    if mask & 1:
+        _write_vector(out, sync_data["position"])
+    if mask & 2:
+        _write_vector(out, sync_data["half_size"])
+    if mask & 4:
+        out.append(1 if sync_data["visible"] else 0)
+    if mask & 8:
+        write_value(out, sync_data["material"])
+    if extra:
+        write_value(out, extra)
+
+
+def _read_sync_data(buf, offset: int):
+    mask = buf[offset]
+    offset += 1
+    sync_data = {}
+    if mask & 1:
+        sync_data["position"], offset = _read_vector(buf, offset)
+    if mask & 2:
+        sync_data["half_size"], offset = _read_vector(buf, offset)
+    if mask & 4:
+        sync_data["visible"] = buf[offset] != 0
+        offset += 1
+    if mask & 8:
+        sync_data["material"], offset = read_value(buf, offset)
+    if mask & _SYNC_EXTRA:
+        extra, offset = read_value(buf, offset)
+        sync_data.update(extra)
+    return sync_data, offset
+
+
+def _write_update_actor(out: bytearray, value):
+    _write_str(out, value[0])
+    _write_sync_data(out, value[1])
+
+
+def _read_update_actor(buf, offset: int):
+    name, offset = _read_str(buf, offset)
+    sync_data, offset = _read_sync_data(buf, offset)
+    return [name, sync_data], offset
+
+
+
+def _write_snapshot_entries(out: bytearray, entries):
+    for net_id, sync_data in entries:
+        out += _U32.pack(net_id)
+        _write_sync_data(out, sync_data)
+
+
+_PARTS_HEADER = struct.Struct("<IHHH")
+
+
+def _write_snapshot(out: bytearray, value):
+    sequence, index, count, entries = value
+    out += _PARTS_HEADER.pack(sequence, index, count, 1)
+    out += _U16.pack(len(entries))
+    _write_snapshot_entries(out, entries)
+
+
+def _read_snapshot(buf, offset: int):
+    sequence, index, record_count, part_count = _PARTS_HEADER.unpack_from(buf, offset)
+    offset += _PARTS_HEADER.size
+    entries = []
+    for _ in range(part_count):
+        count = _U16.unpack_from(buf, offset)[0]
+        offset += 2
+        for _ in range(count):
+            net_id = _U32.unpack_from(buf, offset)[0]
+            sync_data, offset = _read_sync_data(buf, offset + 4)
+            entries.append([net_id, sync_data])
+    return [sequence, index, record_count, entries], offset
+
+
+def _write_snapshot_ack(out: bytearray, value):
+    sequence, missing = value
+    out += _U32.pack(sequence)
+    out += _U16.pack(len(missing))
+    for net_id in missing:
+        out += _U32.pack(net_id)
+
+
+def _read_snapshot_ack(buf, offset: int):
+    sequence, count = _U32.unpack_from(buf, offset)[0], _U16.unpack_from(buf, offset + 4)[0]
+    offset += 6
+    missing = [_U32.unpack_from(buf, offset + i * 4)[0] for i in range(count)]
+    return [sequence, missing], offset + count * 4
+
+
+
+class CommandSpec:
+    """ Describes how the binary codec writes a single command. """
+
+    def __init__(self, cmd: str, opcode: int, writer: Callable[[bytearray, Any], None] = write_value, reader: Callable[[Any, int], Tuple[Any, int]] = read_value, part_writer: Callable[[bytearray, list], None] = None):
+        """
+        Args:
+            cmd: Command name.
+            opcode: Integer id of the command on the wire. It must be between 1 and 65535.
+            writer: Function, which appends the command data to a bytearray. Default writes any value supported by write_value.
+            reader: Function, which reads the command data from a buffer at given offset and returns (data, new_offset). It must match the writer.
+            part_writer: Function, which appends items of a list command without their count. Only commands with it can be joined from parts.
+                Data of such command is [sequence, index, count, items]. On the wire it is u32 sequence number, u16 index of the record,
+                u16 number of records with the same sequence number, u16 part count and the parts, each is u16 item count and the items.
+        """
+        self.cmd = cmd
+        self.opcode = opcode
+        self.writer = writer
+        self.reader = reader
+        self.part_writer = part_writer
+
+
+
+class CommandRegistry:
+    """
+    Maps command names to integer opcodes for the binary codec.
+    Commands, which are not registered, are still sent, but with their full name.
+    Both client and server must register the same commands with the same opcodes.
+    """
+
+    def __init__(self):
+        self.__by_cmd: Dict[str, CommandSpec] = {}
+        self.__by_opcode: Dict[int, CommandSpec] = {}
+
+
+    def register(self, cmd: str, opcode: int, writer: Callable[[bytearray, Any], None] = write_value, reader: Callable[[Any, int], Tuple[Any, int]] = read_value, part_writer: Callable[[bytearray, list], None] = None):
+        """
+        Registers a command. Refer to the CommandSpec class for more information about the parameters.
+        Raises:
+            TypeError: If cmd is not a string or opcode is not an integer between 1 and 65535.
+            ValueError: If command or opcode is already registered.
+        """
+        if not isinstance(cmd, str) or not isinstance(opcode, int) or not 0 < opcode <= 0xFFFF:
+            raise TypeError("Command must be a string and opcode an integer between 1 and 65535:", cmd, opcode)
+        if cmd in self.__by_cmd or opcode in self.__by_opcode:
+            raise ValueError(f"Command {cmd} or opcode {opcode} is already registered")
+
+        spec = CommandSpec(cmd, opcode, writer, reader, part_writer)
+        self.__by_cmd[cmd] = spec
+        self.__by_opcode[opcode] = spec
+
+
+    def get_by_cmd(self, cmd: str) -> CommandSpec | None:
+        """ Returns the spec of the command or None if it isn't registered. """
+        return self.__by_cmd.get(cmd)
+
+
+    def get_by_opcode(self, opcode: int) -> CommandSpec | None:
+        """ Returns the spec of the opcode or None if it isn't registered. """
+        return self.__by_opcode.get(opcode)
+
+
+
+COMMANDS = CommandRegistry()
+COMMANDS.register("hello", 1)
+COMMANDS.register("codec", 2)
+COMMANDS.register("login", 3)
+COMMANDS.register("register", 4)
+COMMANDS.register("register_outcome", 5, _write_int, _read_int)
+COMMANDS.register("register_udp", 6, _write_int, _read_int)
+COMMANDS.register("connected_from_another_location", 7, _write_int, _read_int)
+COMMANDS.register("join_level", 8, _write_str, _read_str)
+COMMANDS.register("update_distance", 9)
+COMMANDS.register("world_mouse_pos", 10, _write_vector, _read_vector)
+COMMANDS.register("key_down", 11, _write_int, _read_int)
+COMMANDS.register("key_up", 12, _write_int, _read_int)
+COMMANDS.register("register_actor", 13, _write_register_actor, _read_register_actor)
+COMMANDS.register("update_actor", 14, _write_update_actor, _read_update_actor)
+COMMANDS.register("destroy_actor", 15, _write_str, _read_str)
+COMMANDS.register("background", 16)
+COMMANDS.register("play_sound", 17)
+COMMANDS.register("snapshot", 18, _write_snapshot, _read_snapshot, _write_snapshot_entries)
+COMMANDS.register("snapshot_ack", 19, _write_snapshot_ack, _read_snapshot_ack)
+COMMANDS.register("input", 20)
+COMMANDS.register("player_state", 21)
+COMMANDS.register("session", 22, _write_str, _read_str)
+COMMANDS.register("resume", 23, _write_str, _read_str)
+COMMANDS.register("register_chunk", 24, _write_register_chunk, _read_register_chunk)
+
+
+
+class Codec(ABC):
+    """
+    Turns (command, data) records into bytes and back.
+    Records are packed into batches, which are sent as a single datagram or stream message.
+    """
+
+    name = ""
+    batch_overhead = 0 # bytes added to every batch
+    record_overhead = 0 # bytes added to every record in a batch
+
+
+    @abstractmethod
+    def encode(self, cmd: str, data: Any) -> bytes:
+        """
+        Encodes a single record.
+        Raises:
+            TypeError: If the data can't be serialized.
+        """
+        pass
+
+
+    @abstractmethod
+    def pack(self, records: List[bytes]) -> bytes:
+        """ Packs encoded records into one batch. """
+        pass
+
+
+    @abstractmethod
+    def decode(self, batch) -> List[Tuple[str, Any]]:
+        """ Decodes a batch into a list of (command, data) records. """
+        pass
+
+
+    @abstractmethod
+    def encode_part(self, cmd: str, items: list) -> bytes:
+        """ Encodes items of a list command, so they can be later joined with other parts into one record. """
+        pass
+
+
+    @abstractmethod
+    def join_parts(self, cmd: str, parts: List[bytes], sequence: int = 0, index: int = 0, count: int = 1) -> bytes:
+        """
+        Joins encoded parts into a single record. It decodes as (cmd, [sequence, index, count, list of all items]).
+        Args:
+            cmd: The list command.
+            parts: Encoded parts.
+            sequence: Sequence number shared by all records, which were joined from the same parts.
+            index: Index of this record among them.
+            count: Number of records with this sequence number.
+        """
+        pass
+
+
+
+class _VectorEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Vector):
+            return {"_type": "Vector", "x": obj.x, "y": obj.y}
+        return super().default(obj)
+
+
+
+class JsonCodec(Codec):
+    """ Human readable codec. Records are JSON arrays separated by ASCII record separator. """
+
+    name = "json"
+    batch_overhead = 0
+    record_overhead = len(RECORD_SEPARATOR_BYTES)
+
+    def __init__(self):
+        self.__encoder = _VectorEncoder()
+
+
+    def encode(self, cmd: str, data: Any) -> bytes:
+        return self.__encoder.encode((cmd, data)).encode("ascii")
+
+
+    def pack(self, records: List[bytes]) -> bytes:
+        return RECORD_SEPARATOR_BYTES.join(records)
+
+
+    def decode(self, batch) -> List[Tuple[str, Any]]:
+        records = []
+        for json_str in str(batch, "ascii").split(RECORD_SEPARATOR):
+            if not json_str:
+                continue
+            records.append(self.__convert(json.loads(json_str)))
+        return records
+
+
+    def encode_part(self, cmd: str, items: list) -> bytes:
+        # items without the enclosing brackets
+        return self.__encoder.encode(items)[1:-1].encode("ascii")
+
+
+    def join_parts(self, cmd: str, parts: List[bytes], sequence: int = 0, index: int = 0, count: int = 1) -> bytes:
+        header = f"[{self.__encoder.encode(cmd)}, [{sequence}, {index}, {count}, [".encode("ascii")
+        return header + b", ".join(part for part in parts if part) + b"]]]"
+
+
+    def __convert(self, obj):
+        if isinstance(obj, dict):
+            if obj.get("_type") == "Vector":
+                return Vector(obj["x"], obj["y"])
+            return {k: self.__convert(v) for k, v in obj.items()}
+
+        if isinstance(obj, list):
+            return [self.__convert(item) for item in obj]
+
+        return obj
+
+
+
+class BinaryCodec(Codec):
+    """
+    Compact codec. Batch starts with BINARY_TAG byte, followed by records.
+    Each record is an u16 opcode and struct packed data. Vectors are sent as two float32s.
+    Commands missing from the registry are sent with opcode 0 and their name.
+    """
+
+    name = "binary"
+    batch_overhead = 1
+    record_overhead = 0
+
+    def __init__(self, registry: CommandRegistry = COMMANDS):
+        """
+        Args:
+            registry: Command registry used to look up opcodes. It must be the same on both sides.
+        """
+        self.__registry = registry
+
+
+    def encode(self, cmd: str, data: Any) -> bytes:
+        out = bytearray()
+        spec = self.__registry.get_by_cmd(cmd)
+        try:
+            if spec:
+                out += _U16.pack(spec.opcode)
+                spec.writer(out, data)
+            else:
+                out += _U16.pack(0)
+                _write_str(out, cmd)
+                write_value(out, data)
+        except (struct.error, OverflowError) as e:
+            # values out of range of the packed fields
+            raise TypeError(f"Data of command {cmd} can't be serialized: {e}") from e
+        return bytes(out)
+
+
+    def pack(self, records: List[bytes]) -> bytes:
+        return bytes((BINARY_TAG,)) + b"".join(records)
+
+
+    def encode_part(self, cmd: str, items: list) -> bytes:
+        out = bytearray(_U16.pack(len(items)))
+        part_writer = self.__get_part_spec(cmd).part_writer
+        try:
+            part_writer(out, items)
+        except (struct.error, OverflowError) as e:
+            raise TypeError(f"Data of command {cmd} can't be serialized: {e}") from e
+        return bytes(out)
+
+
+    def join_parts(self, cmd: str, parts: List[bytes], sequence: int = 0, index: int = 0, count: int = 1) -> bytes:
+        return _U16.pack(self.__get_part_spec(cmd).opcode) + _PARTS_HEADER.pack(sequence, index, count, len(parts)) + b"".join(parts)
+
+
+    def __get_part_spec(self, cmd: str) -> CommandSpec:
+        spec = self.__registry.get_by_cmd(cmd)
+        if spec is None or spec.part_writer is None:
+            raise ValueError(f"Command {cmd} can't be joined from parts")
+        return spec
+
+
+    def decode(self, batch) -> List[Tuple[str, Any]]:
+        if batch[0] != BINARY_TAG:
+            raise ValueError(f"Batch doesn't start with binary tag: {batch[0]}")
+        offset = 1
+        end = len(batch)
+
+        records = []
+        while offset < end:
+            opcode = _U16.unpack_from(batch, offset)[0]
+            offset += 2
+            if opcode == 0:
+                cmd, offset = _read_str(batch, offset)
+                data, offset = read_value(batch, offset)
+            else:
+                spec = self.__registry.get_by_opcode(opcode)
+                if spec is None:
+                    raise ValueError(f"Unknown opcode {opcode}")
+                cmd = spec.cmd
+                data, offset = spec.reader(batch, offset)
+            records.append((cmd, data))
+        return records
+
+
+
+# all codecs, which can be negotiated, by their name
+CODECS: Dict[str, Codec] = {
+    BinaryCodec.name: BinaryCodec(),
+    JsonCodec.name: JsonCodec(),
+}
+
+
+
+def get_codec_for(batch) -> Codec:
+    """
+    Returns the codec, which encoded the batch. Every batch can be decoded regardless of the negotiated codec.
+    Args:
+        batch: Encoded batch.
+    Returns:
+        Codec - BinaryCodec if batch starts with BINARY_TAG, JsonCodec otherwise.
+    """
+    if len(batch) and batch[0] == BINARY_TAG:
+        return CODECS[BinaryCodec.name]
+    return CODECS[JsonCodec.name]
+
+
+
+class EncodedMessage:
+    """
+    Message, which is sent to many clients. It is encoded at most once per codec,
+    so the encoded bytes are shared by all clients, which use the same codec.
+    """
+
+    __slots__ = ("cmd", "data", "__encoded")
+
+    def __init__(self, cmd: str, data: Any):
+        """
+        Args:
+            cmd: The command to send.
+            data: The data to send. It must not be modified after the message is created.
+        """
+        self.cmd = cmd
+        self.data = data
+        self.__encoded = {}
+
+
+    def encode(self, codec: Codec) -> bytes:
+        """ Returns the message encoded with the codec. Encoding is done only on the first call for each codec. """
+        encoded = self.__encoded.get(codec.name)
+        if encoded is None:
+            encoded = self.__encoded[codec.name] = codec.encode(self.cmd, self.data)
+        return encoded
+
+
+
+class EncodedPart:
+    """
+    Items of a list command, which are sent to many clients, each time joined with different other parts.
+    Like EncodedMessage, it is encoded at most once per codec.
+    """
+
+    __slots__ = ("cmd", "items", "__encoded")
+
+    def __init__(self, cmd: str, items: list):
+        """
+        Args:
+            cmd: The list command. For the binary codec, it must be registered with a part writer.
+            items: Items of the command. They must not be modified after the part is created.
+        """
+        self.cmd = cmd
+        self.items = items
+        self.__encoded = {}
+
+
+    def encode(self, codec: Codec) -> bytes:
+        """ Returns the items encoded with the codec. Encoding is done only on the first call for each codec. """
+        encoded = self.__encoded.get(codec.name)
+        if encoded is None:
+            encoded = self.__encoded[codec.name] = codec.encode_part(self.cmd, self.items)
+        return encoded
+
+
+
+def join_parts(codec: Codec, cmd: str, parts: List[EncodedPart], max_size: int, sequence: int = 0) -> List[bytes]:
+    """
+    Joins parts into as few records as possible.
+    Args:
+        codec: Codec to encode the parts with.
+        cmd: The list command.
+        parts: Parts to join.
+        max_size: Maximum size of a single record. Parts are never split, so a single part can exceed it.
+        sequence: Sequence number written to every record. Receiver can tell, that it got all records of the sequence by their index and count.
+    Returns:
+        list[bytes] - Encoded records.
+    """
+    header_size = len(codec.join_parts(cmd, [], 0xFFFFFFFF, 0xFFFF, 0xFFFF))
+    groups = []
+    current = []
+    current_size = header_size
+    for part in parts:
+        encoded = part.encode(codec)
+        if current and current_size + len(encoded) + 2 > max_size:
+            groups.append(current)
+            current = []
+            current_size = header_size
+        current.append(encoded)
+        current_size += len(encoded) + 2 # separator of the JSON codec
+
+    if current:
+        groups.append(current)
+    return [codec.join_parts(cmd, group, sequence, index, len(groups)) for index, group in enumerate(groups)]
+
+
+
+def frame(batch: bytes) -> bytes:
+    """
+    Prefixes the batch with its length, so it can be sent over a stream.
+    Args:
+        batch: Packed batch.
+    Returns:
+        bytes - Frame, which can be read by FrameReader.
+    """
+    return FRAME_HEADER.pack(len(batch)) + batch
+
+
+
+class FrameReader:
+    """
+    Splits a TCP byte stream into length prefixed frames.
+    Data is received straight into a preallocated buffer and frames are returned as memoryviews into it, so they are never copied.
+    """
+
+    def __init__(self, size: int = 65536, max_frame_size: int = MAX_FRAME_SIZE):
+        """
+        Args:
+            size: Initial size of the receive buffer. It grows if a single frame doesn't fit in it.
+            max_frame_size: Frames larger than this are treated as corrupted stream.
+        """
+        self.max_frame_size = max_frame_size
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0
+        self.__end = 0
+        self.__needed = 0
+
+
+    @property
+    def buffered(self):
+        """ int - Number of received bytes, which were not returned as a frame yet. """
+        return self.__end - self.__start
+
+
+    def recv_from(self, sock) -> int:
+        """
+        Receives available data from the socket into the buffer.
+        Args:
+            sock: Connected stream socket.
+        Returns:
+            int - Number of received bytes. 0 means, that the connection was closed.
+        """
+        self.__reserve(_MIN_RECV_SIZE)
+        received = sock.recv_into(self.__view[self.__end:])
+        self.__end += received
+        return received
+
+
+    def feed(self, data):
+        """
+        Appends data, which was received some other way.
+        Args:
+            data: bytes-like object.
+        """
+        self.__reserve(len(data))
+        self.__view[self.__end:self.__end + len(data)] = data
+        self.__end += len(data)
+
+
+    def frames(self):
+        """
+        Yields complete frames from the buffer.
+        Frames are memoryviews into the receive buffer and are valid only until the next recv_from or feed call.
+        Raises:
+            ValueError: If frame is bigger than max_frame_size.
+        """
+        header_size = FRAME_HEADER.size
+        while self.__end - self.__start >= header_size:
+            length = FRAME_HEADER.unpack_from(self.__buffer, self.__start)[0]
+            if length > self.max_frame_size:
+                raise ValueError(f"Frame size {length} exceeds maximum frame size {self.max_frame_size}")
+
+            frame_end = self.__start + header_size + length
+            if frame_end > self.__end:
+                self.__needed = header_size + length
+                return
+
+            frame = self.__view[self.__start + header_size:frame_end]
+            self.__start = frame_end
+            self.__needed = 0
+            yield frame
+
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+
+
+    def __reserve(self, size: int):
+        """ Makes sure there is room for at least `size` more bytes and for the whole incomplete frame. """
+        used = self.__end - self.__start
+        required = max(self.__needed, used + size)
+        if self.__start + required <= len(self.__buffer) and self.__end + size <= len(self.__buffer):
+            return
+
+        pending = bytes(self.__view[self.__start:self.__end])
+        if required > len(self.__buffer):
+            self.__buffer = bytearray(max(required, len(self.__buffer) * 2))
+            self.__view = memoryview(self.__buffer)
+        self.__view[:used] = pending
+        self.__start = 0
+        self.__end = used
+
+
+
+def split_datagram(datagram) -> Tuple[int, Any]:
+    """
+    Splits a datagram into its sequence number and batch.
+    Args:
+        datagram: Received datagram.
+    Returns:
+        tuple[int, memoryview] - Sequence number and the batch.
+    Raises:
+        ValueError: If the datagram is too short to contain the header.
+    """
+    if len(datagram) < DATAGRAM_HEADER.size:
+        raise ValueError(f"Datagram is too short: {len(datagram)} bytes")
+    return DATAGRAM_HEADER.unpack_from(datagram)[0], memoryview(datagram)[DATAGRAM_HEADER.size:]
+
+
+
+class DatagramChannel:
+    """
+    One side of an unreliable channel between two peers.
+    Outgoing datagrams are prefixed with increasing sequence numbers. Incoming datagrams, which are older than the newest processed one, are dropped,
+    so a late datagram can never overwrite newer state. Lost and late datagrams are counted.
+    Batches larger than the MTU are sent as fragments, which are reassembled by the receiving channel.
+    """
+
+    WINDOW = 32 # number of sequence numbers behind the newest one, which are remembered to tell late datagrams from duplicates
+
+    def __init__(self, fragment_timeout: float = 1, max_fragments: int = 1024, max_pending_messages: int = 16):
+        """
+        Args:
+            fragment_timeout: Time in seconds to wait for missing fragments of a message, before it is dropped.
+            max_fragments: Maximum number of fragments of a single message. Larger messages are dropped.
+            max_pending_messages: Maximum number of partially received messages. When exceeded, the oldest one is dropped.
+        """
+        self.fragment_timeout = fragment_timeout
+        self.max_fragments = max_fragments
+        self.max_pending_messages = max_pending_messages
+
+        self.__next_sequence = 1
+        self.__newest = 0
+        self.__processed = 0
+        self.__window = 0
+        self.__received = 0
+        self.__lost = 0
+        self.__late = 0
+        self.__duplicated = 0
+
+        self.__bytes_sent = 0
+        self.__datagrams_sent = 0
+        self.__bytes_received = 0
+        self.__datagrams_received = 0
+        self.__dropped_fragments = 0
+        # message sequence -> [first arrival time, received fragment count, fragments]
+        self.__partial: Dict[int, list] = {}
+
+
+    @property
+    def fragment_timeout(self):
+        """ float - Time in seconds to wait for missing fragments of a message, before it is dropped. """
+        return self.__fragment_timeout
+
+
+    @fragment_timeout.setter
+    def fragment_timeout(self, value):
+        if isinstance(value, (int, float)) and value > 0:
+            self.__fragment_timeout = value
+        else:
+            raise TypeError("Fragment timeout must be a positive float:", value)
+
+
+    @property
+    def max_fragments(self):
+        """ int - Maximum number of fragments of a single message. """
+        return self.__max_fragments
+
+
+    @max_fragments.setter
+    def max_fragments(self, value):
+        if isinstance(value, int) and 0 < value <= 0xFFFF:
+            self.__max_fragments = value
+        else:
+            raise TypeError("Max fragments must be an integer between 1 and 65535:", value)
+
+
+    @property
+    def max_pending_messages(self):
+        """ int - Maximum number of partially received messages. """
+        return self.__max_pending_messages
+
+
+    @max_pending_messages.setter
+    def max_pending_messages(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__max_pending_messages = value
+        else:
+            raise TypeError("Max pending messages must be a positive integer:", value)
+
+
+    @property
+    def received(self):
+        """ int - Number of received datagrams, without duplicates. """
+        return self.__received
+
+
+    @property
+    def lost(self):
+        """ int - Number of datagrams, which never arrived. Datagrams, which arrived late, are not counted. """
+        return self.__lost
+
+
+    @property
+    def late(self):
+        """ int - Number of datagrams, which arrived after a newer one. Unless they are fragments, they are dropped. """
+        return self.__late
+
+
+    @property
+    def duplicated(self):
+        """ int - Number of datagrams, which were received more than once. """
+        return self.__duplicated
+
+
+    @property
+    def loss_rate(self):
+        """ float - Fraction of datagrams, which were lost or arrived late, from all datagrams sent by the peer. """
+        total = self.__received + self.__lost
+        return (self.__lost + self.__late) / total if total else 0.0
+
+
+    @property
+    def bytes_sent(self):
+        """ int - Number of sent bytes, including datagram headers. """
+        return self.__bytes_sent
+
+
+    @property
+    def datagrams_sent(self):
+        """ int - Number of sent datagrams. """
+        return self.__datagrams_sent
+
+
+    @property
+    def bytes_received(self):
+        """ int - Number of received bytes, including datagram headers. """
+        return self.__bytes_received
+
+
+    @property
+    def datagrams_received(self):
+        """ int - Number of received datagrams, including duplicates and late ones. """
+        return self.__datagrams_received
+
+
+    @property
+    def dropped_fragments(self):
+        """ int - Number of received fragments, which were dropped, because their message was never completed. """
+        return self.__dropped_fragments
+
+
+    def wrap(self, batch: bytes) -> bytes:
+        """
+        Prefixes the batch with the next outgoing sequence number.
+        Args:
+            batch: Packed batch. It should fit in a single datagram.
+        Returns:
+            bytes - Datagram, which can be sent to the peer.
+        """
+        sequence = self.__next_sequence
+        self.__next_sequence = (sequence + 1) & 0xFFFFFFFF
+        datagram = DATAGRAM_HEADER.pack(sequence) + batch
+        self.__bytes_sent += len(datagram)
+        self.__datagrams_sent += 1
+        return datagram
+
+
+    def to_datagrams(self, batch: bytes, mtu: int) -> List[bytes]:
+        """
+        Turns the batch into one datagram, or into fragments if it doesn't fit in the MTU.
+        Args:
+            batch: Packed batch.
+            mtu: Maximum size of a single datagram.
+        Returns:
+            list[bytes] - Datagrams, which can be sent to the peer.
+        """
+        if len(batch) + DATAGRAM_HEADER.size <= mtu:
+            return [self.wrap(batch)]
+
+        chunk_size = mtu - DATAGRAM_HEADER.size - _FRAGMENT_HEADER.size
+        count = -(-len(batch) // chunk_size)
+        if count > self.max_fragments:
+            raise ValueError(f"Batch of {len(batch)} bytes needs {count} fragments, but at most {self.max_fragments} are allowed")
+
+        message_sequence = self.__next_sequence
+        return [
+            self.wrap(_FRAGMENT_HEADER.pack(FRAGMENT_TAG, message_sequence, index, count) + batch[index * chunk_size:(index + 1) * chunk_size])
+            for index in range(count)
+        ]
+
+
+    def accept(self, sequence: int) -> bool:
+        """
+        Records an incoming sequence number. Sequence numbers wrap around, so they are compared by their distance.
+        Args:
+            sequence: Sequence number of the received datagram.
+        Returns:
+            bool - True if the datagram is newer than all previously processed ones and should be processed.
+        """
+        return self.__record(sequence) and self.__claim(sequence)
+
+
+    def receive(self, datagram, now: float = None):
+        """
+        Handles a received datagram.
+        Args:
+            datagram: Received datagram.
+            now: Current time, used to expire incomplete messages. Default is time.time().
+        Returns:
+            memoryview | bytes | None - Batch, which should be processed, or None if the datagram is stale, a duplicate or an incomplete fragment.
+        Raises:
+            ValueError: If the datagram is malformed.
+        """
+        self.__bytes_received += len(datagram)
+        self.__datagrams_received += 1
+        sequence, batch = split_datagram(datagram)
+        if self.__partial:
+            self.__expire(time.time() if now is None else now)
+        if not len(batch) or batch[0] != FRAGMENT_TAG:
+            return batch if self.accept(sequence) else None
+
+        # fragments are reassembled regardless of their order, only the whole message can be stale
+        if not self.__record(sequence):
+            return None
+        return self.__add_fragment(batch, time.time() if now is None else now)
+
+
+    def __record(self, sequence: int) -> bool:
+        """ Updates the counters. Returns False for duplicates. """
+        if self.__received == 0:
+            self.__newest = sequence
+            self.__window = 1
+            self.__received = 1
+            return True
+
+        distance = (sequence - self.__newest) & 0xFFFFFFFF
+        if 0 < distance < 0x80000000:
+            self.__lost += distance - 1
+            self.__window = ((self.__window << distance) | 1) & ((1 << self.WINDOW) - 1) if distance < self.WINDOW else 1
+            self.__newest = sequence
+            self.__received += 1
+            return True
+
+        age = (self.__newest - sequence) & 0xFFFFFFFF
+        if age < self.WINDOW and self.__window & (1 << age):
+            self.__duplicated += 1
+            return False
+
+        if age < self.WINDOW:
+            self.__window |= 1 << age
+        # it was counted as lost, when a newer datagram skipped over it
+        self.__lost = max(0, self.__lost - 1)
+        self.__late += 1
+        self.__received += 1
+        return True
+
+
+    def __claim(self, sequence: int) -> bool:
+        """ Returns True and remembers the sequence number, if it is newer than the newest processed one. """
+        if self.__processed and not 0 < (sequence - self.__processed) & 0xFFFFFFFF < 0x80000000:
+            return False
+        self.__processed = sequence
+        return True
+
+
+    def __add_fragment(self, batch, now: float):
+        _, message_sequence, index, count = _FRAGMENT_HEADER.unpack_from(batch)
+        if not index < count <= self.max_fragments:
+            raise ValueError(f"Invalid fragment {index} of {count}")
+
+        message = self.__partial.get(message_sequence)
+        if message is None:
+            if len(self.__partial) >= self.max_pending_messages:
+                self.__drop(next(iter(self.__partial)))
+            message = self.__partial[message_sequence] = [now, 0, [None] * count]
+        fragments = message[2]
+        if len(fragments) != count or fragments[index] is not None:
+            return None
+
+        fragments[index] = bytes(batch[_FRAGMENT_HEADER.size:])
+        message[1] += 1
+        if message[1] < count:
+            return None
+
+        del self.__partial[message_sequence]
+        if not self.__claim(message_sequence):
+            self.__dropped_fragments += count
+            return None
+        return b"".join(fragments)
+
+
+    def __expire(self, now: float):
+        for message_sequence in [seq for seq, message in self.__partial.items() if now - message[0] > self.fragment_timeout]:
+            self.__drop(message_sequence)
+
+
+    def __drop(self, message_sequence: int):
+        self.__dropped_fragments += self.__partial.pop(message_sequence)[1]
@@ -0,0 +1,468 @@
+#?attr SERVER
+
+"""
+Per client replication state, which is used to delta encode snapshots against the state the client acknowledged,
+the scheduler, which decides what fits in the client's bandwidth budget, and chunks the client is subscribed to.
+"""
+
+from .protocol import Codec, EncodedPart
+from engine.components.actors.actor import Actor
+from engine.datatypes import *
+from engine.game_math import *
+
+from typing import Callable, Dict, List, Set, Tuple
+
+
+
+EMPTY_BOUNDS = (0, 0, -1, -1) # bounds, which contain no chunk
+
+
+
+class SnapshotUnit:
+    """ Changes of actors in a single chunk, which are either sent to a client together or deferred together. """
+
+    __slots__ = ("chunk", "parts", "entries", "age", "magnitude")
+
+    def __init__(self, chunk: Vector):
+        self.chunk = chunk
+        self.parts: List[EncodedPart] = []
+        self.entries: List[Tuple[Actor, Tuple[str]]] = [] # actors and their fields in the parts
+        self.age = 0 # number of snapshots, for which the oldest change in the unit waits
+        self.magnitude = 0.0
+
+
+    def get_size(self, codec: Codec) -> int:
+        """ Returns number of bytes the unit takes, when encoded with the codec. """
+        return sum(len(part.encode(codec)) for part in self.parts)
+
+
+
+class ReplicationState:
+    """
+    Tracks actor fields, which were sent to a client in unreliable snapshots, but weren't acknowledged yet, and fields, which were deferred by the scheduler.
+    Snapshot sent to the client contains this tick's changes, fields, whose snapshot was presumably lost, and deferred fields.
+    Fields, that the client already has, are never sent again.
+    """
+
+    def __init__(self, max_pending: int = 256, resend_after: int = 8):
+        """
+        Args:
+            max_pending: Maximum number of snapshots waiting for acknowledgement. Older ones can't be acknowledged anymore, so their fields are sent again.
+            resend_after: Number of snapshots after which unacknowledged fields are sent again, even if no newer snapshot was acknowledged.
+        """
+        self.max_pending = max_pending
+        self.resend_after = resend_after
+        self.__sequence = 0
+        self.__acked_sequence = 0
+        # net id -> [actor, {field: sequence it was last sent in or 0 if it was deferred}, sequence since which the actor waits]
+        self.__unacked: Dict[int, list] = {}
+        self.__pending: Dict[int, List[int]] = {}
+
+
+    @property
+    def max_pending(self):
+        """ int - Maximum number of snapshots waiting for acknowledgement. """
+        return self.__max_pending
+
+
+    @max_pending.setter
+    def max_pending(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__max_pending = value
+        else:
+            raise TypeError("Max pending must be a positive integer:", value)
+
+
+    @property
+    def resend_after(self):
+        """ int - Number of snapshots after which unacknowledged fields are sent again. """
+        return self.__resend_after
+
+
+    @resend_after.setter
+    def resend_after(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__resend_after = value
+        else:
+            raise TypeError("Resend after must be a positive integer:", value)
+
+
+    @property
+    def sequence(self):
+        """ int - Sequence number of the last built snapshot. """
+        return self.__sequence
+
+
+    @property
+    def acked_sequence(self):
+        """ int - Highest sequence number acknowledged by the client. """
+        return self.__acked_sequence
+
+
+    @property
+    def unacked_count(self):
+        """ int - Number of actors with fields, which the client may not have. """
+        return len(self.__unacked)
+
+
+    def build(self, chunk_parts: Dict[Vector, Tuple[EncodedPart, List[Actor]]], is_relevant: Callable[[Actor], bool], select: Callable[[List[SnapshotUnit]], List[SnapshotUnit]] = None):
+        """
+        Assigns the next sequence number to a snapshot and adds fields, which the client may have missed.
+        Args:
+            chunk_parts: Shared snapshot part and its actors, in the same order as their entries, for each chunk, which the client sees.
+            is_relevant: Returns False for actors, which are no longer synced with the client. They are forgotten.
+            select: Returns units, which should be sent now. Fields of the other units are deferred to later snapshots. If None, everything is sent.
+        Returns:
+            tuple[int, list[EncodedPart]] - Sequence number and parts to send. Empty list means, that there is nothing to send.
+        """
+        self.__sequence += 1
+        sequence = self.__sequence
+
+        units: Dict[Vector, SnapshotUnit] = {}
+        covered = {}
+        for chunk, (part, actors) in chunk_parts.items():
+            unit = units[chunk] = SnapshotUnit(chunk)
+            unit.parts.append(part)
+            for actor, (net_id, sync_data) in zip(actors, part.items):
+                covered[net_id] = sync_data
+                unit.entries.append((actor, tuple(sync_data)))
+                self.__add_magnitude(unit, actor, sync_data)
+
+        resend_by_chunk: Dict[Vector, list] = {}
+        for net_id, (actor, fields, since) in list(self.__unacked.items()):
+            if not is_relevant(actor):
+                del self.__unacked[net_id]
+                continue
+
+            sent = covered.get(net_id)
+            missing = tuple(key for key, key_sequence in fields.items() if (sent is None or key not in sent) and self.__needs_resend(key_sequence, sequence))
+            if not missing:
+                continue
+
+            chunk = get_chunk_cords(actor.position)
+            unit = units.get(chunk)
+            if unit is None:
+                unit = units[chunk] = SnapshotUnit(chunk)
+            unit.entries.append((actor, missing))
+            unit.age = max(unit.age, sequence - since)
+            resend_by_chunk.setdefault(chunk, []).append((net_id, actor.get_net_sync_values(missing)))
+            self.__add_magnitude(unit, actor, missing)
+
+        for chunk, resend in resend_by_chunk.items():
+            units[chunk].parts.append(EncodedPart("snapshot", resend))
+
+        selected = list(units.values()) if select is None else select(list(units.values()))
+        selected_chunks = set()
+        parts = []
+        sent_net_ids = []
+        for unit in selected:
+            selected_chunks.add(unit.chunk)
+            parts.extend(unit.parts)
+            for actor, keys in unit.entries:
+                self.__mark(actor, keys, sequence, sequence)
+                sent_net_ids.append(actor.net_id)
+
+        for chunk, unit in units.items():
+            if chunk in selected_chunks:
+                continue
+            for actor, keys in unit.entries:
+                self.__mark(actor, keys, 0, sequence)
+
+        if not parts:
+            return sequence, []
+
+        self.__pending[sequence] = sent_net_ids
+        while len(self.__pending) > self.max_pending:
+            del self.__pending[next(iter(self.__pending))]
+
+        return sequence, parts
+
+
+    def ack(self, sequence: int, missing_net_ids: List[int]):
+        """
+        Marks fields sent in the snapshot as received by the client.
+        Args:
+            sequence: Sequence number of the snapshot, whose all records were received.
+            missing_net_ids: Net ids from the snapshot, which the client didn't know. Their fields stay unacknowledged.
+        """
+        net_ids = self.__pending.pop(sequence, None)
+        if net_ids is None:
+            return
+        self.__acked_sequence = max(self.__acked_sequence, sequence)
+
+        missing_net_ids = set(missing_net_ids)
+        for net_id in net_ids:
+            if net_id in missing_net_ids or net_id not in self.__unacked:
+                continue
+
+            fields = self.__unacked[net_id][1]
+            for key in [key for key, key_sequence in fields.items() if key_sequence == sequence]:
+                del fields[key]
+            if not fields:
+                del self.__unacked[net_id]
+
+
+    def defer_unacked(self):
+        """ Marks all fields, which the client may not have, as deferred, so they are sent again in the next snapshot. Called when the client resumes its session. """
+        self.__pending.clear()
+        for _, fields, _ in self.__unacked.values():
+            for key in fields:
+                fields[key] = 0
+
+
+    def forget(self, actor: Actor):
+        """
+        Stops tracking the actor. Called when the actor is registered or destroyed on the client through the reliable channel.
+        Args:
+            actor: Actor to forget.
+        """
+        self.__unacked.pop(actor.net_id, None)
+
+
+    def __needs_resend(self, key_sequence: int, sequence: int) -> bool:
+        # deferred, sent before a snapshot, which was acknowledged, so it was lost, or not acknowledged for too long
+        return key_sequence != sequence and (key_sequence == 0 or key_sequence < self.__acked_sequence or sequence - key_sequence >= self.resend_after)
+
+
+    def __mark(self, actor: Actor, keys: Tuple[str], key_sequence: int, sequence: int):
+        entry = self.__unacked.get(actor.net_id)
+        if entry is None:
+            entry = self.__unacked[actor.net_id] = [actor, {}, sequence]
+        fields = entry[1]
+        for key in keys:
+            fields[key] = key_sequence
+
+
+    @staticmethod
+    def __add_magnitude(unit: SnapshotUnit, actor: Actor, keys):
+        velocity = getattr(actor, "velocity", None)
+        if len(keys) > 1 or "position" not in keys:
+            # half size or material changes are always significant
+            unit.magnitude = max(unit.magnitude, 1.0)
+        elif isinstance(velocity, Vector):
+            unit.magnitude = max(unit.magnitude, velocity.length)
+
+
+
+class ChunkSubscription:
+    """
+    Chunks, which a client sees. It is the square of chunks around the chunk of the player with update distance as its radius.
+    Chunks are (x, y) tuples of integers, which can be used as keys of Level.chunks.
+    Entered and left chunks are computed only when the player changes chunk or update distance, so a player, who stays in the same chunk, costs nothing.
+    """
+
+    def __init__(self):
+        self.__center = None
+        self.__previous_center = None
+        self.__distance = 0
+        self.__chunks = set()
+        self.__bounds = EMPTY_BOUNDS
+
+
+    @property
+    def center(self):
+        """ tuple[int, int] | None - Chunk of the player. None before the first update. """
+        return self.__center
+
+
+    @property
+    def previous_center(self):
+        """ tuple[int, int] | None - Chunk, in which the player was before it entered the current one. """
+        return self.__previous_center
+
+
+    @property
+    def distance(self):
+        """ int - Update distance in chunks. """
+        return self.__distance
+
+
+    @property
+    def chunks(self):
+        """ set[tuple[int, int]] - Chunks, which the client sees. It must not be modified. """
+        return self.__chunks
+
+
+    @property
+    def bounds(self):
+        """ tuple[int, int, int, int] - Bottom left x, y and top right x, y of chunks, whose actors are synced with the client. It covers chunks around the previous center too, so actors the player just left are still updated. """
+        return self.__bounds
+
+
+    def update(self, center: Tuple[int, int], distance: int) -> Tuple[set, set]:
+        """
+        Moves the subscription.
+        Args:
+            center: Chunk of the player.
+            distance: Update distance in chunks.
+        Returns:
+            tuple[set[tuple[int, int]], set[tuple[int, int]]] - Chunks, which the client started to see and chunks, which it doesn't see anymore.
+        """
+        if center == self.__center and distance == self.__distance:
+            return set(), set()
+
+        if self.__center is None:
+            self.__previous_center = center
+        elif center != self.__center:
+            self.__previous_center = self.__center
+        self.__center = center
+        self.__distance = distance
+
+        x, y = center
+        chunks = {(chunk_x, chunk_y) for chunk_x in range(x - distance, x + distance + 1) for chunk_y in range(y - distance, y + distance + 1)}
+        entered = chunks - self.__chunks
+        left = self.__chunks - chunks
+        self.__chunks = chunks
+
+        previous_x, previous_y = self.__previous_center
+        self.__bounds = (min(x, previous_x) - distance - 1, min(y, previous_y) - distance - 1, max(x, previous_x) + distance, max(y, previous_y) + distance)
+        return entered, left
+
+
+    def contains(self, chunk) -> bool:
+        """ Returns True if actors in the chunk are synced with the client. """
+        min_x, min_y, max_x, max_y = self.__bounds
+        return min_x <= chunk[0] <= max_x and min_y <= chunk[1] <= max_y
+
+
+
+class InterestIndex:
+    """
+    Maps chunks of a level to players, whose subscription bounds contain them, so changes in a chunk are sent only to players interested in it.
+    It changes only when a subscription moves, so fanning changes out costs in proportion to the changed chunks and not to players times their view area.
+    """
+
+    def __init__(self):
+        self.__players: Dict[Tuple[int, int], Set[int]] = {}
+
+
+    @property
+    def chunks(self):
+        """ KeysView[tuple[int, int]] - Chunks, to which at least one player is subscribed. """
+        return self.__players.keys()
+
+
+    def get(self, chunk) -> Set[int]:
+        """
+        Args:
+            chunk: Chunk position. Vector or (x, y) tuple.
+        Returns:
+            set[int] - Ids of players subscribed to the chunk. It must not be modified.
+        """
+        return self.__players.get(chunk, _NO_PLAYERS)
+
+
+    def move(self, player_id: int, old_bounds: Tuple[int, int, int, int], new_bounds: Tuple[int, int, int, int]):
+        """
+        Moves subscription of the player. Pass EMPTY_BOUNDS as new bounds to remove the player.
+        Args:
+            player_id: Id of the player.
+            old_bounds: Bounds of the subscription, which were added before, or EMPTY_BOUNDS.
+            new_bounds: Current bounds of the subscription.
+        """
+        for chunk in self.__iter_bounds(new_bounds):
+            if not self.__contains(old_bounds, chunk):
+                self.__players.setdefault(chunk, set()).add(player_id)
+
+        for chunk in self.__iter_bounds(old_bounds):
+            if self.__contains(new_bounds, chunk):
+                continue
+            players = self.__players.get(chunk)
+            if players is None:
+                continue
+            players.discard(player_id)
+            if not players:
+                del self.__players[chunk]
+
+
+    @staticmethod
+    def __iter_bounds(bounds):
+        min_x, min_y, max_x, max_y = bounds
+        return ((x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1))
+
+
+    @staticmethod
+    def __contains(bounds, chunk) -> bool:
+        return bounds[0] <= chunk[0] <= bounds[2] and bounds[1] <= chunk[1] <= bounds[3]
+
+
+_NO_PLAYERS = frozenset()
+
+
+
+class UpdateScheduler:
+    """
+    Decides which snapshot units are sent to a client, so it gets at most byte budget bytes per snapshot.
+    Units close to the player are always sent. The others are ranked by (1 + age) * (1 + magnitude) / (1 + distance),
+    where distance is in chunks, age is number of snapshots the unit waits and magnitude is actor speed or 1 for changes of other fields than position.
+    Deferred units get older, so even the far ones are eventually sent, just at a lower rate.
+    """
+
+    def __init__(self, byte_budget: int = 8 * 1024, full_rate_distance: int = 2):
+        """
+        Args:
+            byte_budget: Maximum number of snapshot bytes sent to each client per snapshot. Units within full rate distance can exceed it.
+            full_rate_distance: Distance in chunks from the player, within which units are sent in every snapshot.
+        """
+        self.byte_budget = byte_budget
+        self.full_rate_distance = full_rate_distance
+
+
+    @property
+    def byte_budget(self):
+        """ int - Maximum number of snapshot bytes sent to each client per snapshot. """
+        return self.__byte_budget
+
+
+    @byte_budget.setter
+    def byte_budget(self, value):
+        if isinstance(value, int) and value > 0:
+            self.__byte_budget = value
+        else:
+            raise TypeError("Byte budget must be a positive integer:", value)
+
+
+    @property
+    def full_rate_distance(self):
+        """ int - Distance in chunks from the player, within which units are sent in every snapshot. """
+        return self.__full_rate_distance
+
+
+    @full_rate_distance.setter
+    def full_rate_distance(self, value):
+        if isinstance(value, int) and value >= 0:
+            self.__full_rate_distance = value
+        else:
+            raise TypeError("Full rate distance must be a non-negative integer:", value)
+
+
+    def select(self, units: List[SnapshotUnit], center: Vector, codec: Codec) -> List[SnapshotUnit]:
+        """
+        Args:
+            units: Units, which could be sent.
+            center: Chunk of the player.
+            codec: Codec of the client. It is used to measure the units.
+        Returns:
+            list[SnapshotUnit] - Units to send now, the most important first.
+        """
+        budget = self.byte_budget
+        selected = []
+        ranked = []
+        for unit in units:
+            distance = max(abs(unit.chunk.x - center.x), abs(unit.chunk.y - center.y))
+            if distance <= self.full_rate_distance:
+                budget -= unit.get_size(codec)
+                selected.append(unit)
+            else:
+                ranked.append(((1 + unit.age) * (1 + unit.magnitude) / (1 + distance), unit))
+
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        for _, unit in ranked:
+            if budget <= 0:
+                break
+            size = unit.get_size(codec)
+            if size <= budget:
+                budget -= size
+                selected.append(unit)
+
+        return selected
@@ -0,0 +1,112 @@
+"""
+Compact registration of terrain. Static actors aligned to the grid, whose names are generated from their position like dirt_12.0_-3.0,
+are sent to clients as tiles of their chunk in register_chunk messages instead of one register_actor record each.
+The message contains a palette of [class name, name prefix] pairs and for each chunk [chunk x, chunk y, tiles],
+where tiles are [cell index, palette index, net id] and cell index is local y * CHUNK_SIZE + local x.
+"""
+
+#?ifdef SERVER
+from .protocol import EncodedMessage
+from engine.components.actors.actor import Actor
+from engine.components.actors.rigidbody import Rigidbody
+#?endif
+from engine.datatypes import *
+from engine.game_math import *
+
+from typing import Iterable, List, Tuple
+
+
+
+def get_tile_prefix(name: str, position: Vector) -> str | None:
+    """
+    Args:
+        name: Name of the actor.
+        position: Position of the actor.
+    Returns:
+        str | None - Part of the name before the position, if the actor is aligned to the grid and its name ends with its position. Otherwise None.
+    """
+    if not position.x.is_integer() or not position.y.is_integer():
+        return None
+    suffix = f"_{position.x}_{position.y}"
+    if len(name) <= len(suffix) or not name.endswith(suffix):
+        return None
+    return name[:-len(suffix)]
+
+
+
+#?ifdef SERVER
+def pack_tiles(records: List[list]) -> Tuple[list | None, List[list]]:
+    """
+    Splits full net sync records of static actors into tiles and records, which can't be sent as tiles.
+    Args:
+        records: Records returned by get_for_full_net_sync.
+    Returns:
+        tuple[list | None, list[list]] - register_chunk data or None if there are no tiles, and the remaining records.
+    """
+    palette = {}
+    chunks = {}
+    rest = []
+    for record in records:
+        class_name, name, position, net_id = record
+        prefix = get_tile_prefix(name, position)
+        if prefix is None:
+            rest.append(record)
+            continue
+
+        chunk = get_chunk_cords(position)
+        cell = int(position.y - chunk.y * CHUNK_SIZE) * CHUNK_SIZE + int(position.x - chunk.x * CHUNK_SIZE)
+        index = palette.setdefault((class_name, prefix), len(palette))
+        key = (int(chunk.x), int(chunk.y))
+        if key not in chunks:
+            chunks[key] = [key[0], key[1], []]
+        chunks[key][2].append([cell, index, net_id])
+
+    if not chunks:
+        return None, rest
+    return [[list(entry) for entry in palette], list(chunks.values())], rest
+
+
+
+class ChunkPayload:
+    """
+    Encoded registration of static actors in a chunk, which is sent to every client, whose view newly covers the chunk.
+    It is valid, while the version of the chunk doesn't change. Rigidbodies move all the time, so they are registered separately.
+    """
+
+    __slots__ = ("version", "actors", "rigidbodies", "messages")
+
+    def __init__(self, version: int, actors: Iterable[Actor]):
+        """
+        Args:
+            version: Version of the chunk returned by Level.get_chunk_version.
+            actors: All actors in the chunk.
+        """
+        self.version = version
+        self.actors = list(actors)
+        self.rigidbodies = [actor for actor in self.actors if isinstance(actor, Rigidbody)]
+
+        tiles, records = pack_tiles([actor.get_for_full_net_sync() for actor in self.actors if not isinstance(actor, Rigidbody)])
+        self.messages = [EncodedMessage("register_actor", record) for record in records]
+        if tiles:
+            self.messages.insert(0, EncodedMessage("register_chunk", tiles))
+#?endif
+
+
+
+#?ifdef CLIENT
+def unpack_tiles(data) -> List[list]:
+    """
+    Args:
+        data: Data of the register_chunk message.
+    Returns:
+        list[list] - Records of the tiles in the same format as get_for_full_net_sync returns, so they are registered like register_actor records.
+    """
+    palette, chunks = data
+    records = []
+    for chunk_x, chunk_y, tiles in chunks:
+        for cell, index, net_id in tiles:
+            class_name, prefix = palette[index]
+            position = Vector(chunk_x * CHUNK_SIZE + cell % CHUNK_SIZE, chunk_y * CHUNK_SIZE + cell // CHUNK_SIZE)
+            records.append([class_name, f"{prefix}_{position.x}_{position.y}", position, net_id])
+    return records
+#?endif
@@ -426,6 +426,7 @@ class KeyPressType(IntEnum):
     TRIGGER = 0
     HOLD = 1
     RELEASE = 2
+    PREDICTED = 3 # like HOLD, but applied for every input command, so the client can predict it
 
 
 
@@ -549,6 +550,7 @@ class Keys(IntEnum):
 PI = math.pi
 GRAVITY = -9.80665
 KINDA_SMALL_NUMBER = 0.001
+MAX_INPUT_DELTA_TIME = 0.05 # longest time step of one input command
 CHUNK_SIZE = 2
 
 
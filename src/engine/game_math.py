@@ -34,16 +34,17 @@ def is_in_rect(bottom_left: Vector, top_right: Vector, point: Vector):
 
 
 
-def is_overlapping_rect(rect1, rect2):
+def is_overlapping_rect(rect1, rect2, margin: float = 0):
     """
     Check if two rectangles are overlapping. Rectangles must be an objects with attributes position and half_size.
     Args:
         rect1: First rectangle.
         rect2: Second rectangle.
+        margin: Added to the half size of the first rectangle, so touching rectangles can be detected as overlapping.
     Returns:
         bool - True if the rectangles are overlapping, False otherwise.
     """
-    return all(d > 0 for d in (
+    return all(d + margin > 0 for d in (
         rect1.position.x + rect1.half_size.x - (rect2.position.x - rect2.half_size.x),
         rect2.position.x + rect2.half_size.x - (rect1.position.x - rect1.half_size.x),
         rect1.position.y + rect1.half_size.y - (rect2.position.y - rect2.half_size.y),
@@ -6,6 +6,7 @@ from engine.datatypes import *
 from engine.components.background import Background, BackgroundLayer
 
 from .blocks import *
+from .movement import MovementHandler
 from .widgets import *
 
 
@@ -152,6 +153,10 @@ class ClientGame(ClientGameBase):
         eng.regisrer_network_command("health", NetworkHandler.set_health)
         eng.regisrer_network_command("hunger", NetworkHandler.set_hunger)
         eng.regisrer_network_command("set_inventory_slot", NetworkHandler.set_inventory_slot)
+
+        eng.register_predicted_key(Keys.W, MovementHandler.key_W)
+        eng.register_predicted_key(Keys.A, MovementHandler.key_A)
+        eng.register_predicted_key(Keys.D, MovementHandler.key_D)
         
         #?ifdef ENGINE
         eng.connect("localhost", 5555)
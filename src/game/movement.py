@@ -0,0 +1,20 @@
+"""
+Movement of the player. It is registered as predicted keys on both server and client, so the client moves its character before the server confirms it.
+"""
+
+
+
+class MovementHandler:
+    @staticmethod
+    def key_W(engine_ref, level_ref, id, delta_time):
+        level_ref.actors[engine_ref.get_player_actor(id)].jump()
+
+
+    @staticmethod
+    def key_A(engine_ref, level_ref, id, delta_time):
+        level_ref.actors[engine_ref.get_player_actor(id)].move_direction = -1
+
+
+    @staticmethod
+    def key_D(engine_ref, level_ref, id, delta_time):
+        level_ref.actors[engine_ref.get_player_actor(id)].move_direction = 1
@@ -1,11 +1,13 @@
 #?attr SERVER
 
 from engine.core.game_base import ServerGameBase
+from engine.core.network import ServerNetwork
 
 from engine.components.level import Level
 from engine.game_math import *
 
 from .blocks import *
+from .movement import MovementHandler
 from .world_generation.world_generation import WorldGeneration
 
 
@@ -17,20 +19,6 @@ class Overworld(Level):
 
 
 class KeyHandler:
-    @staticmethod
-    def key_W(engine_ref, level_ref, id, delta_time):
-        level_ref.actors[engine_ref.get_player_actor(id)].jump()
-
-
-    @staticmethod
-    def key_A(engine_ref, level_ref, id, delta_time):
-        level_ref.actors[engine_ref.get_player_actor(id)].move_direction = -1
-
-
-    @staticmethod
-    def key_D(engine_ref, level_ref, id, delta_time):
-        level_ref.actors[engine_ref.get_player_actor(id)].move_direction = 1
-
     @staticmethod
     def scroll_up(engine_ref, level_ref, id):
         player = level_ref.actors[engine_ref.get_player_actor(id)]
@@ -134,9 +122,10 @@ class KeyHandler:
 
 
 class ServerGame(ServerGameBase):
-    def __init__(self):
+    def __init__(self, network_class: type = ServerNetwork):
         super().__init__()
         self.engine.max_tps = 120
+        self.engine.snapshot_rate = 30
         
         self.engine.register_level(Overworld())
 
@@ -146,9 +135,9 @@ class ServerGame(ServerGameBase):
         
         self.current_base_chunk = Vector(0, 0)
 
-        self.engine.register_key(Keys.W, KeyPressType.HOLD, KeyHandler.key_W)
-        self.engine.register_key(Keys.A, KeyPressType.HOLD, KeyHandler.key_A)
-        self.engine.register_key(Keys.D, KeyPressType.HOLD, KeyHandler.key_D)
+        self.engine.register_key(Keys.W, KeyPressType.PREDICTED, MovementHandler.key_W)
+        self.engine.register_key(Keys.A, KeyPressType.PREDICTED, MovementHandler.key_A)
+        self.engine.register_key(Keys.D, KeyPressType.PREDICTED, MovementHandler.key_D)
         self.engine.register_key(Keys.C, KeyPressType.TRIGGER, KeyHandler.key_C)
         self.engine.register_key(Keys.MOUSE_SCROLL_UP, KeyPressType.TRIGGER, KeyHandler.scroll_up)
         self.engine.register_key(Keys.MOUSE_SCROLL_DOWN, KeyPressType.TRIGGER, KeyHandler.scroll_down)
@@ -170,7 +159,7 @@ class ServerGame(ServerGameBase):
             for y in range(-2, 3):
                 self.world_generator.generate_and_load_chunks(Vector(x, y))
 
-        self.engine.start_network("0.0.0.0", 5555, 10)
+        self.engine.start_network("0.0.0.0", 5555, 10, network_class)
             
 
     def tick(self):
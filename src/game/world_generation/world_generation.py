@@ -15,6 +15,7 @@ class WorldGeneration:
         self.level_ref = level_ref
         self.seed = seed
         self.game_map = set()
+        self.chunk_threads = []
         self.tunnel_generator = TunnelGenerator(self.seed + 1)
         self.cave_seed = self.seed + 2
         self.tree_seed = self.seed + 3
@@ -244,6 +245,15 @@ class WorldGeneration:
             self.game_map.add(chunk)
             chunk_thread = threading.Thread(target=self.load_chunk, args=(chunk,))
             chunk_thread.start()
+            self.chunk_threads = [thread for thread in self.chunk_threads if thread.is_alive()]
+            self.chunk_threads.append(chunk_thread)
+
+
+    def wait_for_chunks(self):
+        """ Blocks until all chunks, which are being generated, are registered in the level. Benchmarks call it before each tick, so chunks appear on the same tick in every run. """
+        threads, self.chunk_threads = self.chunk_threads, []
+        for chunk_thread in threads:
+            chunk_thread.join()
 
 
     def load_chunk(self, chunk):